@@ -0,0 +1,208 @@
+from abc import ABC, abstractmethod
+
+from live_capable import LiveCapable, AssetInfoResult, BalancesResult
+from order_capable import Broker, MarketOrderable, LimitOrderable, OrderCancelable, DryRunnable
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import typing
+
+###
+# asyncio counterparts of order_capable and live_capable - same arguments, same results
+###
+
+class AsyncMarketOrderable(ABC):
+    @abstractmethod
+    async def place_market_order(self, ticker:str, action:str, contracts:float, tracking_id = None) -> dict:
+        pass
+
+    @abstractmethod
+    async def standardize_market_order(self, market_order_result: dict) -> dict:
+        pass
+
+class AsyncLimitOrderable(ABC):
+    @abstractmethod
+    async def place_limit_order(self, ticker:str, action:str, contracts:float, limit:float, broker_params: dict={}) -> dict:
+        pass
+
+    @abstractmethod
+    def standardize_limit_order(self, limit_order_result: dict) -> dict:
+        pass
+
+class AsyncOrderCancelable(ABC):
+    @abstractmethod
+    async def cancel_order(self, ticker: str, order_id: str) -> dict:
+        pass
+
+class AsyncDryRunnable(ABC):
+    @abstractmethod
+    async def place_market_order_test(self, ticker:str, action:str, contracts:float, broker_params:dict = {}, tracking_id = None) -> dict:
+        pass
+
+    @abstractmethod
+    async def place_limit_order_test(self, ticker:str, action:str, contracts:float, limit:float, broker_params: dict={}) -> dict:
+        pass
+
+    @abstractmethod
+    async def cancel_order_test(self, ticker: str, order_id: str) -> dict:
+        pass
+
+class AsyncLiveCapable(ABC):
+    @abstractmethod
+    async def get_current_prices(self, symbols: list) -> dict:
+        pass
+
+    @abstractmethod
+    async def get_order(self, ticker: str, order_id: str) -> dict:
+        pass
+
+    @abstractmethod
+    async def get_asset_info(self, symbols:list) -> AssetInfoResult:
+        pass
+
+    @abstractmethod
+    async def get_balances(self) -> BalancesResult:
+        pass
+
+class EventLoopThread:
+    """ An event loop running on its own daemon thread, so sync code can hand it coroutines.
+    Everything submitted shares the loop - and with it the connection pool of an async broker. """
+
+    def __init__(self, name:str = "broker-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine:typing.Coroutine) -> concurrent.futures.Future:
+        if threading.current_thread() is self._thread:
+            ### blocking on the loop from inside it would never return
+            raise RuntimeError("cannot wait on the event loop from its own thread, await instead")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine:typing.Coroutine) -> typing.Any:
+        return self.submit(coroutine=coroutine).result()
+
+_shared_loop:EventLoopThread = None
+_shared_lock = threading.Lock()
+
+def shared_loop() -> EventLoopThread:
+    """ the loop every SyncBrokerAdapter runs on unless given its own - started on first use, kept for the life of the process """
+    global _shared_loop
+    with _shared_lock:
+        if _shared_loop is None:
+            logging.info("starting the broker event loop")
+            _shared_loop = EventLoopThread()
+        return _shared_loop
+
+class SyncBrokerAdapter(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCapable, DryRunnable):
+    """ Makes an async broker usable by the existing strategies - each call blocks its thread until the coroutine
+    finished on the event loop. Calls from many threads share the loop. run_all sends many calls at once. """
+
+    def __init__(self, broker:Broker, loop:EventLoopThread = None):
+        if broker is None:
+            raise ValueError("broker is required")
+        self.broker = broker
+        self.loop = shared_loop() if loop is None else loop
+
+    def run_all(self, coroutines:list[typing.Coroutine]) -> list:
+        """ runs coroutines of the async broker concurrently, results in the order given - a call that failed has its exception in its place """
+        async def gather() -> list:
+            return await asyncio.gather(*coroutines, return_exceptions=True)
+        return self.loop.run(gather())
+
+    def get_name(self) -> str:
+        return self.broker.get_name()
+
+    def place_market_order(self, ticker:str, action:str, contracts:float, tracking_id = None) -> dict:
+        return self.loop.run(self.broker.place_market_order(ticker=ticker, action=action, contracts=contracts, tracking_id=tracking_id))
+
+    def standardize_market_order(self, market_order_result: dict) -> dict:
+        return self.loop.run(self.broker.standardize_market_order(market_order_result=market_order_result))
+
+    def place_limit_order(self, ticker:str, action:str, contracts:float, limit:float, broker_params: dict={}) -> dict:
+        return self.loop.run(self.broker.place_limit_order(ticker=ticker, action=action, contracts=contracts, limit=limit, broker_params=broker_params))
+
+    def standardize_limit_order(self, limit_order_result: dict) -> dict:
+        return self.broker.standardize_limit_order(limit_order_result=limit_order_result)
+
+    def cancel_order(self, ticker: str, order_id: str) -> dict:
+        return self.loop.run(self.broker.cancel_order(ticker=ticker, order_id=order_id))
+
+    def place_market_order_test(self, ticker:str, action:str, contracts:float, broker_params:dict = {}, tracking_id = None) -> dict:
+        return self.loop.run(self.broker.place_market_order_test(ticker=ticker, action=action, contracts=contracts, broker_params=broker_params, tracking_id=tracking_id))
+
+    def place_limit_order_test(self, ticker:str, action:str, contracts:float, limit:float, broker_params: dict={}) -> dict:
+        return self.loop.run(self.broker.place_limit_order_test(ticker=ticker, action=action, contracts=contracts, limit=limit, broker_params=broker_params))
+
+    def cancel_order_test(self, ticker: str, order_id: str) -> dict:
+        return self.loop.run(self.broker.cancel_order_test(ticker=ticker, order_id=order_id))
+
+    def get_current_prices(self, symbols: list) -> dict:
+        return self.loop.run(self.broker.get_current_prices(symbols=symbols))
+
+    def get_order(self, ticker: str, order_id: str) -> dict:
+        return self.loop.run(self.broker.get_order(ticker=ticker, order_id=order_id))
+
+    def get_asset_info(self, symbols:list) -> AssetInfoResult:
+        return self.loop.run(self.broker.get_asset_info(symbols=symbols))
+
+    def get_balances(self) -> BalancesResult:
+        return self.loop.run(self.broker.get_balances())
+
+if __name__ == "__main__":
+    import unittest
+
+    class _Broker(Broker, AsyncOrderCancelable, AsyncLiveCapable):
+        def __init__(self):
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+        def get_name(self) -> str:
+            return "test"
+
+        async def cancel_order(self, ticker: str, order_id: str) -> dict:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0.01)
+            self.in_flight -= 1
+            if order_id == "bad":
+                raise ValueError(order_id)
+            return { "order_id": order_id }
+
+        async def get_current_prices(self, symbols: list) -> dict:
+            return { symbol: 1.0 for symbol in symbols }
+
+        async def get_order(self, ticker: str, order_id: str) -> dict:
+            pass
+
+        async def get_asset_info(self, symbols:list) -> AssetInfoResult:
+            pass
+
+        async def get_balances(self) -> BalancesResult:
+            pass
+
+    class Test(unittest.TestCase):
+        def test_sync_calls(self):
+            adapter = SyncBrokerAdapter(broker=_Broker())
+            self.assertIsInstance(adapter, LiveCapable)
+            self.assertEqual(adapter.get_current_prices(symbols=[ "BTCUSDT" ]), { "BTCUSDT": 1.0 })
+            self.assertEqual(adapter.cancel_order(ticker="BTCUSDT", order_id="1"), { "order_id": "1" })
+
+        def test_run_all_is_concurrent(self):
+            broker = _Broker()
+            adapter = SyncBrokerAdapter(broker=broker)
+            results = adapter.run_all([ broker.cancel_order(ticker="BTCUSDT", order_id=id) for id in [ "1", "bad", "3" ] ])
+            self.assertEqual(results[0], { "order_id": "1" })
+            self.assertIsInstance(results[1], ValueError)
+            self.assertEqual(broker.max_in_flight, 3)
+
+        def test_no_blocking_on_own_loop(self):
+            loop = EventLoopThread()
+            async def nested():
+                return loop.submit(asyncio.sleep(0))
+            with self.assertRaises(RuntimeError):
+                loop.run(nested())
+
+    unittest.main()
@@ -2,10 +2,11 @@
 from broker_exceptions import OversoldError, InvalidQuantityScale, ApiError
 from order_strategy import OrderStrategy, HandleResult
 from order_capable import Broker, MarketOrderable, OrderCancelable, DryRunnable, StopMarketOrderable
-from live_capable import LiveCapable, BalancesResult, AssetBalance
+from live_capable import LiveCapable, BalancesResult, AssetBalance, SymbolInfo
 from merchant_order import Order, MerchantParams, SubOrder, SubOrders, Metadata, Projections, Results
 from merchant_signal import MerchantSignal
 from merchant_keys import keys
+from security import order_digest
 from transactions import calculate_stop_loss, calculate_take_profit, calculate_pnl, Transaction, TransactionAction
 from utils import unix_timestamp_ms, pause_thread, null_or_empty
 
@@ -26,6 +27,9 @@ class BracketStrategy(OrderStrategy):
     def handle_price_change(self, broker:Broker, order:Order, merchant_params:dict = {}) -> HandleResult:
         return HandleResult(target_order=order, complete=False)
 
+    def handles_price_change(self) -> bool:
+        return False
+
     def place_orders(self, broker:Broker, signal: MerchantSignal, merchant_state:dict, merchant_params:dict = {}) -> Order:
         if broker is None:
             raise ValueError("broker is required")
@@ -181,6 +185,7 @@ class BracketStrategy(OrderStrategy):
             complete=False,
             additional_data={}
         )
+        new_order.metadata.set_digest(digest=order_digest(order=new_order))
         return new_order
     
     def handle_take_profit(self, broker:Broker, order:Order, merchant_params:dict = {}) -> HandleResult:
@@ -301,10 +306,22 @@ class BracketStrategy(OrderStrategy):
         result:BalancesResult = broker.get_balances()
         balances:dict[str, AssetBalance] = result.balances
         remaining_quantity = None
-        for asset_name in balances.keys():
-            if ticker.startswith(asset_name):
-                remaining_quantity = balances.get(asset_name).available
-                break
+        try:
+            symbol_info:SymbolInfo = broker.get_asset_info(symbols=[ticker]).symbols.get(ticker)
+        except (KeyError, ApiError) as e:
+            ### the sell retry must not fail on the asset lookup
+            logging.warning(f"failed to get the asset info of {ticker}, matching its balance by prefix - {e}")
+            symbol_info = None
+        if symbol_info is not None:
+            ### exact - a prefix match confuses assets like ETH and ETHFI
+            if symbol_info.base_asset in balances:
+                remaining_quantity = balances.get(symbol_info.base_asset).available
+        else:
+            ### the broker does not say what the base asset is
+            for asset_name in balances.keys():
+                if ticker.startswith(asset_name):
+                    remaining_quantity = balances.get(asset_name).available
+                    break
         if remaining_quantity is None:
             raise ValueError(f"Expected  ticker {ticker} to be in balances: {balances}")
         return remaining_quantity
@@ -1,12 +1,22 @@
+from async_capable import SyncBrokerAdapter
 from order_capable import Broker, InvalidBroker
 from mexc import MEXC_API
+from mexc_async import AsyncMEXC_API
 from security_types import SecurityTypes, security_type_from_str, valid_types
 from utils import null_or_empty
 
+import os
+
+class cfg:
+    @staticmethod
+    def MEXC_ASYNC() -> bool:
+        ### MEXC on the aiohttp client, one event loop serving all worker threads - needs aiohttp
+        return os.environ.get("BROKER_MEXC_ASYNC", "false").lower() == "true"
+
 class BrokerRepository:
     def __init__(self):
         self.__repository = {
-            SecurityTypes.crypto: MEXC_API(),
+            SecurityTypes.crypto: SyncBrokerAdapter(broker=AsyncMEXC_API()) if cfg.MEXC_ASYNC() else MEXC_API(),
             SecurityTypes.forex: InvalidBroker(),
             SecurityTypes.stocks: InvalidBroker(),
         }
@@ -0,0 +1,204 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import asyncio
+import json
+import logging
+import os
+import requests
+import threading
+import typing
+
+def _float_env(name:str, default:str) -> float:
+    value:str = os.environ.get(name, default)
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {value}")
+    if value <= 0.0:
+        raise ValueError(f"{name} must be positive, got {value}")
+    return value
+
+class cfg:
+    @staticmethod
+    def POOL_SIZE() -> int:
+        ### connections kept alive per host - at least MERCHANT_CHECK_POSITIONS_WORKERS, or workers wait on each other
+        pool_size:str = os.environ.get("BROKER_HTTP_POOL_SIZE", "10")
+        if not pool_size.isnumeric() or int(pool_size) < 1:
+            raise ValueError(f"BROKER_HTTP_POOL_SIZE must be a positive integer, got {pool_size}")
+        return int(pool_size)
+
+    @staticmethod
+    def GET_RETRIES() -> int:
+        ### only GETs are retried - an order or cancel that timed out may still have gone through
+        retries:str = os.environ.get("BROKER_HTTP_GET_RETRIES", "2")
+        if not retries.isnumeric():
+            raise ValueError(f"BROKER_HTTP_GET_RETRIES must be an integer, got {retries}")
+        return int(retries)
+
+    @staticmethod
+    def CONNECT_TIMEOUT_SECS() -> float:
+        return _float_env("BROKER_HTTP_CONNECT_TIMEOUT_SECS", "3.05")
+
+    @staticmethod
+    def MARKET_DATA_TIMEOUT_SECS() -> float:
+        return _float_env("BROKER_HTTP_MARKET_DATA_TIMEOUT_SECS", "5")
+
+    @staticmethod
+    def ACCOUNT_TIMEOUT_SECS() -> float:
+        return _float_env("BROKER_HTTP_ACCOUNT_TIMEOUT_SECS", "10")
+
+    @staticmethod
+    def ORDER_TIMEOUT_SECS() -> float:
+        ### generous - giving up on an order that is being placed leaves its outcome unknown
+        return _float_env("BROKER_HTTP_ORDER_TIMEOUT_SECS", "20")
+
+class consts:
+    @staticmethod
+    def RETRY_BACKOFF_SECS() -> float:
+        ### retries of signed requests have to land within the receive window
+        return 0.25
+
+    @staticmethod
+    def RETRY_STATUSES() -> list[int]:
+        return [ 429, 500, 502, 503, 504 ]
+
+class timeouts:
+    """ (connect, read) timeouts by kind of endpoint """
+    @staticmethod
+    def MARKET_DATA() -> tuple[float, float]:
+        return (cfg.CONNECT_TIMEOUT_SECS(), cfg.MARKET_DATA_TIMEOUT_SECS())
+
+    @staticmethod
+    def ACCOUNT() -> tuple[float, float]:
+        return (cfg.CONNECT_TIMEOUT_SECS(), cfg.ACCOUNT_TIMEOUT_SECS())
+
+    @staticmethod
+    def ORDER() -> tuple[float, float]:
+        return (cfg.CONNECT_TIMEOUT_SECS(), cfg.ORDER_TIMEOUT_SECS())
+
+class BrokerTransport:
+    """ One requests.Session with a keep-alive connection pool, so calls to a broker reuse their TCP and TLS
+    connections instead of opening new ones. GETs are retried on connection errors and on 429 / 5xx responses,
+    nothing else is. Every call needs a timeout, see timeouts. Safe to share between threads. """
+
+    def __init__(self, pool_size:int = None, get_retries:int = None):
+        pool_size = cfg.POOL_SIZE() if pool_size is None else pool_size
+        get_retries = cfg.GET_RETRIES() if get_retries is None else get_retries
+        retry = Retry(
+            total=get_retries,
+            backoff_factor=consts.RETRY_BACKOFF_SECS(),
+            status_forcelist=consts.RETRY_STATUSES(),
+            allowed_methods=[ "GET" ],
+            raise_on_status=False,
+            respect_retry_after_header=True
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry, pool_block=False)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url:str, timeout:tuple[float, float], headers:dict = None, params:dict = None) -> requests.Response:
+        return self.session.get(url, headers=headers, params=params, timeout=timeout)
+
+    def post(self, url:str, timeout:tuple[float, float], headers:dict = None, params:dict = None) -> requests.Response:
+        return self.session.post(url, headers=headers, params=params, timeout=timeout)
+
+    def delete(self, url:str, timeout:tuple[float, float], headers:dict = None, params:dict = None) -> requests.Response:
+        return self.session.delete(url, headers=headers, params=params, timeout=timeout)
+
+    def close(self) -> None:
+        self.session.close()
+
+_shared_transports:dict[str, BrokerTransport] = {}
+_shared_lock = threading.Lock()
+
+def shared_transport(broker_name:str) -> BrokerTransport:
+    """ the transport every instance of a broker uses unless given its own - kept for the life of the process,
+    so warm function invocations skip the handshakes too """
+    with _shared_lock:
+        if broker_name not in _shared_transports:
+            logging.info(f"opening the {broker_name} broker transport")
+            _shared_transports[broker_name] = BrokerTransport()
+        return _shared_transports[broker_name]
+
+class AsyncResponse:
+    """ what the async transport returns - shaped like the part of requests.Response the brokers use """
+    def __init__(self, status_code:int, text:str):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self) -> typing.Any:
+        return json.loads(self.text)
+
+class AsyncBrokerTransport:
+    """ The asyncio counterpart of BrokerTransport - one aiohttp session and connection pool, with the same
+    retry policy. The session belongs to the event loop it is first used on, so a transport must stay on one loop.
+    aiohttp is only needed once a request is made. """
+
+    def __init__(self, pool_size:int = None, get_retries:int = None):
+        self._pool_size = cfg.POOL_SIZE() if pool_size is None else pool_size
+        self._get_retries = cfg.GET_RETRIES() if get_retries is None else get_retries
+        self._session = None
+
+    def _get_session(self):
+        import aiohttp
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=self._pool_size))
+        return self._session
+
+    async def request(self, method:str, url:str, timeout:tuple[float, float], headers:dict = None, params:dict = None) -> AsyncResponse:
+        import aiohttp
+        session = self._get_session()
+        attempts = 1 + (self._get_retries if method == "GET" else 0)
+        client_timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                async with session.request(method, url, headers=headers, params=params, timeout=client_timeout) as response:
+                    text = await response.text()
+                    if last_attempt or response.status not in consts.RETRY_STATUSES():
+                        return AsyncResponse(status_code=response.status, text=text)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last_attempt:
+                    raise
+            await asyncio.sleep(consts.RETRY_BACKOFF_SECS() * (2 ** attempt))
+
+    async def get(self, url:str, timeout:tuple[float, float], headers:dict = None, params:dict = None) -> AsyncResponse:
+        return await self.request("GET", url, timeout=timeout, headers=headers, params=params)
+
+    async def post(self, url:str, timeout:tuple[float, float], headers:dict = None, params:dict = None) -> AsyncResponse:
+        return await self.request("POST", url, timeout=timeout, headers=headers, params=params)
+
+    async def delete(self, url:str, timeout:tuple[float, float], headers:dict = None, params:dict = None) -> AsyncResponse:
+        return await self.request("DELETE", url, timeout=timeout, headers=headers, params=params)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    class Test(unittest.TestCase):
+        def test_only_gets_are_retried(self):
+            transport = BrokerTransport(pool_size=4, get_retries=3)
+            adapter = transport.session.get_adapter("https://api.mexc.com")
+            self.assertEqual(adapter.max_retries.total, 3)
+            self.assertTrue(adapter.max_retries.is_retry("GET", 503))
+            self.assertFalse(adapter.max_retries.is_retry("POST", 503))
+            self.assertFalse(adapter.max_retries.is_retry("DELETE", 503))
+            self.assertEqual(adapter._pool_maxsize, 4)
+
+        def test_timeouts_are_passed(self):
+            transport = BrokerTransport()
+            transport.session = unittest.mock.Mock()
+            transport.get("https://api.mexc.com/api/v3/time", timeout=timeouts.MARKET_DATA())
+            self.assertEqual(transport.session.get.call_args.kwargs.get("timeout"), (3.05, 5.0))
+
+        def test_shared_per_broker(self):
+            self.assertIs(shared_transport("test"), shared_transport("test"))
+            self.assertIsNot(shared_transport("test"), shared_transport("other"))
+
+    unittest.main()
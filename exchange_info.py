@@ -0,0 +1,216 @@
+from live_capable import SymbolInfo
+from table_batch import TableWriteBatch
+from utils import unix_timestamp_secs
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.data.tables import TableClient
+
+import json
+import logging
+import os
+import threading
+import typing
+
+class cfg:
+    @staticmethod
+    def TTL_SECS() -> int:
+        ### precisions and filters rarely change - a symbol listed since is looked up at most once per MIN_REFRESH_SECS
+        ttl:str = os.environ.get("BROKER_EXCHANGE_INFO_TTL_SECS", "21600")
+        if not ttl.isnumeric():
+            raise ValueError(f"BROKER_EXCHANGE_INFO_TTL_SECS must be an integer, got {ttl}")
+        return int(ttl)
+
+    @staticmethod
+    def TABLE_NAME() -> str:
+        return "brokerexchangeinfo"
+
+    @staticmethod
+    def CONNECTION_STRING() -> str:
+        ### without storage the exchange info is only kept in memory
+        return os.environ.get("storageAccountConnectionString")
+
+class consts:
+    @staticmethod
+    def LOADED_ROW_KEY() -> str:
+        return "__loaded__"
+
+    @staticmethod
+    def MIN_REFRESH_SECS() -> int:
+        return 60
+
+class xkeys:
+    """ properties of a symbol entity - PartitionKey is the broker name, RowKey the symbol """
+    @staticmethod
+    def BASE_ASSET() -> str:
+        return "base_asset"
+
+    @staticmethod
+    def QUOTE_ASSET() -> str:
+        return "quote_asset"
+
+    @staticmethod
+    def BASE_SCALE() -> str:
+        return "base_scale"
+
+    @staticmethod
+    def FILTERS() -> str:
+        return "filters"
+
+    @staticmethod
+    def LOADED_AT() -> str:
+        return "loaded_at"
+
+class ExchangeInfoStore:
+    """ The last exchange info download of a broker in table storage, so a cold process starts from it instead of the broker """
+
+    def __init__(self, table_client:TableClient, broker_name:str):
+        if table_client is None:
+            raise ValueError("table_client is required")
+        self.table_client = table_client
+        self.broker_name = broker_name
+
+    def load(self) -> tuple[int, dict[str, SymbolInfo]]:
+        """ (when it was downloaded, symbol -> info), (None, {}) if nothing is stored """
+        try:
+            entities = list(self.table_client.query_entities("PartitionKey eq @broker", parameters={ "broker": self.broker_name }))
+        except ResourceNotFoundError:
+            return None, {}
+        loaded_at = None
+        symbols = {}
+        for entity in entities:
+            if entity.get("RowKey") == consts.LOADED_ROW_KEY():
+                loaded_at = entity.get(xkeys.LOADED_AT())
+                continue
+            symbols[entity.get("RowKey")] = SymbolInfo(
+                symbol=entity.get("RowKey"),
+                base_asset=entity.get(xkeys.BASE_ASSET()),
+                quote_asset=entity.get(xkeys.QUOTE_ASSET()),
+                base_scale=entity.get(xkeys.BASE_SCALE()),
+                filters=json.loads(entity.get(xkeys.FILTERS(), "[]"))
+            )
+        return loaded_at, symbols
+
+    def save(self, loaded_at:int, symbols:dict[str, SymbolInfo]) -> None:
+        try:
+            self.table_client.create_table()
+        except ResourceExistsError:
+            pass
+        batch = TableWriteBatch(table_client=self.table_client)
+        for info in symbols.values():
+            batch.upsert(entity={
+                "PartitionKey": self.broker_name,
+                "RowKey": info.symbol,
+                xkeys.BASE_ASSET(): info.base_asset,
+                xkeys.QUOTE_ASSET(): info.quote_asset,
+                xkeys.BASE_SCALE(): info.base_scale,
+                xkeys.FILTERS(): json.dumps(info.filters)
+            })
+        ### written last, so a download that was cut short is not taken as complete
+        batch.flush()
+        self.table_client.upsert_entity(entity={ "PartitionKey": self.broker_name, "RowKey": consts.LOADED_ROW_KEY(), xkeys.LOADED_AT(): loaded_at })
+
+def store_for(broker_name:str) -> ExchangeInfoStore:
+    """ the store of broker_name in the function's storage account, None without one """
+    connection_string = cfg.CONNECTION_STRING()
+    if connection_string is None:
+        return None
+    return ExchangeInfoStore(
+        table_client=TableClient.from_connection_string(connection_string, table_name=cfg.TABLE_NAME()),
+        broker_name=broker_name
+    )
+
+class ExchangeInfoCache:
+    """ Every symbol of a broker, downloaded in one call and kept in memory for BROKER_EXCHANGE_INFO_TTL_SECS.
+    A process without a fresh copy reads the one in store before downloading. Safe to share between threads. """
+
+    def __init__(self, fetch_fn:typing.Callable[[], dict[str, SymbolInfo]], store:ExchangeInfoStore = None, ttl_secs:int = None):
+        if fetch_fn is None:
+            raise ValueError("fetch_fn is required")
+        self._fetch_fn = fetch_fn
+        self._store = store
+        self._ttl_secs = ttl_secs
+        self._symbols:dict[str, SymbolInfo] = {}
+        self._loaded_at:int = None
+        self._lock = threading.Lock()
+
+    def ttl_secs(self) -> int:
+        return cfg.TTL_SECS() if self._ttl_secs is None else self._ttl_secs
+
+    def _is_fresh(self, loaded_at:int, max_age:int) -> bool:
+        return loaded_at is not None and unix_timestamp_secs() - loaded_at < max_age
+
+    def _refresh(self) -> None:
+        ### called with the lock held
+        if self._is_fresh(loaded_at=self._loaded_at, max_age=self.ttl_secs()):
+            return
+        if self._store is not None:
+            try:
+                loaded_at, symbols = self._store.load()
+                if self._is_fresh(loaded_at=loaded_at, max_age=self.ttl_secs()):
+                    self._loaded_at, self._symbols = loaded_at, symbols
+                    return
+            except Exception as e:
+                logging.warning(f"failed to read the stored exchange info, downloading it - {e}")
+        self._download()
+
+    def _download(self) -> None:
+        symbols = self._fetch_fn()
+        self._loaded_at, self._symbols = unix_timestamp_secs(), symbols
+        logging.info(f"downloaded the exchange info of {len(symbols)} symbols")
+        if self._store is not None:
+            try:
+                self._store.save(loaded_at=self._loaded_at, symbols=symbols)
+            except Exception as e:
+                logging.warning(f"failed to store the exchange info - {e}")
+
+    def get(self, symbols:list[str]) -> dict[str, SymbolInfo]:
+        """ symbol -> info of every symbol asked for, KeyError if the broker does not list one """
+        if symbols is None:
+            raise ValueError("symbols is required")
+        with self._lock:
+            self._refresh()
+            missing = [ symbol for symbol in symbols if symbol not in self._symbols ]
+            if len(missing) != 0 and not self._is_fresh(loaded_at=self._loaded_at, max_age=consts.MIN_REFRESH_SECS()):
+                ### possibly listed since the last download
+                self._download()
+                missing = [ symbol for symbol in symbols if symbol not in self._symbols ]
+            if len(missing) != 0:
+                raise KeyError(f"unknown symbols {missing}")
+            return { symbol: self._symbols[symbol] for symbol in symbols }
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    def _symbols(*names) -> dict[str, SymbolInfo]:
+        return { name: SymbolInfo(symbol=name, base_asset=name[:-4], quote_asset="USDT", base_scale=0.01) for name in names }
+
+    class Test(unittest.TestCase):
+        def test_bulk_load_once(self):
+            fetch_fn = unittest.mock.Mock(return_value=_symbols("BTCUSDT", "ETHUSDT"))
+            cache = ExchangeInfoCache(fetch_fn=fetch_fn, ttl_secs=60)
+            self.assertEqual(cache.get(symbols=[ "BTCUSDT", "ETHUSDT" ])["ETHUSDT"].base_asset, "ETH")
+            self.assertEqual(cache.get(symbols=[ "BTCUSDT" ])["BTCUSDT"].base_scale, 0.01)
+            self.assertEqual(fetch_fn.call_count, 1)
+            ### just downloaded - an unknown symbol does not trigger another download
+            with self.assertRaises(KeyError):
+                cache.get(symbols=[ "XYZUSDT" ])
+            self.assertEqual(fetch_fn.call_count, 1)
+
+        def test_starts_from_fresh_store(self):
+            store = unittest.mock.Mock()
+            store.load.return_value = (unix_timestamp_secs() - 10, _symbols("BTCUSDT"))
+            fetch_fn = unittest.mock.Mock()
+            cache = ExchangeInfoCache(fetch_fn=fetch_fn, store=store, ttl_secs=60)
+            self.assertIn("BTCUSDT", cache.get(symbols=[ "BTCUSDT" ]))
+            fetch_fn.assert_not_called()
+
+        def test_stale_store_is_refreshed(self):
+            store = unittest.mock.Mock()
+            store.load.return_value = (unix_timestamp_secs() - 120, _symbols("BTCUSDT"))
+            fetch_fn = unittest.mock.Mock(return_value=_symbols("BTCUSDT", "NEWUSDT"))
+            cache = ExchangeInfoCache(fetch_fn=fetch_fn, store=store, ttl_secs=60)
+            self.assertIn("NEWUSDT", cache.get(symbols=[ "NEWUSDT" ]))
+            store.save.assert_called_once()
+
+    unittest.main()
@@ -0,0 +1,172 @@
+from utils import unix_timestamp_ms, pause_thread
+
+import asyncio
+import logging
+import os
+import typing
+
+class cfg:
+    @staticmethod
+    def MAX_WAIT_MS() -> int:
+        ### how long a market order may take to show up as filled before its price is taken from the price snapshot
+        max_wait:str = os.environ.get("BROKER_FILL_MAX_WAIT_MS", "2000")
+        if not max_wait.isnumeric():
+            raise ValueError(f"BROKER_FILL_MAX_WAIT_MS must be an integer, got {max_wait}")
+        return int(max_wait)
+
+class consts:
+    @staticmethod
+    def POLL_INTERVAL_SECS() -> float:
+        return 0.25
+
+class sources:
+    @staticmethod
+    def ORDER() -> str:
+        return "order"
+
+    @staticmethod
+    def TRADES() -> str:
+        return "trades"
+
+    @staticmethod
+    def SNAPSHOT() -> str:
+        return "snapshot"
+
+class Fill:
+    def __init__(self, contracts:float, quote_amount:float, source:str):
+        self.contracts = contracts
+        self.quote_amount = quote_amount
+        self.source = source
+
+    def price(self) -> float:
+        """ the average price the order was filled at """
+        return self.quote_amount / self.contracts
+
+def fill_from_trades(trades:list[tuple[float, float]]) -> Fill:
+    """ the fill of an order from its (quantity, quote quantity) trades, None if there are none yet """
+    contracts = sum([ trade[0] for trade in trades ])
+    quote_amount = sum([ trade[1] for trade in trades ])
+    if contracts <= 0.0 or quote_amount <= 0.0:
+        return None
+    return Fill(contracts=contracts, quote_amount=quote_amount, source=sources.TRADES())
+
+class FillResolver:
+    """ The average price a market order was actually filled at - its quote amount over its executed quantity.
+    Asks the order itself first, then its trades, for up to BROKER_FILL_MAX_WAIT_MS. Only if neither knows by
+    then is the price taken from the price snapshot, with the quantity that was ordered.
+    order_fill_fn and trade_fill_fn take (ticker, broker order id) and return None while the fill is unknown. """
+
+    def __init__(self,
+                 order_fill_fn:typing.Callable[[str, str], Fill],
+                 snapshot_price_fn:typing.Callable[[str], float],
+                 trade_fill_fn:typing.Callable[[str, str], Fill] = None,
+                 max_wait_ms:int = None):
+        if order_fill_fn is None:
+            raise ValueError("order_fill_fn is required")
+        if snapshot_price_fn is None:
+            raise ValueError("snapshot_price_fn is required")
+        self._order_fill_fn = order_fill_fn
+        self._trade_fill_fn = trade_fill_fn
+        self._snapshot_price_fn = snapshot_price_fn
+        self._max_wait_ms = max_wait_ms
+
+    def max_wait_ms(self) -> int:
+        return cfg.MAX_WAIT_MS() if self._max_wait_ms is None else self._max_wait_ms
+
+    def _try(self, fill_fn:typing.Callable[[str, str], Fill], ticker:str, broker_order_id:str) -> Fill:
+        try:
+            return fill_fn(ticker, broker_order_id)
+        except Exception as e:
+            logging.warning(f"failed to look up the fill of {broker_order_id} for {ticker} - {e}")
+            return None
+
+    def resolve(self, ticker:str, broker_order_id:str, ordered_contracts:float) -> Fill:
+        deadline_ms = unix_timestamp_ms() + self.max_wait_ms()
+        while True:
+            fill = self._try(fill_fn=self._order_fill_fn, ticker=ticker, broker_order_id=broker_order_id)
+            if fill is None and self._trade_fill_fn is not None:
+                fill = self._try(fill_fn=self._trade_fill_fn, ticker=ticker, broker_order_id=broker_order_id)
+            if fill is not None:
+                return fill
+            if unix_timestamp_ms() + consts.POLL_INTERVAL_SECS() * 1000 > deadline_ms:
+                break
+            pause_thread(seconds=consts.POLL_INTERVAL_SECS())
+        price = self._snapshot_price_fn(ticker)
+        if price is None:
+            raise ValueError(f"no fill and no price found for {broker_order_id} of {ticker}")
+        logging.warning(f"fill of {broker_order_id} for {ticker} unknown after {self.max_wait_ms()}ms, using the snapshot price {price}")
+        return Fill(contracts=ordered_contracts, quote_amount=price * ordered_contracts, source=sources.SNAPSHOT())
+
+class AsyncFillResolver(FillResolver):
+    """ FillResolver for async brokers - the same lookups as coroutines, waiting without holding a thread """
+
+    async def _try_async(self, fill_fn:typing.Callable[[str, str], typing.Awaitable[Fill]], ticker:str, broker_order_id:str) -> Fill:
+        try:
+            return await fill_fn(ticker, broker_order_id)
+        except Exception as e:
+            logging.warning(f"failed to look up the fill of {broker_order_id} for {ticker} - {e}")
+            return None
+
+    async def resolve_async(self, ticker:str, broker_order_id:str, ordered_contracts:float) -> Fill:
+        deadline_ms = unix_timestamp_ms() + self.max_wait_ms()
+        while True:
+            fill = await self._try_async(fill_fn=self._order_fill_fn, ticker=ticker, broker_order_id=broker_order_id)
+            if fill is None and self._trade_fill_fn is not None:
+                fill = await self._try_async(fill_fn=self._trade_fill_fn, ticker=ticker, broker_order_id=broker_order_id)
+            if fill is not None:
+                return fill
+            if unix_timestamp_ms() + consts.POLL_INTERVAL_SECS() * 1000 > deadline_ms:
+                break
+            await asyncio.sleep(consts.POLL_INTERVAL_SECS())
+        price = await self._snapshot_price_fn(ticker)
+        if price is None:
+            raise ValueError(f"no fill and no price found for {broker_order_id} of {ticker}")
+        logging.warning(f"fill of {broker_order_id} for {ticker} unknown after {self.max_wait_ms()}ms, using the snapshot price {price}")
+        return Fill(contracts=ordered_contracts, quote_amount=price * ordered_contracts, source=sources.SNAPSHOT())
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    class Test(unittest.TestCase):
+        def test_order_fill_is_averaged(self):
+            snapshot_price_fn = unittest.mock.Mock()
+            resolver = FillResolver(
+                order_fill_fn=lambda ticker, id: Fill(contracts=2.0, quote_amount=21.0, source=sources.ORDER()),
+                snapshot_price_fn=snapshot_price_fn,
+                max_wait_ms=0
+            )
+            fill = resolver.resolve(ticker="BTCUSDT", broker_order_id="1", ordered_contracts=2.0)
+            self.assertEqual(fill.price(), 10.5)
+            self.assertEqual(fill.source, sources.ORDER())
+            snapshot_price_fn.assert_not_called()
+
+        def test_trades_when_order_unknown(self):
+            order_fill_fn = unittest.mock.Mock(side_effect=[ ValueError("not found"), None ])
+            trade_fill_fn = unittest.mock.Mock(side_effect=[ None, fill_from_trades(trades=[ (1.0, 10.0), (1.0, 12.0) ]) ])
+            resolver = FillResolver(order_fill_fn=order_fill_fn, trade_fill_fn=trade_fill_fn, snapshot_price_fn=unittest.mock.Mock(), max_wait_ms=1000)
+            with unittest.mock.patch(f"{__name__}.pause_thread") as pause:
+                fill = resolver.resolve(ticker="BTCUSDT", broker_order_id="1", ordered_contracts=2.0)
+            self.assertEqual(fill.price(), 11.0)
+            self.assertEqual(fill.source, sources.TRADES())
+            self.assertEqual(pause.call_count, 1)
+
+        def test_snapshot_after_wait(self):
+            resolver = FillResolver(order_fill_fn=lambda ticker, id: None, snapshot_price_fn=lambda ticker: 9.0, max_wait_ms=0)
+            fill = resolver.resolve(ticker="BTCUSDT", broker_order_id="1", ordered_contracts=3.0)
+            self.assertEqual(fill.source, sources.SNAPSHOT())
+            self.assertEqual(fill.price(), 9.0)
+            self.assertEqual(fill.contracts, 3.0)
+            self.assertIsNone(fill_from_trades(trades=[]))
+
+        def test_async_snapshot_after_wait(self):
+            async def no_fill(ticker, id):
+                return None
+            async def price(ticker):
+                return 9.0
+            resolver = AsyncFillResolver(order_fill_fn=no_fill, trade_fill_fn=no_fill, snapshot_price_fn=price, max_wait_ms=300)
+            fill = asyncio.run(resolver.resolve_async(ticker="BTCUSDT", broker_order_id="1", ordered_contracts=3.0))
+            self.assertEqual(fill.source, sources.SNAPSHOT())
+            self.assertEqual(fill.price(), 9.0)
+
+    unittest.main()
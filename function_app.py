@@ -11,8 +11,11 @@ from merchant_order import Order
 from merchant import Merchant, PositionsCheckResult
 from merchant_performance import MerchantPerformance, LedgerOrdersResult, LedgerTransactionsResult
 from merchant_reporting import MerchantReporting
+from order_repository import OrderRepository
 from server import *
-from table_ledger import TableLedger, HashSigner
+from ledger_backends import ledger_for, rollups_for
+from ledger_sampling import PriceSampler, cfg as sampling_cfg
+from table_ledger import HashSigner
 from utils import null_or_empty, days_past_as_str, time_utc_as_str, unix_timestamp_secs, roll_dice_5percent as roll_dice, consts as util_consts
 
 app = func.FunctionApp()        
@@ -36,6 +39,7 @@ def handle_status() -> func.HttpResponse:
         table_name = "flowmerchant"
         table = table_service.get_table_client(table_name)
         entities = list(table.list_entities())
+        merchants_with_orders = OrderRepository(table_service=table_service).merchants_with_orders()
         formatted_entities = []
         now = unix_timestamp_secs()
         for entity in entities:
@@ -47,7 +51,7 @@ def handle_status() -> func.HttpResponse:
                     "id": entity.get("merchant_id"), 
                     "status": entity.get("status"), 
                     "last_time": time_ago,
-                    "has_orders": len(order_data) > 0
+                    "has_orders": len(order_data) > 0 or entity.get("PartitionKey") in merchants_with_orders
                 } 
             )
         return rx_json(data=formatted_entities)
@@ -127,8 +131,7 @@ def handle_performance_metrics(hours:int, query:str, identifier:str, ledger_type
         return rx_bad_request()
     
     with connect_table_service() as table_service:
-        table_client = table_service.create_table_if_not_exists(table_name=table_name)
-        table_ledger = TableLedger(table_client=table_client)
+        table_ledger = ledger_for(table_service=table_service, table_name=table_name)
         now_ts = unix_timestamp_secs()
         from_ts = now_ts - util_consts.ONE_HOUR_IN_SECS(hours=hours)
 
@@ -160,7 +163,8 @@ def handle_performance_metrics(hours:int, query:str, identifier:str, ledger_type
                 ledger=table_ledger,
                 from_timestamp=from_ts,
                 to_timestamp=now_ts,
-                filters=filters
+                filters=filters,
+                rollups=rollups_for(table_service=table_service, table_name=table_name)
             )
             return rx_json(results.as_dict())
         elif ledger_type == "ORDERS":
@@ -336,8 +340,7 @@ def handle_command_for_report_performance(identifer:str) -> func.HttpResponse:
         return rx_bad_request()
     with connect_table_service() as table_service:
         table_name = "fmorderledger"
-        table_client = table_service.create_table_if_not_exists(table_name=table_name)
-        table_ledger = TableLedger(table_client=table_client)
+        table_ledger = ledger_for(table_service=table_service, table_name=table_name)
         report_hours = 24
         now_ts = unix_timestamp_secs()
         from_ts = now_ts - util_consts.ONE_HOUR_IN_SECS(hours=report_hours)
@@ -429,8 +432,8 @@ def merchant_positions_checked(results: PositionsCheckResult) -> None:
         with connect_table_service() as table_service:
             ## log the finalized transactions
             transaction_table_name = "fmorderledger"
-            transaction_table_client = table_service.create_table_if_not_exists(table_name=transaction_table_name)
-            transaction_ledger = TableLedger(table_client=transaction_table_client)
+            transaction_rollups = rollups_for(table_service=table_service, table_name=transaction_table_name)
+            transaction_ledger = ledger_for(table_service=table_service, table_name=transaction_table_name, rollups=transaction_rollups)
             transaction_signer = HashSigner()
     
             reporting.report_to_ledger(
@@ -441,33 +444,35 @@ def merchant_positions_checked(results: PositionsCheckResult) -> None:
             
             ## only trigger a performance report occassionally due to it's processurally expensive nature
             if roll_dice():
-                reporting.report_ledger_performance(ledger=transaction_ledger, signer=transaction_signer)
+                reporting.report_ledger_performance(ledger=transaction_ledger, signer=transaction_signer, rollups=transaction_rollups)
                 purged = transaction_ledger.purge_old_logs()
-                logging.info(f"purged {purged} old logs from {transaction_table_name}")
+                logging.info(f"purged {len(purged)} old logs from {transaction_table_name}")
                 bad_emtries = transaction_ledger.verify_integrity(signer=transaction_signer)
                 if len(bad_emtries) > 0:
                     logging.critical(f"transaction ledger integrity check failed with {len(bad_emtries)} problems")
+                transaction_ledger.anchor()
 
 
             ## log the prices for analytics purposes
             performance_table_name = "fmperformanceledger"
-            performance_table_client = table_service.create_table_if_not_exists(table_name=performance_table_name)
-            performance_ledger = TableLedger(table_client=performance_table_client)
+            performance_ledger = ledger_for(table_service=table_service, table_name=performance_table_name)
             performance_signer = HashSigner()
 
             reporting.report_to_ledger(
                 positions=open_positions + closed_positions, 
                 ledger=performance_ledger, 
                 signer=performance_signer,
-                current_prices=results.current_prices
+                current_prices=results.current_prices,
+                sampler=PriceSampler(table_service=table_service, ledger_table_name=performance_table_name) if sampling_cfg.ENABLED() else None
             )
 
             if roll_dice():
                 purged = performance_ledger.purge_old_logs()
-                logging.info(f"purged {purged} old logs from {performance_table_name}")
+                logging.info(f"purged {len(purged)} old logs from {performance_table_name}")
                 bad_emtries = performance_ledger.verify_integrity(signer=performance_signer)
                 if len(bad_emtries) > 0:
                     logging.critical(f"performance ledger integrity check failed with {len(bad_emtries)} problems")
+                performance_ledger.anchor()
 
     except Exception as e:
         logging.error(f"error writing ledger - {e}", exc_info=True)
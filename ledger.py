@@ -26,6 +26,13 @@ class Entry(dict):
         self.test = test
         self.data = {} if data is None else data
 
+class LedgerError(Exception):
+    pass
+
+class LedgerConflictError(LedgerError):
+    """ another writer appended to the ledger since the latest entry was read - re-read, re-sign and retry """
+    pass
+
 class Signer:
     @abstractmethod
     def sign(self, new_entry:Entry, prev_entry:Entry) -> str:
@@ -36,10 +43,20 @@ class Ledger(ABC):
     def log(self, entry:Entry) -> None:
         pass
 
+    def log_many(self, entries:list[Entry], signer:Signer) -> None:
+        """ signs each entry onto the latest one and appends them in order - ledgers should override this to write in bulk """
+        for entry in entries:
+            entry.hash = signer.sign(new_entry=entry, prev_entry=self.get_latest_entry())
+            self.log(entry=entry)
+
     @abstractmethod
     def verify_integrity(self, signer:Signer) -> list[Entry]:
         pass
 
+    def anchor(self) -> int:
+        """ writes integrity anchors for entries not anchored yet, returns how many - ledgers without anchors write none """
+        return 0
+
     @abstractmethod
     def purge_old_logs(self) -> list[Entry]:
         pass
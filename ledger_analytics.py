@@ -9,6 +9,12 @@ class BasePerformance:
         self.winning_trades = 0.0
         self.total_pnl = 0.0
 
+    def add_totals(self, trades:float, winning_trades:float, pnl:float) -> None:
+        self.total_trades += trades
+        self.winning_trades += winning_trades
+        self.total_pnl += pnl
+        self.win_pct = self.winning_trades / self.total_trades if self.total_trades > 0.0 else 0.0
+
 class BaseAnalytics:
     def __init__(self):
         self.data = {}
@@ -19,11 +25,11 @@ class BaseAnalytics:
     def add(self, ledger_entry:Entry) -> None:
         order = Order.from_dict(ledger_entry.data)
         performance = self.check_new_data(order)
-        performance.total_trades += 1.0
-        performance.total_pnl += ledger_entry.amount
-        if ledger_entry.amount > 0.0:
-            performance.winning_trades += 1.0
-        performance.win_pct = performance.winning_trades / performance.total_trades
+        performance.add_totals(
+            trades=1.0, 
+            winning_trades=1.0 if ledger_entry.amount > 0.0 else 0.0, 
+            pnl=ledger_entry.amount
+        )
 
     def results(self) -> list:
         results = list(self.data.values())
@@ -99,6 +105,15 @@ class Analytics:
                 ticker_analytics.add(ledger_entry=ledger_entry)
                 overall.add(ledger_entry=ledger_entry)
             
+            return Analytics.performance_metrics(
+                overall=overall, 
+                interval_analytics=interval_analytics, 
+                spread_analytics=spread_analytics, 
+                ticker_analytics=ticker_analytics
+            )
+
+    @staticmethod
+    def performance_metrics(overall:BaseAnalytics, interval_analytics:BaseAnalytics, spread_analytics:BaseAnalytics, ticker_analytics:BaseAnalytics) -> dict:
             overall_results = [result.__dict__ for result in overall.results()]
             interval_results = [interval.__dict__ for interval in interval_analytics.results()]
             spread_results = [spread.__dict__ for spread in spread_analytics.results()]
@@ -0,0 +1,53 @@
+from azure.data.tables import TableServiceClient
+
+from ledger import Ledger
+from ledger_rollups import LedgerRollups
+from sqlite_ledger import SqliteLedger, ReplicatedLedger
+from table_ledger import TableLedger
+
+import os
+import threading
+
+class cfg:
+    @staticmethod
+    def BACKEND() -> str:
+        ### TABLE keeps the ledgers in Azure tables, SQLITE in local files, REPLICA writes to the tables and reads from a local replica
+        backend:str = os.environ.get("LEDGER_BACKEND", "TABLE").upper()
+        if backend not in [ "TABLE", "SQLITE", "REPLICA" ]:
+            raise ValueError(f"LEDGER_BACKEND must be TABLE, SQLITE or REPLICA, got {backend}")
+        return backend
+
+    @staticmethod
+    def SQLITE_DIR() -> str:
+        sqlite_dir:str = os.environ.get("LEDGER_SQLITE_DIR", ".")
+        if not os.path.isdir(sqlite_dir):
+            raise ValueError(f"LEDGER_SQLITE_DIR must be an existing directory, got {sqlite_dir}")
+        return sqlite_dir
+
+### one connection per file for the life of the process
+_sqlite_ledgers:dict[str, SqliteLedger] = {}
+_sqlite_lock = threading.Lock()
+
+def _sqlite_ledger(table_name:str) -> SqliteLedger:
+    path = os.path.join(cfg.SQLITE_DIR(), f"{table_name}.sqlite3")
+    with _sqlite_lock:
+        if path not in _sqlite_ledgers:
+            _sqlite_ledgers[path] = SqliteLedger(path=path)
+        return _sqlite_ledgers[path]
+
+def rollups_for(table_service:TableServiceClient, table_name:str) -> LedgerRollups:
+    """ the rollups of the ledger named table_name, None when its entries are not written to Azure tables """
+    if cfg.BACKEND() == "SQLITE":
+        return None
+    return LedgerRollups(table_service=table_service, ledger_table_name=table_name)
+
+def ledger_for(table_service:TableServiceClient, table_name:str, rollups:LedgerRollups = None) -> Ledger:
+    """ the ledger named table_name on the backend configured by LEDGER_BACKEND - table_service is unused for SQLITE """
+    backend = cfg.BACKEND()
+    if backend == "SQLITE":
+        return _sqlite_ledger(table_name=table_name)
+    table_client = table_service.create_table_if_not_exists(table_name=table_name)
+    table_ledger = TableLedger(table_client=table_client, table_service=table_service, rollups=rollups)
+    if backend == "REPLICA":
+        return ReplicatedLedger(table_ledger=table_ledger, replica=_sqlite_ledger(table_name=table_name))
+    return table_ledger
@@ -0,0 +1,185 @@
+from abc import ABC, abstractmethod
+
+from azure.data.tables import TableClient, TableServiceClient
+
+import datetime
+import heapq
+import logging
+import os
+
+class cfg:
+    @staticmethod
+    def LAYOUT() -> str:
+        ### SINGLE keeps every entry in the ledger's own table, MONTHLY writes them to one table per month
+        layout:str = os.environ.get("TABLE_LEDGER_BUCKETS", "SINGLE").upper()
+        if layout not in [ "SINGLE", "MONTHLY" ]:
+            raise ValueError(f"TABLE_LEDGER_BUCKETS must be SINGLE or MONTHLY, got {layout}")
+        return layout
+
+class LedgerBuckets(ABC):
+    """ Where a TableLedger keeps its entries, by log_timestamp. Range reads go through query(), which only
+    touches the buckets overlapping the range and merges their results in log_timestamp order. """
+
+    @abstractmethod
+    def table_for(self, log_timestamp:float) -> TableClient:
+        """ the table an entry logged at log_timestamp is written to """
+        pass
+
+    @abstractmethod
+    def tables_between(self, from_timestamp:float, to_timestamp:float) -> list[TableClient]:
+        """ every table that can hold entries logged within [from_timestamp, to_timestamp], oldest first """
+        pass
+
+    @abstractmethod
+    def drop_before(self, timestamp:float) -> int:
+        """ drops the buckets holding only entries logged before timestamp, returns how many were dropped """
+        pass
+
+    @abstractmethod
+    def all_tables(self) -> list[TableClient]:
+        pass
+
+    def query(self, query_filter:str, from_timestamp:float, to_timestamp:float, sort_key:str = "log_timestamp", **kwargs) -> list[dict]:
+        return [ entity for _, entity in self.query_by_table(query_filter, from_timestamp=from_timestamp, to_timestamp=to_timestamp, sort_key=sort_key, **kwargs) ]
+
+    def query_by_table(self, query_filter:str, from_timestamp:float, to_timestamp:float, sort_key:str = "log_timestamp", **kwargs) -> list[tuple[TableClient, dict]]:
+        """ query() with the table each entity was read from - for writing entities back where they are """
+        results = []
+        for table in self.tables_between(from_timestamp=from_timestamp, to_timestamp=to_timestamp):
+            entities = list(table.query_entities(query_filter, **kwargs))
+            entities.sort(key=lambda x: x.get(sort_key))
+            results.append([ (table, entity) for entity in entities ])
+        if len(results) == 1:
+            return results[0]
+        return list(heapq.merge(*results, key=lambda x: x[1].get(sort_key)))
+
+class SingleTable(LedgerBuckets):
+    """ every entry in the ledger's own table - expired entries are purged row by row """
+
+    def __init__(self, table_client:TableClient):
+        if table_client is None:
+            raise ValueError("table_client is required")
+        self.table_client = table_client
+
+    def table_for(self, log_timestamp:float) -> TableClient:
+        return self.table_client
+
+    def tables_between(self, from_timestamp:float, to_timestamp:float) -> list[TableClient]:
+        return [ self.table_client ]
+
+    def all_tables(self) -> list[TableClient]:
+        return [ self.table_client ]
+
+    def drop_before(self, timestamp:float) -> int:
+        return 0
+
+class MonthlyTables(LedgerBuckets):
+    """ One table per UTC month of log_timestamp, named {ledger table}{YYYYMM}. The ledger's own table keeps the
+    chain bookkeeping and serves as the bucket of entries written before the monthly layout, so it is always read
+    and never dropped - its expired entries are still purged row by row. """
+
+    def __init__(self, table_service:TableServiceClient, table_client:TableClient):
+        if table_service is None:
+            raise ValueError("table_service is required")
+        if table_client is None:
+            raise ValueError("table_client is required")
+        self.table_service = table_service
+        self.table_client = table_client
+        self.base_name = table_client.table_name
+        self._tables:dict[str, TableClient] = None
+
+    @staticmethod
+    def month_of(timestamp:float) -> str:
+        return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).strftime("%Y%m")
+
+    @staticmethod
+    def _month_end(month:str) -> float:
+        year, month = int(month[:4]), int(month[4:])
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+    def _known_tables(self) -> dict[str, TableClient]:
+        """ month -> table of the buckets that exist, listed once per instance """
+        if self._tables is None:
+            self._tables = {}
+            for table in self.table_service.query_tables(
+                "TableName gt @low and TableName lt @high",
+                parameters={ "low": f"{self.base_name}0", "high": f"{self.base_name}:" }
+            ):
+                month = table.name[len(self.base_name):]
+                if len(month) == 6 and month.isnumeric():
+                    self._tables[month] = self.table_service.get_table_client(table_name=table.name)
+        return self._tables
+
+    def table_for(self, log_timestamp:float) -> TableClient:
+        month = self.month_of(log_timestamp)
+        tables = self._known_tables()
+        if month not in tables:
+            tables[month] = self.table_service.create_table_if_not_exists(table_name=f"{self.base_name}{month}")
+        return tables[month]
+
+    def tables_between(self, from_timestamp:float, to_timestamp:float) -> list[TableClient]:
+        first_month = self.month_of(max(from_timestamp, 0))
+        last_month = self.month_of(to_timestamp)
+        tables = self._known_tables()
+        return [ self.table_client ] + [ tables[month] for month in sorted(tables.keys()) if first_month <= month <= last_month ]
+
+    def all_tables(self) -> list[TableClient]:
+        tables = self._known_tables()
+        return [ self.table_client ] + [ tables[month] for month in sorted(tables.keys()) ]
+
+    def drop_before(self, timestamp:float) -> int:
+        tables = self._known_tables()
+        expired = [ month for month in tables.keys() if self._month_end(month) <= timestamp ]
+        for month in expired:
+            logging.info(f"dropping expired ledger bucket {self.base_name}{month}")
+            self.table_service.delete_table(table_name=f"{self.base_name}{month}")
+            del tables[month]
+        return len(expired)
+
+def buckets_for(table_client:TableClient, table_service:TableServiceClient = None) -> LedgerBuckets:
+    """ the layout configured by TABLE_LEDGER_BUCKETS - monthly tables need the table_service to create and drop them """
+    if cfg.LAYOUT() == "MONTHLY":
+        if table_service is None:
+            raise ValueError("TABLE_LEDGER_BUCKETS is MONTHLY but no table_service was given")
+        return MonthlyTables(table_service=table_service, table_client=table_client)
+    return SingleTable(table_client=table_client)
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    class Test(unittest.TestCase):
+        def test_month_bounds(self):
+            self.assertEqual(MonthlyTables.month_of(datetime.datetime(2026, 12, 31, 23, 59, tzinfo=datetime.timezone.utc).timestamp()), "202612")
+            self.assertEqual(MonthlyTables._month_end("202612"), datetime.datetime(2027, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+        def test_monthly_routing(self):
+            table_service = unittest.mock.Mock()
+            listed_tables = []
+            for name in [ "ledger202609", "ledger202610", "ledgerxyz" ]:
+                listed_table = unittest.mock.Mock()
+                listed_table.name = name
+                listed_tables.append(listed_table)
+            table_service.query_tables.return_value = listed_tables
+            table_service.get_table_client.side_effect = lambda table_name: unittest.mock.Mock(table_name=table_name)
+            base = unittest.mock.Mock(table_name="ledger")
+            buckets = MonthlyTables(table_service=table_service, table_client=base)
+            october = datetime.datetime(2026, 10, 15, tzinfo=datetime.timezone.utc).timestamp()
+            tables = buckets.tables_between(from_timestamp=october, to_timestamp=october + 1)
+            self.assertEqual([ table.table_name for table in tables ], [ "ledger", "ledger202610" ])
+            self.assertEqual(len(buckets.all_tables()), 3)
+            self.assertEqual(buckets.drop_before(timestamp=october), 1)
+            table_service.delete_table.assert_called_once_with(table_name="ledger202609")
+
+        def test_query_merges_in_order(self):
+            first = unittest.mock.Mock()
+            first.query_entities.return_value = [ { "log_timestamp": 3.0 }, { "log_timestamp": 1.0 } ]
+            second = unittest.mock.Mock()
+            second.query_entities.return_value = [ { "log_timestamp": 2.0 } ]
+            buckets = SingleTable(table_client=first)
+            buckets.tables_between = lambda from_timestamp, to_timestamp: [ first, second ]
+            merged = buckets.query("log_timestamp gt 0", from_timestamp=0, to_timestamp=4)
+            self.assertEqual([ entity.get("log_timestamp") for entity in merged ], [ 1.0, 2.0, 3.0 ])
+
+    unittest.main()
@@ -0,0 +1,193 @@
+""" Encoding of a ledger entry's data (an Order dict) in the entry entity.
+
+JSON is the original encoding - json.dumps of the whole dict in the data property.
+COMPACT drops the raw broker responses (the api_rx of every sub-order and the *_api keys of additional_data),
+shortens the known keys and marks the payload with its version. ZLIB compresses the COMPACT payload into the
+binary data_z property and leaves data empty.
+decode() reads all of them, so entries of every encoding can sit in the same table. """
+import json
+import os
+import zlib
+
+class cfg:
+    @staticmethod
+    def CODEC() -> str:
+        codec:str = os.environ.get("TABLE_LEDGER_PAYLOAD_CODEC", "COMPACT").upper()
+        if codec not in [ "JSON", "COMPACT", "ZLIB" ]:
+            raise ValueError(f"TABLE_LEDGER_PAYLOAD_CODEC must be JSON, COMPACT or ZLIB, got {codec}")
+        return codec
+
+class consts:
+    @staticmethod
+    def VERSION() -> int:
+        return 1
+
+    @staticmethod
+    def VERSION_KEY() -> str:
+        ### never a key of an Order dict - original keys that collide are escaped
+        return "~"
+
+    @staticmethod
+    def ESCAPE() -> str:
+        return "!"
+
+    @staticmethod
+    def ZLIB_LEVEL() -> int:
+        return 6
+
+class pkeys:
+    @staticmethod
+    def DATA() -> str:
+        return "data"
+
+    @staticmethod
+    def DATA_Z() -> str:
+        return "data_z"
+
+_SHORT_KEYS = {
+    "ticker": "t",
+    "sub_orders": "so",
+    "main_order": "m",
+    "stop_loss": "sl",
+    "take_profit": "tp",
+    "id": "i",
+    "time": "tm",
+    "price": "pr",
+    "contracts": "c",
+    "metadata": "md",
+    "time_created": "tc",
+    "is_dry_run": "dr",
+    "security_type": "st",
+    "tags": "tg",
+    "merchant_params": "mp",
+    "high_interval": "hi",
+    "low_interval": "lo",
+    "stoploss_percent": "slp",
+    "takeprofit_percent": "tpp",
+    "notes": "n",
+    "version": "v",
+    "strategy": "sg",
+    "projections": "pj",
+    "profit_without_fees": "pwf",
+    "loss_without_fees": "lwf",
+    "results": "r",
+    "transaction": "tx",
+    "action": "a",
+    "quantity": "q",
+    "complete": "cp",
+    "additional_data": "ad",
+    "timestamp": "ts"
+}
+_LONG_KEYS = { short: long for long, short in _SHORT_KEYS.items() }
+
+def _is_raw_response(key:str) -> bool:
+    return key == "api_rx" or key.endswith("_api")
+
+def _shorten_key(key:str) -> str:
+    if key in _SHORT_KEYS:
+        return _SHORT_KEYS[key]
+    if key in _LONG_KEYS or key == consts.VERSION_KEY() or key.startswith(consts.ESCAPE()):
+        return f"{consts.ESCAPE()}{key}"
+    return key
+
+def _lengthen_key(key:str) -> str:
+    if key.startswith(consts.ESCAPE()):
+        return key[len(consts.ESCAPE()):]
+    return _LONG_KEYS.get(key, key)
+
+def _compact(value):
+    if isinstance(value, dict):
+        return { _shorten_key(key): _compact(item) for key, item in value.items() if not _is_raw_response(key) }
+    if isinstance(value, list):
+        return [ _compact(item) for item in value ]
+    return value
+
+def _expand(value):
+    if isinstance(value, dict):
+        return { _lengthen_key(key): _expand(item) for key, item in value.items() }
+    if isinstance(value, list):
+        return [ _expand(item) for item in value ]
+    return value
+
+def dumps(data:dict) -> str:
+    """ data as a COMPACT payload """
+    if data is None:
+        raise ValueError("data is required")
+    return json.dumps({ consts.VERSION_KEY(): consts.VERSION(), **_compact(data) }, separators=(",", ":"))
+
+def loads(payload:str) -> dict:
+    """ a JSON or COMPACT payload as the dict it was made from - raw broker responses of COMPACT payloads come back empty """
+    data = json.loads(payload)
+    if not isinstance(data, dict) or consts.VERSION_KEY() not in data:
+        return data
+    version = data.pop(consts.VERSION_KEY())
+    if version != consts.VERSION():
+        raise ValueError(f"unsupported ledger payload version {version}")
+    data = _expand(data)
+    for sub_order in data.get("sub_orders", {}).values():
+        if isinstance(sub_order, dict):
+            sub_order.setdefault("api_rx", {})
+    return data
+
+def encode(data:dict, codec:str = None) -> dict:
+    """ the entity properties holding data, in the codec configured by TABLE_LEDGER_PAYLOAD_CODEC unless given """
+    codec = cfg.CODEC() if codec is None else codec
+    if codec == "JSON":
+        return { pkeys.DATA(): json.dumps(data) }
+    if codec == "COMPACT":
+        return { pkeys.DATA(): dumps(data=data) }
+    if codec == "ZLIB":
+        return { pkeys.DATA(): "", pkeys.DATA_Z(): zlib.compress(dumps(data=data).encode("utf-8"), consts.ZLIB_LEVEL()) }
+    raise ValueError(f"unknown ledger payload codec {codec}")
+
+def decode(properties:dict, data_key:str = pkeys.DATA(), data_z_key:str = pkeys.DATA_Z()) -> dict:
+    """ the data held by properties, whatever codec wrote it """
+    data_z = properties.get(data_z_key)
+    if data_z is not None and len(data_z) > 0:
+        return loads(payload=zlib.decompress(bytes(data_z)).decode("utf-8"))
+    return loads(payload=properties.get(data_key) or "{}")
+
+if __name__ == "__main__":
+    import unittest
+
+    def _order_data() -> dict:
+        sub_order = lambda id: { "id": id, "api_rx": { "orderId": id, "fills": [ 1, 2, 3 ] }, "time": 1700000000000, "price": 10.0, "contracts": 1.5 }
+        return {
+            "ticker": "BTCUSDT",
+            "sub_orders": { "main_order": sub_order("m"), "stop_loss": sub_order("s"), "take_profit": sub_order("t") },
+            "metadata": { "id": "1", "time_created": 1700000000, "is_dry_run": False, "security_type": "crypto", "tags": [ "a" ] },
+            "merchant_params": { "high_interval": "60", "low_interval": "5", "stoploss_percent": 2.0, "takeprofit_percent": 3.0, "notes": "", "version": 1, "strategy": "BRACKET" },
+            "projections": { "profit_without_fees": 1.0, "loss_without_fees": -1.0 },
+            "results": { "transaction": None, "complete": False, "additional_data": {
+                "new_stop_loss_order": { "id": "x" },
+                "new_stop_loss_order_api": { "raw": True },
+                "t": "collides with a short key",
+                "!odd": 1
+            } }
+        }
+
+    class Test(unittest.TestCase):
+        def test_round_trip_strips_raw_responses(self):
+            data = _order_data()
+            for codec in [ "COMPACT", "ZLIB" ]:
+                decoded = decode(properties=encode(data=data, codec=codec))
+                additional_data = decoded["results"]["additional_data"]
+                self.assertNotIn("new_stop_loss_order_api", additional_data)
+                self.assertEqual(additional_data["t"], "collides with a short key")
+                self.assertEqual(additional_data["!odd"], 1)
+                self.assertEqual(decoded["sub_orders"]["main_order"]["api_rx"], {})
+                self.assertEqual(decoded["merchant_params"], data["merchant_params"])
+                self.assertEqual(decoded["ticker"], "BTCUSDT")
+
+        def test_legacy_rows_decode(self):
+            data = _order_data()
+            self.assertEqual(decode(properties={ "data": json.dumps(data) }), data)
+            self.assertEqual(decode(properties={ "data": "{}" }), {})
+
+        def test_compact_is_smaller(self):
+            data = _order_data()
+            legacy = len(encode(data=data, codec="JSON")["data"])
+            self.assertLess(len(encode(data=data, codec="COMPACT")["data"]), legacy)
+            self.assertLess(len(encode(data=data, codec="ZLIB")["data_z"]), legacy)
+
+    unittest.main()
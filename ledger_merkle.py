@@ -0,0 +1,306 @@
+from ledger_buckets import LedgerBuckets, SingleTable
+from table_batch import TableWriteBatch
+from utils import unix_timestamp_secs, consts as util_consts
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.data.tables import TableClient, UpdateMode
+
+import hashlib
+import logging
+import os
+
+class consts:
+    @staticmethod
+    def ANCHOR_PARTITION_KEY() -> str:
+        ### one anchor per interval, RowKey is the zero padded interval start
+        return "__anchor__"
+
+    @staticmethod
+    def CHAIN_PARTITION_KEY() -> str:
+        ### same bookkeeping partition as table_ledger
+        return "__chain__"
+
+    @staticmethod
+    def ANCHORED_ROW_KEY() -> str:
+        return "anchored"
+
+    @staticmethod
+    def ROW_KEY_WIDTH() -> int:
+        return 12
+
+class akeys:
+    """ properties of anchors - prefixed so the ledger's log_timestamp / timestamp / name queries never match them """
+    @staticmethod
+    def START() -> str:
+        return "anchor_start"
+
+    @staticmethod
+    def END() -> str:
+        return "anchor_end"
+
+    @staticmethod
+    def ROOT() -> str:
+        return "anchor_root"
+
+    @staticmethod
+    def LEAF_COUNT() -> str:
+        return "anchor_leaf_count"
+
+    @staticmethod
+    def ANCHORED_UNTIL() -> str:
+        ### on the __chain__/anchored entity - every interval before this has an anchor
+        return "anchor_until"
+
+class cfg:
+    @staticmethod
+    def INTERVAL_SECS() -> int:
+        interval_secs:str = os.environ.get("TABLE_LEDGER_ANCHOR_INTERVAL_SECS", str(util_consts.ONE_HOUR_IN_SECS()))
+        if not interval_secs.isnumeric() or int(interval_secs) == 0:
+            raise ValueError(f"TABLE_LEDGER_ANCHOR_INTERVAL_SECS must be a positive integer, got {interval_secs}")
+        return int(interval_secs)
+
+    @staticmethod
+    def SETTLE_SECS() -> int:
+        ### an interval is only anchored once no in-flight log_many can still write into it
+        settle_secs:str = os.environ.get("TABLE_LEDGER_VERIFY_SETTLE_SECS", "60")
+        if not settle_secs.isnumeric():
+            raise ValueError(f"TABLE_LEDGER_VERIFY_SETTLE_SECS must be an integer, got {settle_secs}")
+        return int(settle_secs)
+
+def _sha256(target:str) -> str:
+    return hashlib.sha256(target.encode("utf-8")).hexdigest()
+
+def leaf_hash(entity:dict) -> str:
+    """ commits to the signed fields of a ledger entity as well as its stored chain hash """
+    return _sha256(f"0_{entity.get('name')}_{entity.get('timestamp')}_{entity.get('amount')}_{entity.get('test')}_{entity.get('log_timestamp')}_{entity.get('hash')}")
+
+def _node_hash(left:str, right:str) -> str:
+    return _sha256(f"1_{left}_{right}")
+
+def merkle_root(leaves:list[str]) -> str:
+    """ an odd node is carried up unchanged rather than paired with itself """
+    if len(leaves) == 0:
+        return _sha256("2_empty")
+    level = list(leaves)
+    while len(level) > 1:
+        level = [ _node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i] for i in range(0, len(level), 2) ]
+    return level[0]
+
+def merkle_proof(leaves:list[str], index:int) -> list[tuple[str, bool]]:
+    """ the sibling hashes from leaves[index] up to the root - each paired with True when the sibling is on the left """
+    if index < 0 or index >= len(leaves):
+        raise ValueError(f"index must be within the {len(leaves)} leaves, got {index}")
+    proof = []
+    level = list(leaves)
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append((level[sibling], sibling < index))
+        level = [ _node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i] for i in range(0, len(level), 2) ]
+        index //= 2
+    return proof
+
+def verify_proof(leaf:str, proof:list[tuple[str, bool]], root:str) -> bool:
+    node = leaf
+    for sibling, sibling_is_left in proof:
+        node = _node_hash(sibling, node) if sibling_is_left else _node_hash(node, sibling)
+    return node == root
+
+class LedgerAnchors:
+    """ Merkle anchors for a TableLedger table: every closed interval (hourly by default) gets an anchor entity holding
+    the root over the leaf hashes of its entries in log_timestamp order. Any range is then verified by re-reading
+    only the entries of the intervals it covers, and a single entry is proven with O(log n) sibling hashes.
+    Intervals without entries are anchored too, so an interval emptied after the fact is caught. 
+    The anchors live in table_client, the entries are read from buckets (default: table_client as well). """
+
+    def __init__(self, table_client:TableClient, buckets:LedgerBuckets = None):
+        if table_client is None:
+            raise ValueError("table_client is required")
+        self.table_client = table_client
+        self.buckets = SingleTable(table_client=table_client) if buckets is None else buckets
+
+    @staticmethod
+    def is_anchor_entity(entity:dict) -> bool:
+        return entity.get("PartitionKey") == consts.ANCHOR_PARTITION_KEY()
+
+    @staticmethod
+    def _interval_start(timestamp:float, interval_secs:int) -> int:
+        return int(timestamp // interval_secs) * interval_secs
+
+    @staticmethod
+    def _row_key(interval_start:int) -> str:
+        return str(interval_start).zfill(consts.ROW_KEY_WIDTH())
+
+    def _read_anchored_until(self) -> int:
+        try:
+            entity = self.table_client.get_entity(partition_key=consts.CHAIN_PARTITION_KEY(), row_key=consts.ANCHORED_ROW_KEY())
+            return entity.get(akeys.ANCHORED_UNTIL())
+        except ResourceNotFoundError:
+            return None
+
+    def _leaves_by_interval(self, from_ts:int, to_ts:int, interval_secs:int) -> dict[int, list[str]]:
+        entities = self.buckets.query(
+            f"log_timestamp ge {from_ts} and log_timestamp lt {to_ts}",
+            from_timestamp=from_ts,
+            to_timestamp=to_ts,
+            select=[ "name", "timestamp", "amount", "test", "log_timestamp", "hash" ]
+        )
+        leaves = {}
+        for entity in entities:
+            leaves.setdefault(self._interval_start(entity.get("log_timestamp"), interval_secs), []).append(leaf_hash(entity))
+        return leaves
+
+    def anchor(self, from_timestamp:int) -> int:
+        """ anchors every closed interval since the last one anchored - from_timestamp is where a ledger without
+        anchors starts (usually the start of its retention). Returns the number of anchors written. """
+        interval_secs = cfg.INTERVAL_SECS()
+        anchored_until = self._read_anchored_until()
+        start = self._interval_start(from_timestamp, interval_secs) if anchored_until is None else anchored_until
+        end = self._interval_start(unix_timestamp_secs() - cfg.SETTLE_SECS(), interval_secs)
+        if start >= end:
+            return 0
+        leaves = self._leaves_by_interval(from_ts=start, to_ts=end, interval_secs=interval_secs)
+        batch = TableWriteBatch(table_client=self.table_client)
+        anchor_ct = 0
+        for interval_start in range(start, end, interval_secs):
+            interval_leaves = leaves.get(interval_start, [])
+            batch.upsert({
+                "PartitionKey": consts.ANCHOR_PARTITION_KEY(),
+                "RowKey": self._row_key(interval_start),
+                akeys.START(): interval_start,
+                akeys.END(): interval_start + interval_secs,
+                akeys.ROOT(): merkle_root(interval_leaves),
+                akeys.LEAF_COUNT(): len(interval_leaves)
+            })
+            anchor_ct += 1
+        batch.flush()
+        ### only moved once the anchors are written, an interrupted run re-anchors the same intervals
+        self.table_client.upsert_entity(entity={
+            "PartitionKey": consts.CHAIN_PARTITION_KEY(),
+            "RowKey": consts.ANCHORED_ROW_KEY(),
+            akeys.ANCHORED_UNTIL(): end
+        }, mode=UpdateMode.REPLACE)
+        logging.info(f"anchored {anchor_ct} ledger intervals up to {end}")
+        return anchor_ct
+
+    def _anchors_between(self, from_ts:int, to_ts:int) -> dict[int, dict]:
+        entities = self.table_client.query_entities(
+            "PartitionKey eq @pk and RowKey ge @from_rk and RowKey lt @to_rk",
+            parameters={
+                "pk": consts.ANCHOR_PARTITION_KEY(),
+                "from_rk": self._row_key(from_ts),
+                "to_rk": self._row_key(to_ts)
+            }
+        )
+        return { entity.get(akeys.START()): entity for entity in entities }
+
+    def verify_range(self, from_timestamp:float, to_timestamp:float, retained_from:float = None) -> list[int]:
+        """ starts of the anchored intervals overlapping [from_timestamp, to_timestamp) whose entries no longer
+        match their anchor, or whose anchor is missing. Intervals not anchored yet are not checked, nor are the 
+        intervals starting before retained_from - the purge may have deleted part of them. """
+        if from_timestamp > to_timestamp:
+            raise ValueError("from_timestamp must be less than to_timestamp")
+        interval_secs = cfg.INTERVAL_SECS()
+        anchored_until = self._read_anchored_until()
+        if anchored_until is None:
+            return []
+        start = self._interval_start(from_timestamp, interval_secs)
+        if retained_from is not None:
+            first_whole = self._interval_start(retained_from, interval_secs)
+            if first_whole < retained_from:
+                first_whole += interval_secs
+            start = max(start, first_whole)
+        end = min(anchored_until, self._interval_start(to_timestamp, interval_secs) + interval_secs)
+        if start >= end:
+            return []
+        anchors = self._anchors_between(from_ts=start, to_ts=end)
+        leaves = self._leaves_by_interval(from_ts=start, to_ts=end, interval_secs=interval_secs)
+        problem_intervals = []
+        for interval_start in range(start, end, interval_secs):
+            anchor = anchors.get(interval_start)
+            if anchor is None:
+                logging.warning(f"ledger anchor missing for the interval starting {interval_start}")
+                problem_intervals.append(interval_start)
+            elif anchor.get(akeys.ROOT()) != merkle_root(leaves.get(interval_start, [])):
+                logging.warning(f"ledger interval starting {interval_start} does not match its anchor")
+                problem_intervals.append(interval_start)
+        return problem_intervals
+
+    def prove(self, entity:dict) -> tuple[dict, list[tuple[str, bool]]]:
+        """ the anchor of a ledger entity and the proof of its leaf against the anchor root - check with
+        verify_proof(leaf_hash(entity), proof, anchor["anchor_root"]). None if its interval is not anchored yet. """
+        interval_secs = cfg.INTERVAL_SECS()
+        interval_start = self._interval_start(entity.get("log_timestamp"), interval_secs)
+        try:
+            anchor = self.table_client.get_entity(partition_key=consts.ANCHOR_PARTITION_KEY(), row_key=self._row_key(interval_start))
+        except ResourceNotFoundError:
+            return None
+        leaves = self._leaves_by_interval(from_ts=interval_start, to_ts=interval_start + interval_secs, interval_secs=interval_secs).get(interval_start, [])
+        target = leaf_hash(entity)
+        if target not in leaves:
+            raise ValueError(f"entity {entity.get('RowKey')} is not in the ledger")
+        return anchor, merkle_proof(leaves, leaves.index(target))
+
+    def purge_old_anchors(self, before_timestamp:int) -> int:
+        anchors = self._anchors_between(from_ts=0, to_ts=self._interval_start(before_timestamp, cfg.INTERVAL_SECS()))
+        batch = TableWriteBatch(table_client=self.table_client)
+        for anchor in anchors.values():
+            batch.delete(partition_key=anchor.get("PartitionKey"), row_key=anchor.get("RowKey"))
+        batch.flush()
+        return len(anchors)
+
+    def reset(self) -> None:
+        """ re-anchors every interval on the next anchor() - after the hashes were recomputed """
+        try:
+            self.table_client.delete_entity(partition_key=consts.CHAIN_PARTITION_KEY(), row_key=consts.ANCHORED_ROW_KEY())
+        except ResourceNotFoundError:
+            pass
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    class Test(unittest.TestCase):
+        def test_proofs(self):
+            for leaf_ct in range(1, 12):
+                leaves = [ _sha256(str(i)) for i in range(leaf_ct) ]
+                root = merkle_root(leaves)
+                for i in range(leaf_ct):
+                    proof = merkle_proof(leaves, i)
+                    self.assertTrue(verify_proof(leaves[i], proof, root))
+                    self.assertFalse(verify_proof(_sha256("x"), proof, root))
+                    self.assertLessEqual(len(proof), leaf_ct.bit_length())
+
+        def test_root_changes_with_order(self):
+            leaves = [ _sha256("a"), _sha256("b") ]
+            self.assertNotEqual(merkle_root(leaves), merkle_root(list(reversed(leaves))))
+            self.assertNotEqual(merkle_root([]), merkle_root([ _sha256("") ]))
+
+        def test_leaf_covers_signed_fields(self):
+            entity = { "name": "a", "timestamp": 1, "amount": 1.0, "test": True, "log_timestamp": 1.0, "hash": "h" }
+            tampered = dict(entity, amount=2.0)
+            self.assertNotEqual(leaf_hash(entity), leaf_hash(tampered))
+
+        def test_verify_range_skips_purged_interval(self):
+            table_client = unittest.mock.Mock()
+            buckets = unittest.mock.Mock()
+            entities = [ { "name": "a", "timestamp": ts, "amount": 1.0, "test": False, "log_timestamp": ts, "hash": "h" } for ts in [ 100, 150, 250 ] ]
+            anchors = {
+                start: { akeys.START(): start, akeys.ROOT(): merkle_root([ leaf_hash(entity) for entity in entities if start <= entity["log_timestamp"] < start + 100 ]) }
+                for start in [ 100, 200 ]
+            }
+            table_client.get_entity.return_value = { akeys.ANCHORED_UNTIL(): 300 }
+            table_client.query_entities.side_effect = lambda query_filter, parameters: [
+                anchor for start, anchor in anchors.items() if parameters["from_rk"] <= LedgerAnchors._row_key(start) < parameters["to_rk"]
+            ]
+            ### the purge deleted the entry at 100, half way into the first interval
+            buckets.query.side_effect = lambda query_filter, from_timestamp, to_timestamp, select: [
+                entity for entity in entities[1:] if from_timestamp <= entity["log_timestamp"] < to_timestamp
+            ]
+            ledger_anchors = LedgerAnchors(table_client=table_client, buckets=buckets)
+            with unittest.mock.patch.dict(os.environ, { "TABLE_LEDGER_ANCHOR_INTERVAL_SECS": "100" }):
+                self.assertEqual(ledger_anchors.verify_range(from_timestamp=100, to_timestamp=300), [ 100 ])
+                self.assertEqual(ledger_anchors.verify_range(from_timestamp=100, to_timestamp=300, retained_from=120), [])
+                self.assertEqual(ledger_anchors.verify_range(from_timestamp=100, to_timestamp=300, retained_from=100), [ 100 ])
+
+    unittest.main()
@@ -0,0 +1,288 @@
+from ledger import Entry
+from ledger_analytics import Analytics, BaseAnalytics
+from merchant_order import Order
+from utils import consts as util_consts
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import TableClient, TableServiceClient, UpdateMode
+
+import logging
+import os
+
+class consts:
+    @staticmethod
+    def ALL_TAG() -> str:
+        ### every entry is rolled up under this tag as well as its own tags
+        return "All"
+
+    @staticmethod
+    def BUCKET_SECS() -> int:
+        return util_consts.ONE_HOUR_IN_SECS()
+
+    @staticmethod
+    def UPDATE_ATTEMPTS() -> int:
+        return 5
+
+class dimensions:
+    @staticmethod
+    def OVERALL() -> str:
+        return "overall"
+
+    @staticmethod
+    def TICKER() -> str:
+        return "ticker"
+
+    @staticmethod
+    def INTERVAL() -> str:
+        return "interval"
+
+    @staticmethod
+    def SPREAD() -> str:
+        return "spread"
+
+class rkeys:
+    """ properties of a rollup row - PartitionKey is the zero padded hour, RowKey the tag, dimension and key """
+    @staticmethod
+    def TAG() -> str:
+        return "tag"
+
+    @staticmethod
+    def DIMENSION() -> str:
+        return "dimension"
+
+    @staticmethod
+    def KEY() -> str:
+        return "key"
+
+    @staticmethod
+    def TRADES() -> str:
+        return "trades"
+
+    @staticmethod
+    def WINS() -> str:
+        return "wins"
+
+    @staticmethod
+    def PNL() -> str:
+        return "pnl"
+
+    @staticmethod
+    def HIGH_INTERVAL() -> str:
+        return "high_interval"
+
+    @staticmethod
+    def LOW_INTERVAL() -> str:
+        return "low_interval"
+
+    @staticmethod
+    def TAKE_PROFIT() -> str:
+        return "take_profit"
+
+    @staticmethod
+    def STOP_LOSS() -> str:
+        return "stop_loss"
+
+class cfg:
+    @staticmethod
+    def QUERIES_ENABLED() -> bool:
+        ### only turn on once the rollups were built for the existing entries (migration ledger-rollups)
+        return os.environ.get("TABLE_LEDGER_ROLLUP_QUERIES", "false").lower() == "true"
+
+def _safe_key(value:str) -> str:
+    ### characters a RowKey may not hold
+    for char in [ "/", "\\", "#", "?" ]:
+        value = value.replace(char, "_")
+    return value
+
+class LedgerRollups:
+    """ Hourly win / pnl totals of a transaction ledger, per tag and per overall / ticker / interval / spread,
+    in the table {ledger table}rollups. TableLedger adds every entry it logs, so a window's performance is a
+    merge of its hourly rows instead of a read of its entries. Hours are by entry timestamp, windows are
+    widened to whole hours. """
+
+    def __init__(self, table_service:TableServiceClient, ledger_table_name:str):
+        if table_service is None:
+            raise ValueError("table_service is required")
+        self.table_client:TableClient = table_service.create_table_if_not_exists(table_name=f"{ledger_table_name}rollups")
+
+    @staticmethod
+    def _bucket_key(timestamp:float) -> str:
+        return str(int(timestamp // consts.BUCKET_SECS()) * consts.BUCKET_SECS()).zfill(12)
+
+    @staticmethod
+    def _rows_of(entry:Entry) -> list[dict]:
+        """ the rollup rows an entry counts towards, each holding that entry's totals """
+        order = Order.from_dict(entry.data)
+        merchant_params = order.merchant_params
+        dimension_rows = [
+            { rkeys.DIMENSION(): dimensions.OVERALL(), rkeys.KEY(): "*" },
+            { rkeys.DIMENSION(): dimensions.TICKER(), rkeys.KEY(): order.ticker },
+            {
+                rkeys.DIMENSION(): dimensions.INTERVAL(),
+                rkeys.KEY(): f"{merchant_params.high_interval}-{merchant_params.low_interval}",
+                rkeys.HIGH_INTERVAL(): merchant_params.high_interval,
+                rkeys.LOW_INTERVAL(): merchant_params.low_interval
+            },
+            {
+                rkeys.DIMENSION(): dimensions.SPREAD(),
+                rkeys.KEY(): f"{merchant_params.takeprofit_percent}-{merchant_params.stoploss_percent}",
+                rkeys.TAKE_PROFIT(): merchant_params.takeprofit_percent,
+                rkeys.STOP_LOSS(): merchant_params.stoploss_percent
+            }
+        ]
+        rows = []
+        partition_key = LedgerRollups._bucket_key(entry.timestamp)
+        for tag in [ consts.ALL_TAG() ] + list(order.metadata.tags):
+            for dimension_row in dimension_rows:
+                rows.append({
+                    **dimension_row,
+                    "PartitionKey": partition_key,
+                    "RowKey": _safe_key(f"{tag}|{dimension_row.get(rkeys.DIMENSION())}|{dimension_row.get(rkeys.KEY())}"),
+                    rkeys.TAG(): tag,
+                    rkeys.TRADES(): 1,
+                    rkeys.WINS(): 1 if entry.amount > 0.0 else 0,
+                    rkeys.PNL(): float(entry.amount)
+                })
+        return rows
+
+    @staticmethod
+    def _aggregate(entries:list[Entry]) -> dict[tuple, dict]:
+        totals = {}
+        for entry in entries:
+            for row in LedgerRollups._rows_of(entry=entry):
+                row_key = (row.get("PartitionKey"), row.get("RowKey"))
+                if row_key not in totals:
+                    totals[row_key] = row
+                    continue
+                total = totals.get(row_key)
+                total[rkeys.TRADES()] += row.get(rkeys.TRADES())
+                total[rkeys.WINS()] += row.get(rkeys.WINS())
+                total[rkeys.PNL()] += row.get(rkeys.PNL())
+        return totals
+
+    def add(self, entries:list[Entry]) -> None:
+        """ adds the entries to their hourly rows - each row is a read-modify-write under its ETag """
+        for delta in LedgerRollups._aggregate(entries=entries).values():
+            self._add_to_row(delta=delta)
+
+    def _add_to_row(self, delta:dict) -> None:
+        for attempt in range(consts.UPDATE_ATTEMPTS()):
+            try:
+                row = self.table_client.get_entity(partition_key=delta.get("PartitionKey"), row_key=delta.get("RowKey"))
+            except ResourceNotFoundError:
+                try:
+                    self.table_client.create_entity(entity=delta)
+                    return
+                except ResourceExistsError:
+                    continue
+            row[rkeys.TRADES()] = row.get(rkeys.TRADES(), 0) + delta.get(rkeys.TRADES())
+            row[rkeys.WINS()] = row.get(rkeys.WINS(), 0) + delta.get(rkeys.WINS())
+            row[rkeys.PNL()] = row.get(rkeys.PNL(), 0.0) + delta.get(rkeys.PNL())
+            try:
+                self.table_client.update_entity(
+                    entity=row,
+                    mode=UpdateMode.REPLACE,
+                    etag=row.metadata.get("etag"),
+                    match_condition=MatchConditions.IfNotModified
+                )
+                return
+            except ResourceModifiedError:
+                logging.info(f"rollup {delta.get('PartitionKey')}/{delta.get('RowKey')} changed concurrently (attempt {attempt + 1}) - retrying")
+        raise ResourceModifiedError(f"could not update rollup {delta.get('PartitionKey')}/{delta.get('RowKey')} after {consts.UPDATE_ATTEMPTS()} attempts")
+
+    def rebuild(self, entries:list[Entry]) -> int:
+        """ replaces the rows of the hours the entries fall in with totals of exactly those entries -
+        for building rollups of an existing ledger, run it while nothing is logged. Returns the rows written. """
+        totals = LedgerRollups._aggregate(entries=entries)
+        for total in totals.values():
+            self.table_client.upsert_entity(entity=total, mode=UpdateMode.REPLACE)
+        return len(totals)
+
+    def analytics(self, from_timestamp:int, to_timestamp:int) -> dict[str, dict[str, BaseAnalytics]]:
+        """ tag -> the Analytics of every dimension, from the hours overlapping [from_timestamp, to_timestamp] """
+        rows = self.table_client.query_entities(
+            "PartitionKey ge @from_key and PartitionKey le @to_key",
+            parameters={ "from_key": self._bucket_key(from_timestamp), "to_key": self._bucket_key(to_timestamp) }
+        )
+        results = {}
+        for row in rows:
+            tag = row.get(rkeys.TAG())
+            if tag not in results:
+                results[tag] = {
+                    dimensions.OVERALL(): Analytics.Overall(),
+                    dimensions.TICKER(): Analytics.Tickers(),
+                    dimensions.INTERVAL(): Analytics.Intervals(),
+                    dimensions.SPREAD(): Analytics.Spreads()
+                }
+            dimension = row.get(rkeys.DIMENSION())
+            analytics = results.get(tag).get(dimension)
+            key = row.get(rkeys.KEY())
+            if key not in analytics.data:
+                analytics.data[key] = self._performance_of(row=row)
+            analytics.data.get(key).add_totals(
+                trades=float(row.get(rkeys.TRADES())),
+                winning_trades=float(row.get(rkeys.WINS())),
+                pnl=row.get(rkeys.PNL())
+            )
+        return results
+
+    @staticmethod
+    def _performance_of(row:dict):
+        dimension = row.get(rkeys.DIMENSION())
+        if dimension == dimensions.TICKER():
+            return Analytics.TickerPerformance(ticker=row.get(rkeys.KEY()))
+        if dimension == dimensions.INTERVAL():
+            return Analytics.IntervalPerformance(high_interval=row.get(rkeys.HIGH_INTERVAL()), low_interval=row.get(rkeys.LOW_INTERVAL()))
+        if dimension == dimensions.SPREAD():
+            return Analytics.SpreadPerformance(profit=row.get(rkeys.TAKE_PROFIT()), stop=row.get(rkeys.STOP_LOSS()))
+        return Analytics.OverallPerformance()
+
+    def performance_metrics(self, from_timestamp:int, to_timestamp:int) -> dict:
+        """ Analytics.all_performance_metrics shaped, over every entry in the window """
+        tag_analytics = self.analytics(from_timestamp=from_timestamp, to_timestamp=to_timestamp).get(consts.ALL_TAG())
+        if tag_analytics is None:
+            return Analytics.all_performance_metrics(ledger_entries=[])
+        return Analytics.performance_metrics(
+            overall=tag_analytics.get(dimensions.OVERALL()),
+            interval_analytics=tag_analytics.get(dimensions.INTERVAL()),
+            spread_analytics=tag_analytics.get(dimensions.SPREAD()),
+            ticker_analytics=tag_analytics.get(dimensions.TICKER())
+        )
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    def _entry(ticker:str, amount:float, timestamp:int, tags:list[str]) -> Entry:
+        ### just what Order.from_dict reads
+        return Entry(name=ticker, amount=amount, hash=None, timestamp=timestamp, test=True, data={
+            "ticker": ticker,
+            "sub_orders": { "main_order": { "id": "m", "api_rx": {}, "time": 0, "price": 10.0, "contracts": 1.0 }, "stop_loss": { "id": "s", "price": 9.0 }, "take_profit": { "id": "t", "price": 12.0 } },
+            "metadata": { "id": "o", "time_created": 0, "is_dry_run": True, "tags": tags },
+            "merchant_params": { "high_interval": "60", "low_interval": "5", "stoploss_percent": 1.0, "takeprofit_percent": 2.0, "notes": "", "version": 1, "strategy": "BRACKET" },
+            "projections": { "profit_without_fees": 0.0, "loss_without_fees": 0.0 },
+            "results": { "transaction": None, "complete": False }
+        })
+
+    class Test(unittest.TestCase):
+        def test_rollups_match_analytics(self):
+            entries = [
+                _entry("BTCUSDT", 2.0, 1700000000, [ "a" ]),
+                _entry("BTCUSDT", -1.0, 1700000100, []),
+                _entry("ETHUSDT", 3.0, 1700007200, [ "a" ])
+            ]
+            totals = LedgerRollups._aggregate(entries=entries)
+            ### 2 hours, All has 4 rows in the first hour (one ticker) and 4 in the second, tag a has the same
+            self.assertEqual(len(totals), 16)
+            table_service = unittest.mock.Mock()
+            table_service.create_table_if_not_exists.return_value.query_entities.return_value = list(totals.values())
+            rollups = LedgerRollups(table_service=table_service, ledger_table_name="fmorderledger")
+            self.assertEqual(
+                rollups.performance_metrics(from_timestamp=1700000000, to_timestamp=1700007200),
+                Analytics.all_performance_metrics(ledger_entries=entries)
+            )
+            tagged = rollups.analytics(from_timestamp=1700000000, to_timestamp=1700007200).get("a")
+            self.assertEqual(tagged.get(dimensions.OVERALL()).results()[0].total_pnl, 5.0)
+
+    unittest.main()
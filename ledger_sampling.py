@@ -0,0 +1,233 @@
+from ledger import Entry
+from merchant_order import Order
+from table_batch import TableWriteBatch
+from table_ledger import cfg as table_ledger_cfg
+from utils import consts as util_consts
+
+from azure.data.tables import TableClient, TableServiceClient
+
+import logging
+import os
+
+class cfg:
+    @staticmethod
+    def ENABLED() -> bool:
+        return os.environ.get("PERFORMANCE_LEDGER_SAMPLING", "true").lower() == "true"
+
+    @staticmethod
+    def MIN_PRICE_CHANGE_PERCENT() -> float:
+        min_change:str = os.environ.get("PERFORMANCE_LEDGER_MIN_PRICE_CHANGE_PERCENT", "0.5")
+        try:
+            min_change = float(min_change)
+        except ValueError:
+            raise ValueError(f"PERFORMANCE_LEDGER_MIN_PRICE_CHANGE_PERCENT must be a number, got {min_change}")
+        if min_change < 0.0:
+            raise ValueError(f"PERFORMANCE_LEDGER_MIN_PRICE_CHANGE_PERCENT must not be negative, got {min_change}")
+        return min_change
+
+    @staticmethod
+    def MAX_INTERVAL_SECS() -> int:
+        ### an open order is logged at least this often, moved or not
+        max_interval:str = os.environ.get("PERFORMANCE_LEDGER_MAX_INTERVAL_SECS", "3600")
+        if not max_interval.isnumeric():
+            raise ValueError(f"PERFORMANCE_LEDGER_MAX_INTERVAL_SECS must be a positive integer, got {max_interval}")
+        return int(max_interval)
+
+class consts:
+    @staticmethod
+    def PARTITION_KEY() -> str:
+        return "sample"
+
+    @staticmethod
+    def SNAPSHOT_KEY() -> str:
+        ### only in the data of a price tick - the timestamp of the order snapshot it refers to
+        return "snapshot"
+
+class skeys:
+    """ properties of an order's sampling state - RowKey is the order id """
+    @staticmethod
+    def PRICE() -> str:
+        return "price"
+
+    @staticmethod
+    def TIMESTAMP() -> str:
+        return "timestamp"
+
+    @staticmethod
+    def STATE() -> str:
+        return "state"
+
+    @staticmethod
+    def SNAPSHOT_TIMESTAMP() -> str:
+        return "snapshot_timestamp"
+
+def snapshot_max_age_secs() -> int:
+    """ a snapshot is logged again before the ledger purges it - the price ticks after it need one to refer to """
+    retention_secs = util_consts.ONE_DAY_IN_SECS(days=table_ledger_cfg.ENTRY_RETENTION_DAYS())
+    return max(retention_secs - util_consts.ONE_DAY_IN_SECS(), retention_secs // 2)
+
+def order_state(order:Order) -> str:
+    """ what a snapshot of order is kept for - a change to any of it is a state transition """
+    return "|".join([
+        str(order.results.complete),
+        str(order.sub_orders.main_order.contracts),
+        str(order.sub_orders.stop_loss.price),
+        str(order.sub_orders.take_profit.price)
+    ])
+
+def is_price_tick(data:dict) -> bool:
+    return consts.SNAPSHOT_KEY() in data
+
+def price_tick_data(order:Order, snapshot_timestamp:int) -> dict:
+    """ the data of a price tick - just what the ledger filters on, the rest is in the snapshot """
+    return {
+        "ticker": order.ticker,
+        "metadata": {
+            "id": order.metadata.id,
+            "is_dry_run": order.metadata.is_dry_run,
+            "tags": order.metadata.tags
+        },
+        "merchant_params": dict(order.merchant_params),
+        consts.SNAPSHOT_KEY(): snapshot_timestamp
+    }
+
+def snapshot_key(entry:Entry) -> tuple[str, int]:
+    """ (order id, snapshot timestamp) of the snapshot entry is or refers to """
+    if is_price_tick(data=entry.data):
+        return (entry.data["metadata"]["id"], entry.data[consts.SNAPSHOT_KEY()])
+    return (entry.data["metadata"]["id"], entry.timestamp)
+
+class Sample:
+    def __init__(self, order:Order, snapshot:bool, snapshot_timestamp:int):
+        self.order = order
+        self.snapshot = snapshot
+        self.snapshot_timestamp = snapshot_timestamp
+
+class PriceSampler:
+    """ Decides which positions checks make it into the performance ledger. An open order is logged when its price
+    moved PERFORMANCE_LEDGER_MIN_PRICE_CHANGE_PERCENT since it was last logged, or PERFORMANCE_LEDGER_MAX_INTERVAL_SECS
+    passed. The first time an order is seen, on every state transition (see order_state) and before its last snapshot
+    is purged (see snapshot_max_age_secs), the whole order is logged as a snapshot - the price ticks in between only refer to it.
+    What was last logged per order is kept in the table {ledger table}samples. """
+
+    def __init__(self, table_service:TableServiceClient, ledger_table_name:str):
+        if table_service is None:
+            raise ValueError("table_service is required")
+        self.table_client:TableClient = table_service.create_table_if_not_exists(table_name=f"{ledger_table_name}samples")
+        self._states:dict[str, dict] = {}
+
+    def select(self, orders:list[Order], current_prices:dict, now:int) -> list[Sample]:
+        """ the orders to log at now, in the order given """
+        if orders is None:
+            raise ValueError("orders is required")
+        self._states = {
+            entity.get("RowKey"): entity
+            for entity in self.table_client.query_entities("PartitionKey eq @pk", parameters={ "pk": consts.PARTITION_KEY() })
+        }
+        min_change = cfg.MIN_PRICE_CHANGE_PERCENT()
+        max_interval = cfg.MAX_INTERVAL_SECS()
+        snapshot_max_age = snapshot_max_age_secs()
+        samples = []
+        for order in orders:
+            state = self._states.get(order.metadata.id)
+            if order.results.complete or state is None or state.get(skeys.STATE()) != order_state(order=order) \
+                    or now - state.get(skeys.SNAPSHOT_TIMESTAMP()) >= snapshot_max_age:
+                samples.append(Sample(order=order, snapshot=True, snapshot_timestamp=now))
+                continue
+            if order.ticker not in current_prices:
+                raise ValueError(f"Current price not found for {order.ticker}")
+            price = current_prices.get(order.ticker)
+            last_price = state.get(skeys.PRICE())
+            change = 100.0 if last_price == 0.0 else abs(price - last_price) / abs(last_price) * 100.0
+            if change >= min_change or now - state.get(skeys.TIMESTAMP()) >= max_interval:
+                samples.append(Sample(order=order, snapshot=False, snapshot_timestamp=state.get(skeys.SNAPSHOT_TIMESTAMP())))
+        logging.info(f"sampled {len(samples)} of {len(orders)} positions for the performance ledger")
+        return samples
+
+    def record(self, samples:list[Sample], orders:list[Order], current_prices:dict, now:int) -> None:
+        """ keeps what was logged once it is in the ledger - orders that are complete or gone are forgotten """
+        batch = TableWriteBatch(table_client=self.table_client)
+        for sample in samples:
+            order = sample.order
+            if order.results.complete:
+                batch.delete(partition_key=consts.PARTITION_KEY(), row_key=order.metadata.id)
+                continue
+            batch.upsert(entity={
+                "PartitionKey": consts.PARTITION_KEY(),
+                "RowKey": order.metadata.id,
+                skeys.PRICE(): current_prices.get(order.ticker),
+                skeys.TIMESTAMP(): now,
+                skeys.STATE(): order_state(order=order),
+                skeys.SNAPSHOT_TIMESTAMP(): sample.snapshot_timestamp
+            })
+        order_ids = set([ order.metadata.id for order in orders ])
+        for row_key in self._states.keys():
+            if row_key not in order_ids:
+                batch.delete(partition_key=consts.PARTITION_KEY(), row_key=row_key)
+        batch.flush()
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    def _order(id:str, complete:bool = False, stop_loss:float = 9.0) -> Order:
+        ### just what Order.from_dict reads
+        return Order.from_dict({
+            "ticker": "BTCUSDT",
+            "sub_orders": { "main_order": { "id": "m", "api_rx": {}, "time": 0, "price": 10.0, "contracts": 1.0 }, "stop_loss": { "id": "s", "price": stop_loss }, "take_profit": { "id": "t", "price": 12.0 } },
+            "metadata": { "id": id, "time_created": 0, "is_dry_run": True },
+            "merchant_params": { "high_interval": "60", "low_interval": "5", "stoploss_percent": 1.0, "takeprofit_percent": 2.0, "notes": "", "version": 1, "strategy": "BRACKET" },
+            "projections": { "profit_without_fees": 0.0, "loss_without_fees": 0.0 },
+            "results": { "transaction": None, "complete": complete }
+        })
+
+    class Test(unittest.TestCase):
+        def test_sampling_policy(self):
+            table_service = unittest.mock.Mock()
+            table_client = table_service.create_table_if_not_exists.return_value
+            sampler = PriceSampler(table_service=table_service, ledger_table_name="ledger")
+            state = lambda id, price, timestamp, stop_loss = 9.0: {
+                "RowKey": id, skeys.PRICE(): price, skeys.TIMESTAMP(): timestamp,
+                skeys.STATE(): order_state(order=_order(id=id, stop_loss=stop_loss)), skeys.SNAPSHOT_TIMESTAMP(): 500
+            }
+            table_client.query_entities.return_value = [
+                state("flat", 10.0, 1000),
+                state("moved", 10.0, 1000),
+                state("stale", 10.0, 0),
+                state("trailed", 10.0, 1000, stop_loss=8.0),
+                state("gone", 10.0, 1000)
+            ]
+            orders = [ _order(id="new"), _order(id="flat"), _order(id="moved"), _order(id="stale"), _order(id="trailed") ]
+            with unittest.mock.patch.dict(os.environ, { "PERFORMANCE_LEDGER_MAX_INTERVAL_SECS": "600" }):
+                samples = sampler.select(orders=orders, current_prices={ "BTCUSDT": 10.01 }, now=1200)
+                moved = sampler.select(orders=[ _order(id="moved") ], current_prices={ "BTCUSDT": 10.1 }, now=1200)
+            self.assertEqual([ (sample.order.metadata.id, sample.snapshot) for sample in samples ], [ ("new", True), ("stale", False), ("trailed", True) ])
+            self.assertEqual(samples[1].snapshot_timestamp, 500)
+            self.assertEqual(len(moved), 1)
+            self.assertFalse(moved[0].snapshot)
+            sampler.record(samples=samples, orders=orders, current_prices={ "BTCUSDT": 10.01 }, now=1200)
+            operations = table_client.submit_transaction.call_args.args[0]
+            ### three states kept, the one of the order that is gone dropped
+            self.assertEqual(sorted([ (op[0].value, op[1].get("RowKey")) for op in operations ]), [ ("delete", "gone"), ("upsert", "new"), ("upsert", "stale"), ("upsert", "trailed") ])
+
+        def test_snapshot_logged_again_before_purge(self):
+            table_service = unittest.mock.Mock()
+            sampler = PriceSampler(table_service=table_service, ledger_table_name="ledger")
+            now = util_consts.ONE_DAY_IN_SECS(days=60)
+            table_service.create_table_if_not_exists.return_value.query_entities.return_value = [ {
+                "RowKey": "1", skeys.PRICE(): 10.0, skeys.TIMESTAMP(): now - 60,
+                skeys.STATE(): order_state(order=_order(id="1")), skeys.SNAPSHOT_TIMESTAMP(): now - util_consts.ONE_DAY_IN_SECS(days=29)
+            } ]
+            with unittest.mock.patch.dict(os.environ, { "TABLE_LEDGER_ENTRY_RETENTION_DAYS": "30" }):
+                samples = sampler.select(orders=[ _order(id="1") ], current_prices={ "BTCUSDT": 10.0 }, now=now)
+            self.assertEqual([ (sample.snapshot, sample.snapshot_timestamp) for sample in samples ], [ (True, now) ])
+
+        def test_price_tick_refers_to_snapshot(self):
+            order = _order(id="1")
+            tick = Entry(name="BTCUSDT", amount=10.0, hash=None, timestamp=900, data=price_tick_data(order=order, snapshot_timestamp=500))
+            snapshot = Entry(name="BTCUSDT", amount=10.0, hash=None, timestamp=500, data=order.__dict__)
+            self.assertTrue(is_price_tick(data=tick.data))
+            self.assertFalse(is_price_tick(data=snapshot.data))
+            self.assertEqual(snapshot_key(entry=tick), snapshot_key(entry=snapshot))
+
+    unittest.main()
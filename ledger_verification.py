@@ -0,0 +1,94 @@
+from ledger import Entry, Signer
+
+import concurrent.futures
+import logging
+import os
+
+class cfg:
+    @staticmethod
+    def WORKERS() -> int:
+        ### 1 keeps verification in-process
+        workers:str = os.environ.get("TABLE_LEDGER_VERIFY_WORKERS", "1")
+        if not workers.isnumeric() or int(workers) < 1:
+            raise ValueError(f"TABLE_LEDGER_VERIFY_WORKERS must be a positive integer, got {workers}")
+        return int(workers)
+
+class consts:
+    @staticmethod
+    def MIN_CHUNK_SIZE() -> int:
+        ### below this, starting worker processes costs more than the hashing
+        return 512
+
+def _verify_chunk(signer:Signer, prev_entry:Entry, entries:list[Entry], offset:int) -> list[int]:
+    mismatches = []
+    for i, entry in enumerate(entries):
+        if signer.sign(new_entry=entry, prev_entry=prev_entry) != entry.hash:
+            mismatches.append(offset + i)
+        prev_entry = entry
+    return mismatches
+
+def _chunk_bounds(entry_ct:int, workers:int) -> list[tuple[int, int]]:
+    chunk_size = max(consts.MIN_CHUNK_SIZE(), -(-entry_ct // workers))
+    return [ (start, min(start + chunk_size, entry_ct)) for start in range(0, entry_ct, chunk_size) ]
+
+def verify_chain(entries:list[Entry], signer:Signer, prev_entry:Entry = None, workers:int = None) -> list[int]:
+    """ Indexes into entries (sorted by log_timestamp) whose hash does not match the one signed onto the entry before it.
+    prev_entry is the entry before entries[0], None if there is none.
+    Each signature only depends on the stored hash of the previous entry, so the entries are split into contiguous
+    chunks - each one seeded with the last entry of the chunk before it - and hashed on a process pool. """
+    if entries is None:
+        raise ValueError("entries is required")
+    if signer is None:
+        raise ValueError("signer is required")
+    workers = cfg.WORKERS() if workers is None else workers
+    bounds = _chunk_bounds(entry_ct=len(entries), workers=workers)
+    if workers <= 1 or len(bounds) <= 1:
+        return _verify_chunk(signer=signer, prev_entry=prev_entry, entries=entries, offset=0)
+    logging.info(f"verifying {len(entries)} ledger entries in {len(bounds)} chunks on {workers} processes")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_verify_chunk, signer, prev_entry if start == 0 else entries[start - 1], entries[start:end], start)
+            for start, end in bounds
+        ]
+        mismatches = []
+        for future in futures:
+            mismatches.extend(future.result())
+    return mismatches
+
+if __name__ == "__main__":
+    import unittest
+    from table_ledger import HashSigner
+
+    def _chain(count:int, signer:Signer) -> list[Entry]:
+        entries = []
+        prev_entry = None
+        for i in range(count):
+            entry = Entry(name=f"entry-{i}", amount=float(i), hash=None, timestamp=1700000000 + i, test=True)
+            entry.hash = signer.sign(new_entry=entry, prev_entry=prev_entry)
+            entries.append(entry)
+            prev_entry = entry
+        return entries
+
+    class Test(unittest.TestCase):
+        def test_chunk_bounds(self):
+            self.assertEqual(_chunk_bounds(entry_ct=10, workers=4), [ (0, 10) ])
+            self.assertEqual(_chunk_bounds(entry_ct=1100, workers=2), [ (0, 550), (550, 1100) ])
+            self.assertEqual(_chunk_bounds(entry_ct=0, workers=2), [])
+
+        def test_sequential_and_parallel_agree(self):
+            signer = HashSigner()
+            entries = _chain(count=1200, signer=signer)
+            entries[3].hash = "tampered"
+            entries[700].hash = "tampered"
+            ### a tampered hash also breaks the entry signed onto it
+            expected = [ 3, 4, 700, 701 ]
+            self.assertEqual(verify_chain(entries=entries, signer=signer, workers=1), expected)
+            self.assertEqual(verify_chain(entries=entries, signer=signer, workers=3), expected)
+
+        def test_prev_entry_seeds_first_entry(self):
+            signer = HashSigner()
+            entries = _chain(count=3, signer=signer)
+            self.assertEqual(verify_chain(entries=entries[1:], signer=signer, prev_entry=entries[0], workers=1), [])
+            self.assertEqual(verify_chain(entries=entries[1:], signer=signer, workers=1), [ 0 ])
+
+    unittest.main()
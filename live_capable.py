@@ -1,8 +1,18 @@
 from abc import ABC, abstractmethod
 
+class SymbolInfo:
+    def __init__(self, symbol: str, base_asset: str, quote_asset: str, base_scale: float, filters: list[dict] = []):
+        self.symbol = symbol
+        self.base_asset = base_asset
+        self.quote_asset = quote_asset
+        self.base_scale = base_scale
+        self.filters = filters
+
 class AssetInfoResult:
-    def __init__(self, base_scale: float):
+    def __init__(self, base_scale: float, symbols: dict[str, SymbolInfo] = None):
+        ### base_scale is the one of the first symbol asked for
         self.base_scale = base_scale
+        self.symbols = {} if symbols is None else symbols
 
 class AssetBalance:
     def __init__(self, asset: str, available: float):
@@ -1,3 +1,4 @@
+import concurrent.futures
 import copy
 import json
 import logging
@@ -5,7 +6,9 @@ import os
 import eventkit
 import uuid
 
-from azure.data.tables import TableServiceClient
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import TableClient, TableServiceClient, TransactionOperation
 
 from bracket_strategy import BracketStrategy
 from trailing_stop_strategy import TrailingStopStrategy
@@ -13,11 +16,15 @@ from live_capable import LiveCapable
 from merchant_keys import keys, state, action
 from merchant_order import Order, Results
 from merchant_signal import MerchantSignal
+from order_repository import OrderRepository
+from open_book import OpenBook, BookEvaluation, categories as book_categories
 from order_capable import Broker, MarketOrderable, StopMarketOrderable, OrderCancelable, DryRunnable
 from order_strategy import OrderStrategy
 from order_strategies import OrderStrategies, strategy_enum_from_str
 from security import order_digest
 from signal_enhancements import apply_all
+from table_batch import TableWriteBatch
+from trigger_index import TriggerIndexes, position_key, order_key
 from transactions import calculate_pnl, Transaction, TransactionAction
 from utils import unix_timestamp_secs, unix_timestamp_ms, roll_dice_10percent, null_or_empty, consts as util_consts
 
@@ -47,7 +54,25 @@ class cfg:
     @staticmethod
     def TABLE_NAME():
         return "flowmerchant"
+
+    @staticmethod
+    def CHECK_POSITIONS_WORKERS() -> int:
+        ### 1 evaluates positions serially (the original behaviour)
+        default_workers = min((os.cpu_count() or 1) * 2, 10)
+        workers:str = os.environ.get("MERCHANT_CHECK_POSITIONS_WORKERS", str(default_workers))
+        if not workers.isnumeric():
+            raise ValueError(f"MERCHANT_CHECK_POSITIONS_WORKERS must be an integer, got {workers}")
+        workers = int(workers)
+        if workers < 1:
+            raise ValueError(f"MERCHANT_CHECK_POSITIONS_WORKERS must be at least 1, got {workers}")
+        return workers
     
+class consts:
+    @staticmethod
+    def STATE_ROW_KEY() -> str:
+        ### a merchant's state lives at PartitionKey=merchant id, RowKey=this - so it can be point read
+        return "state"
+
 class SellResult:
     def __init__(self, order: Order, transaction: Transaction, additional_data: dict = {}) -> None:
         if order is None:
@@ -71,6 +96,10 @@ class PositionsCheckResult:
     def __str__(self) -> str:
         return json.dumps(self.__dict__)
         
+### shared by every Merchant in the process so unchanged positions are not re-indexed on each check
+_trigger_indexes = TriggerIndexes()
+_handles_price_change_by_strategy:dict[str, bool] = {}
+
 class Merchant:
     def __init__(self, table_service: TableServiceClient, broker: Broker) -> None:
         if table_service is None:
@@ -83,9 +112,13 @@ class Merchant:
         self.table_service = table_service
         self.broker = broker
         self._order_strategy = None
+        self._storage_batch:TableWriteBatch = None
+        self._order_batch:TableWriteBatch = None
+        self._digest_batch:TableWriteBatch = None
         
         self.TABLE_NAME = cfg.TABLE_NAME()
         table_service.create_table_if_not_exists(table_name=self.TABLE_NAME)
+        self.order_repository = OrderRepository(table_service=table_service)
 
         self.on_signal_received = eventkit.Event("on_signal_received")
         self.on_state_change = eventkit.Event("on_state_change")
@@ -101,8 +134,14 @@ class Merchant:
         identifier = "".join(identifier.split())
         if len(identifier) > 200:
             raise ValueError("identifier cannot be more than 200 characters")
-        current_positions = self._query_current_positions()
-        for position in current_positions:
+        order_entity = self.order_repository.find_by_digest(digest=identifier)
+        if order_entity is not None:
+            position = self._read_position(merchant_id=order_entity.get(keys.PARTITIONKEY()))
+            if position is not None:
+                return Order.from_dict(OrderRepository.from_entity(order_entity)), position
+            logging.warning(f"order {identifier} belongs to merchant {order_entity.get(keys.PARTITIONKEY())} which no longer exists")
+        ### merchants not yet migrated still keep their orders in broker_data
+        for position in self._query_legacy_positions():
             position_order_list = json.loads(position.get(keys.BROKER_DATA()))
             for order_dict in position_order_list:
                 order = Order.from_dict(order_dict)
@@ -199,8 +238,13 @@ class Merchant:
         return check_result
 
     def _remove_order_from_storage(self, position:dict, removal_order:Order) -> None:
-        position_order_list = json.loads(position.get(keys.BROKER_DATA()))
         removal_id = order_digest(removal_order)
+        ### a check cycle that failed between writing order entities and clearing broker_data leaves an order in both
+        self.order_repository.remove(merchant_id=position.get(keys.PARTITIONKEY()), order_id=removal_order.metadata.id, digest=removal_id)
+        position_order_list = json.loads(position.get(keys.BROKER_DATA(), "[]"))
+        if removal_order.metadata.id not in [ order_key(order_dict) for order_dict in position_order_list ]:
+            logging.info(f"Removed order {removal_order} from storage")
+            return
         new_order_list = []
         for order_dict in position_order_list:
             if order_digest(Order.from_dict(order_dict)) != removal_id:
@@ -254,6 +298,25 @@ class Merchant:
         current_prices = self.broker.get_current_prices(symbols=tickers)
         database.update({ "current_prices": current_prices })
 
+        ### every stored order is parsed once and evaluated against the prices in a single vectorized pass
+        order_entities = self.order_repository.list_by_merchant()
+        order_lists = { }
+        stored_order_ids = { }
+        fingerprints = { }
+        for position in current_positions:
+            merchant_order_entities = order_entities.get(position.get(keys.PARTITIONKEY()), [])
+            order_lists[position_key(position)] = OrderRepository.orders_of(position=position, order_entities=merchant_order_entities)
+            stored_order_ids[position_key(position)] = set([ entity.get(keys.ROWKEY()) for entity in merchant_order_entities ])
+            fingerprints[position_key(position)] = self._orders_fingerprint(position=position, order_entities=merchant_order_entities)
+        book_evaluation = OpenBook.from_order_lists(order_lists=order_lists.values()).evaluate(prices=current_prices)
+        database.update({ 
+            "order_lists": order_lists, 
+            "stored_order_ids": stored_order_ids, 
+            "fingerprints": fingerprints, 
+            "book": book_evaluation 
+        })
+        logging.info(f"open book: {len(book_evaluation.book)} orders, {book_evaluation.count(book_categories.STOP_LOSS())} at stop loss, {book_evaluation.count(book_categories.TAKE_PROFIT())} at take profit, unrealized pnl {book_evaluation.total_pnl()}")
+
         results = {
             "monitored_tickers": tickers,
             "positions": {
@@ -265,28 +328,154 @@ class Merchant:
             "current_prices": current_prices
         }
         
-        for position in current_positions:
+        ### positions sharing a ticker are checked serially, in storage order, by the same worker 
+        ### so that two merchants never race each other on the same asset at the broker
+        position_groups = self._group_positions_by_ticker(positions=current_positions)
+        worker_ct = min(cfg.CHECK_POSITIONS_WORKERS(), len(position_groups))
+        
+        ### updated positions are staged and written once at the end of the cycle, 
+        ### one transaction per partition rather than one round trip per position
+        self._storage_batch = TableWriteBatch(table_client=self.table_service.get_table_client(table_name=self.TABLE_NAME))
+        self._order_batch = TableWriteBatch(table_client=self.order_repository.table_client)
+        self._digest_batch = TableWriteBatch(table_client=self.order_repository.digest_table_client)
+        group_results = []
+        try:
+            if worker_ct > 1:
+                logging.info(f"checking {len(current_positions)} positions across {len(position_groups)} tickers with {worker_ct} workers")
+                with self._create_worker_pool(max_worker_count=worker_ct) as worker_pool:
+                    futures = [ 
+                        worker_pool.submit(self._check_position_group, positions=position_group, database=database) 
+                        for position_group in position_groups 
+                    ]
+                    ### collect in submission order (sorted by ticker) so the results are deterministic
+                    group_results = [ future.result() for future in futures ]
+            else:
+                group_results = [ 
+                    self._check_position_group(positions=position_group, database=database) 
+                    for position_group in position_groups 
+                ]
+        finally:
+            ### always flush - orders may already have been sold at the broker even if a later position failed.
+            ### orders first, a legacy broker_data list is only cleared once its orders are stored on their own
+            ### - and their digest index before them, see OrderRepository.add
+            storage_batch, order_batch, digest_batch = self._storage_batch, self._order_batch, self._digest_batch
+            self._storage_batch, self._order_batch, self._digest_batch = None, None, None
+            digest_batch.flush()
+            order_batch.flush()
+            storage_batch.flush()
+
+        for group_result in group_results:
+            results["positions"]["losers"].extend(group_result["losers"])
+            results["positions"]["winners"].extend(group_result["winners"])
+            results["positions"]["leaders"].extend(group_result["leaders"])
+            results["positions"]["laggards"].extend(group_result["laggards"])
+        return results
+
+    def _group_positions_by_ticker(self, positions:list[dict]) -> list[list[dict]]:
+        groups = { }
+        for position in positions:
+            ticker = position.get(keys.TICKER())
+            if ticker not in groups:
+                groups[ticker] = []
+            groups[ticker].append(position)
+        ordered_tickers = sorted(groups.keys(), key=lambda ticker: "" if ticker is None else ticker)
+        return [ groups.get(ticker) for ticker in ordered_tickers ]
+
+    def _check_position_group(self, positions:list[dict], database:dict) -> dict:
+        results = {
+            "losers": [],
+            "winners": [],
+            "leaders": [],
+            "laggards": []
+        }
+        current_prices = database.get("current_prices")
+        priced_positions = []
+        for position in positions:
             ticker = position.get(keys.TICKER())
             if ticker not in current_prices:
                 logging.warning(f"check_positions() - no price for {ticker} - {current_prices}")
             else:
-                check_result = self._check_position(
-                                    position=position, 
-                                    database=database
-                                )
-
-                if check_result.get("updated", False):
-                    self._sync_with_storage(state=position)
-                
-                results["positions"]["losers"].extend(check_result["orders"]["losers"])
-                results["positions"]["winners"].extend(check_result["orders"]["winners"])
-                results["positions"]["leaders"].extend(check_result["orders"]["leaders"])
-                results["positions"]["laggards"].extend(check_result["orders"]["laggards"])
-        return results
+                priced_positions.append(position)
+        if len(priced_positions) == 0:
+            return results
+
+        ### positions are grouped by ticker, so one trigger index answers which orders crossed a threshold
+        ticker = priced_positions[0].get(keys.TICKER())
+        trigger_index = _trigger_indexes.for_ticker(ticker)
+        trigger_index.retain_positions(position_keys=[ position_key(position) for position in positions ])
+        order_lists = []
+        for position in priced_positions:
+            order_list = database.get("order_lists").get(position_key(position))
+            trigger_index.sync_position(
+                position_key=position_key(position), 
+                fingerprint=database.get("fingerprints").get(position_key(position)), 
+                order_list=order_list
+            )
+            order_lists.append(order_list)
+
+        triggered_by_position = { }
+        for triggered_position_key, order_id in trigger_index.crossed(current_price=current_prices.get(ticker)):
+            if triggered_position_key not in triggered_by_position:
+                triggered_by_position[triggered_position_key] = set()
+            triggered_by_position[triggered_position_key].add(order_id)
+
+        for position, order_list in zip(priced_positions, order_lists):
+            check_result = self._check_position(
+                                position=position, 
+                                database=database,
+                                order_list=order_list,
+                                triggered_order_ids=triggered_by_position.get(position_key(position), set())
+                            )
 
+            if self._store_checked_orders(
+                    position=position, 
+                    order_list=order_list, 
+                    new_order_list=check_result.get("order_list"),
+                    stored_order_ids=database.get("stored_order_ids").get(position_key(position))
+                ):
+                ### the stored version is unknown until the writes are flushed - resync on the next check
+                trigger_index.sync_position(position_key=position_key(position), fingerprint=None, order_list=check_result.get("order_list"))
+            
+            results["losers"].extend(check_result["orders"]["losers"])
+            results["winners"].extend(check_result["orders"]["winners"])
+            results["leaders"].extend(check_result["orders"]["leaders"])
+            results["laggards"].extend(check_result["orders"]["laggards"])
+        return results
 
-    def _check_position(self, position:dict, database:dict) -> dict:
-        order_list = json.loads(position.get(keys.BROKER_DATA()))
+    def _store_checked_orders(self, position:dict, order_list:list[dict], new_order_list:list[dict], stored_order_ids:set) -> bool:
+        """ stages a write for every order the check changed, added (a legacy order moving out of broker_data) 
+        or closed. Returns whether anything was staged """
+        merchant_id = position.get(keys.PARTITIONKEY())
+        previous_orders = { order_key(order_dict): order_dict for order_dict in order_list }
+        remaining_ids = set()
+        changed = False
+        for order_dict in new_order_list:
+            order_id = order_key(order_dict)
+            remaining_ids.add(order_id)
+            ### untouched orders are passed through as the very same dict
+            if order_id not in stored_order_ids or previous_orders.get(order_id) is not order_dict:
+                order_entity = OrderRepository.to_entity(merchant_id=merchant_id, order_dict=order_dict)
+                if order_id not in stored_order_ids:
+                    self._digest_batch.upsert(entity=OrderRepository.to_digest_entity(order_entity=order_entity))
+                self._order_batch.upsert(entity=order_entity)
+                changed = True
+        for order_id in stored_order_ids - remaining_ids:
+            self._order_batch.delete(partition_key=merchant_id, row_key=order_id)
+            changed = True
+        if len(json.loads(position.get(keys.BROKER_DATA(), "[]"))) != 0:
+            position.update({ keys.BROKER_DATA(): json.dumps([ ]) })
+            self._sync_with_storage(state=position)
+            changed = True
+        return changed
+
+    def _orders_fingerprint(self, position:dict, order_entities:list[dict]) -> str:
+        versions = sorted([ f"{entity.get(keys.ROWKEY())}:{entity.metadata.get('etag')}" for entity in order_entities ])
+        return f"{position.get(keys.BROKER_DATA(), '[]')}|{','.join(versions)}"
+
+    def _check_position(self, position:dict, database:dict, order_list:list[dict], triggered_order_ids:set = None) -> dict:
+        """ only orders in triggered_order_ids (stop loss or take profit crossed) or whose strategy
+        reacts to every price change are built into an Order - the rest stay as stored.
+        The orders still open afterwards are returned under order_list """
         results = { 
             "updated": False,
             "orders": {
@@ -302,6 +491,16 @@ class Merchant:
         new_order_list = []
 
         for order_dict in order_list:
+            if triggered_order_ids is not None and order_key(order_dict) not in triggered_order_ids and not self._handles_price_change(order_dict=order_dict):
+                self._price_unchanged(
+                    order_dict=order_dict,
+                    results=results,
+                    new_order_list=new_order_list,
+                    current_price=current_prices.get(order_dict.get("ticker")),
+                    book=database.get("book")
+                )
+                continue
+
             order:Order = Order.from_dict(order_dict)
             main_order = order.sub_orders.main_order
             stop_loss_order = order.sub_orders.stop_loss
@@ -363,10 +562,11 @@ class Merchant:
                         merchant_params={ 
                             "current_price": current_price,
                             "dry_run_order": is_dry_run
-                        }
+                        },
+                        book=database.get("book")
                     )
                     
-        position.update({ keys.BROKER_DATA(): json.dumps(new_order_list) })
+        results.update({ "order_list": new_order_list })
 
         return results
     
@@ -402,7 +602,7 @@ class Merchant:
         else:
             results["orders"]["losers"].append(order_result.__dict__)
 
-    def _price_changed(self, order:Order, results:dict, strategy:OrderStrategy, new_order_list:list[dict], merchant_params:dict) -> None:
+    def _price_changed(self, order:Order, results:dict, strategy:OrderStrategy, new_order_list:list[dict], merchant_params:dict, book:BookEvaluation = None) -> None:
         handle_pc_result = strategy.handle_price_change(
                                 broker=self.broker,
                                 order=order,
@@ -417,12 +617,32 @@ class Merchant:
             else:
                 results["orders"]["losers"].append(order_result.__dict__)
         else:
-            if merchant_params.get("current_price") > order.sub_orders.main_order.price:
+            if self._is_leader(order_dict=order, current_price=merchant_params.get("current_price"), book=book):
                 results["orders"]["leaders"].append(order_result.__dict__)
             else:
                 results["orders"]["laggards"].append(order_result.__dict__)
             new_order_list.append(order_result.__dict__)
 
+    def _price_unchanged(self, order_dict:dict, results:dict, new_order_list:list[dict], current_price:float, book:BookEvaluation = None) -> None:
+        if self._is_leader(order_dict=order_dict, current_price=current_price, book=book):
+            results["orders"]["leaders"].append(order_dict)
+        else:
+            results["orders"]["laggards"].append(order_dict)
+        new_order_list.append(order_dict)
+
+    def _is_leader(self, order_dict:dict, current_price:float, book:BookEvaluation = None) -> bool:
+        category = None if book is None else book.category(order_id=order_key(order_dict))
+        if category in [ book_categories.LEADER(), book_categories.LAGGARD() ]:
+            return category == book_categories.LEADER()
+        ### not in the book (or evaluated as triggered but left open by the strategy) - compare directly
+        return current_price > order_dict.get("sub_orders").get("main_order").get("price")
+
+    def _handles_price_change(self, order_dict:dict) -> bool:
+        strategy_str = order_dict.get("merchant_params").get("strategy")
+        if strategy_str not in _handles_price_change_by_strategy:
+            strategy = self._strategy_from_enum(strategy_enum_from_str(strategy_str))
+            _handles_price_change_by_strategy[strategy_str] = strategy.handles_price_change()
+        return _handles_price_change_by_strategy.get(strategy_str)
         
     def _check_broker(self) -> bool:
         result = True
@@ -438,16 +658,25 @@ class Merchant:
         table_client = self.table_service.get_table_client(table_name=self.TABLE_NAME)
         return list(table_client.list_entities())
 
+    def _query_legacy_positions(self) -> list:
+        """ the merchants that still keep orders in broker_data """
+        table_client = self.table_service.get_table_client(table_name=self.TABLE_NAME)
+        return list(table_client.query_entities(
+            f"{keys.BROKER_DATA()} ne @empty",
+            parameters={ "empty": json.dumps([ ]) }
+        ))
+
     def _purge_old_positions(self) -> dict:
         table_client =  self.table_service.get_table_client(table_name=self.TABLE_NAME)
         all_positions = list(table_client.list_entities())
+        merchants_with_orders = self.order_repository.merchants_with_orders()
         one_month_old_ts = unix_timestamp_secs() - util_consts.ONE_MONTH_IN_SECS()
         for position in all_positions:
             last_action_time = position.get(keys.LAST_ACTION_TIME())
             if one_month_old_ts > last_action_time:
                 orders = position.get(keys.BROKER_DATA())
                 orders = json.loads(orders)
-                if len(orders) != 0:
+                if len(orders) != 0 or position.get(keys.PARTITIONKEY()) in merchants_with_orders:
                     logging.warning(f"position {position} has orders {orders} - not deleting!")
                 else:
                     logging.info(f"deleting old position {position}")
@@ -457,12 +686,11 @@ class Merchant:
                     )
             
     
-    # def _create_worker_pool(self) -> concurrent.futures.ThreadPoolExecutor:
-    #     max_worker_count = min(os.cpu_count() * 2, 10)
-    #     return concurrent.futures.ThreadPoolExecutor(
-    #         max_workers=max_worker_count,
-    #         thread_name_prefix="FlowMerc"
-    #     )
+    def _create_worker_pool(self, max_worker_count:int) -> concurrent.futures.ThreadPoolExecutor:
+        return concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_worker_count,
+            thread_name_prefix="FlowMerc"
+        )
     
     ### Signals
 
@@ -499,28 +727,129 @@ class Merchant:
     
     def load_state_from_storage(self) -> None:
         logging.debug(f"load_state_from_storage()")
-        query_filter = f"{keys.MERCHANT_ID()} eq '{self.merchant_id()}'"
         table_client = self.table_service.get_table_client(table_name=self.TABLE_NAME)
-        rows = list(table_client.query_entities(query_filter))
+        row = self._read_state(table_client=table_client)
+        if row is None:
+            logging.info(f"no open merchants found for {self.merchant_id()}, creating new...")
+            self.status(state.SHOPPING())
+            self.id(str(uuid.uuid4()))
+            self.broker_data(json.dumps([ ]))
+            try:
+                table_client.create_entity(entity=self.state)
+                return
+            except ResourceExistsError:
+                ### a concurrent signal created this merchant first - use theirs
+                logging.warning(f"merchant {self.merchant_id()} was created concurrently, loading it instead")
+                row = self._read_state(table_client=table_client)
+                if row is None:
+                    raise ValueError(f"merchant {self.merchant_id()} exists but could not be read")
+        logging.info(f"found existing merchant - id={self.merchant_id()}")
+        self.status(row.get(keys.STATUS()))
+        self.id(row.get(keys.ID()))
+        self.partition_key(row.get(keys.PARTITIONKEY()))
+        self.row_key(row.get(keys.ROWKEY()))
+        self.last_action_time(row.get(keys.LAST_ACTION_TIME()))
+        self.version(row.get(keys.VERSION()))
+        self.broker_data(row.get(keys.BROKER_DATA()))
+
+    def _read_position(self, merchant_id:str) -> dict:
+        ### the check cycle moves orders out of broker_data without touching the state row key,
+        ### so the merchant of an order may still have a legacy state row
+        table_client = self.table_service.get_table_client(table_name=self.TABLE_NAME)
+        try:
+            return self._read_state(table_client=table_client, merchant_id=merchant_id)
+        except ResourceNotFoundError:
+            return None
+
+    def _read_state(self, table_client:TableClient, merchant_id:str = None) -> dict:
+        merchant_id = self.merchant_id() if merchant_id is None else merchant_id
+        try:
+            return table_client.get_entity(partition_key=merchant_id, row_key=consts.STATE_ROW_KEY())
+        except ResourceNotFoundError:
+            pass
+        ### states written before the point-read keying have RowKey = ticker-signal id, but the same
+        ### PartitionKey, so this stays a single-partition query - migrate on first touch
+        legacy_filter = f"{keys.PARTITIONKEY()} eq @merchant_id and {keys.ROWKEY()} ne @row_key"
+        rows = list(table_client.query_entities(
+            legacy_filter, 
+            parameters={ "merchant_id": merchant_id, "row_key": consts.STATE_ROW_KEY() }
+        ))
         if len(rows) > 1:
-            raise ValueError(f"Multiple open merchants found for {self.merchant_id()}")
-        else:
-            if len(rows) == 1:
-                logging.info(f"found existing merchant - id={self.merchant_id()}")
-                row = rows[0]
-                self.status(row.get(keys.STATUS()))
-                self.id(row.get(keys.ID()))
-                self.partition_key(row.get(keys.PARTITIONKEY()))
-                self.row_key(row.get(keys.ROWKEY()))
-                self.last_action_time(row.get(keys.LAST_ACTION_TIME()))
-                self.version(row.get(keys.VERSION()))
-                self.broker_data(row.get(keys.BROKER_DATA()))
+            raise ValueError(f"Multiple open merchants found for {merchant_id}")
+        if len(rows) == 0:
+            return None
+        ### not migrated most likely because a concurrent signal migrated it already - its row is read either way
+        Merchant._migrate_legacy_state(table_client=table_client, legacy_row=rows[0])
+        return table_client.get_entity(partition_key=merchant_id, row_key=consts.STATE_ROW_KEY())
+
+    @staticmethod
+    def _migrate_legacy_state(table_client:TableClient, legacy_row:dict) -> bool:
+        """ True if the legacy row was moved to the point-read row key """
+        migrated_row = dict(legacy_row)
+        migrated_row[keys.ROWKEY()] = consts.STATE_ROW_KEY()
+        try:
+            ### same partition, so the copy and the delete commit (or fail) together
+            table_client.submit_transaction([
+                (TransactionOperation.CREATE, migrated_row),
+                (TransactionOperation.DELETE, legacy_row, { "match_condition": MatchConditions.IfNotModified })
+            ])
+            logging.info(f"migrated merchant state {legacy_row.get(keys.PARTITIONKEY())}/{legacy_row.get(keys.ROWKEY())} to row key {consts.STATE_ROW_KEY()}")
+            return True
+        except Exception as e:
+            logging.warning(f"could not migrate merchant state {legacy_row.get(keys.PARTITIONKEY())}/{legacy_row.get(keys.ROWKEY())} - {e}")
+            return False
+
+    @staticmethod
+    def migrate_state_row_keys(table_service:TableServiceClient) -> int:
+        """ moves every merchant state still keyed by ticker-signal id to the point-read row key, returns how many were migrated """
+        table_client = table_service.get_table_client(table_name=cfg.TABLE_NAME())
+        legacy_rows = list(table_client.query_entities(
+            f"{keys.ROWKEY()} ne @row_key", 
+            parameters={ "row_key": consts.STATE_ROW_KEY() }
+        ))
+        migrated = 0
+        left_behind = []
+        for legacy_row in legacy_rows:
+            if Merchant._migrate_legacy_state(table_client=table_client, legacy_row=legacy_row):
+                migrated += 1
             else:
-                logging.info(f"no open merchants found for {self.merchant_id()}, creating new...")
-                self.status(state.SHOPPING())
-                self.id(str(uuid.uuid4()))
-                self.broker_data(json.dumps([ ]))
-                table_client.create_entity(entity=self.state)
+                ### e.g. a second legacy row in a partition already migrated - it needs a look by hand
+                left_behind.append(f"{legacy_row.get(keys.PARTITIONKEY())}/{legacy_row.get(keys.ROWKEY())}")
+        if len(left_behind) != 0:
+            logging.error(f"{len(left_behind)} legacy merchant states were left behind: {left_behind}")
+        logging.info(f"migrated {migrated} of {len(legacy_rows)} legacy merchant states")
+        return migrated
+
+    @staticmethod
+    def migrate_orders_to_entities(table_service:TableServiceClient) -> int:
+        """ moves the orders kept in each merchant's broker_data into their own order entities, returns how many orders were moved """
+        table_client = table_service.get_table_client(table_name=cfg.TABLE_NAME())
+        order_repository = OrderRepository(table_service=table_service)
+        migrated = 0
+        for position in list(table_client.list_entities()):
+            for attempt in range(3):
+                order_list = json.loads(position.get(keys.BROKER_DATA(), "[]"))
+                if len(order_list) == 0:
+                    break
+                merchant_id = position.get(keys.PARTITIONKEY())
+                for order_dict in order_list:
+                    order_repository.save(merchant_id=merchant_id, order=order_dict)
+                position[keys.BROKER_DATA()] = json.dumps([ ])
+                try:
+                    ### only clear the list if nobody changed it while the orders were copied
+                    table_client.update_entity(entity=position, etag=position.metadata.get("etag"), match_condition=MatchConditions.IfNotModified)
+                    migrated += len(order_list)
+                    break
+                except ResourceModifiedError:
+                    logging.warning(f"merchant {merchant_id} changed during migration (attempt {attempt + 1}) - retrying")
+                    position = table_client.get_entity(partition_key=merchant_id, row_key=position.get(keys.ROWKEY()))
+                    ### orders removed in the meantime must not come back as entities
+                    current_ids = set([ order_key(order_dict) for order_dict in json.loads(position.get(keys.BROKER_DATA(), "[]")) ])
+                    for order_dict in order_list:
+                        if order_key(order_dict) not in current_ids:
+                            order_repository.remove(merchant_id=merchant_id, order_id=order_key(order_dict))
+        logging.info(f"migrated {migrated} orders out of broker_data")
+        return migrated
 
     def load_config_from_env(self) -> None:
         """ NOTE - env will OVERRIDE signal configs """
@@ -535,7 +864,7 @@ class Merchant:
         self.order_strategy(self._strategy_from_signal(signal=signal))
         self.state[keys.MERCHANT_ID()] = self.merchant_id()
         self.partition_key(self.merchant_id())
-        self.row_key(f"{signal.ticker()}-{signal.id()}")
+        self.row_key(consts.STATE_ROW_KEY())
         self.version(signal.version())
         self.ticker(signal.ticker())
         self.suggested_stoploss(signal.suggested_stoploss())
@@ -694,16 +1023,17 @@ class Merchant:
         logging.debug(f"_sync_with_storage()")
         if state is None:
             state = self.state
+        if self._storage_batch is not None:
+            logging.info(f"staging the following state for storage: {state}")
+            self._storage_batch.update(entity=state)
+            return
         client = self.table_service.get_table_client(table_name=self.TABLE_NAME)
         logging.info(f"persisting the following state to storage: {state}")
         client.update_entity(entity=state)
 
     def _handle_orders(self, signal: MerchantSignal) -> None:
         order_result = self._place_orders(signal)
-        order_list = json.loads(self.broker_data())
-        order_list.append(order_result.__dict__)
-        new_order_list = json.dumps(order_list)
-        self.broker_data(broker_data=new_order_list)
+        self.order_repository.add(merchant_id=self.partition_key(), order=order_result)
         self.on_order_placed.emit(self.merchant_id(), order_result)
 
     def _place_orders(self, signal: MerchantSignal) -> Order:
@@ -752,7 +1082,7 @@ class Merchant:
     def _has_open_orders(self) -> bool:
         orders_str = self.broker_data()
         orders_list = json.loads(orders_str)
-        return len(orders_list) != 0
+        return len(orders_list) != 0 or self.order_repository.has_orders(merchant_id=self.partition_key())
 
     ## properties
 
@@ -867,3 +1197,144 @@ class Merchant:
         if main_broker is not None:
             self.broker = main_broker
         return self.broker
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    from order_repository import okeys
+
+    def _order_dict(id:str) -> dict:
+        return {
+            "ticker": "BTCUSDT",
+            "sub_orders": {
+                "main_order": { "id": "m", "api_rx": {}, "time": 1000, "price": 10.0, "contracts": 1.0 },
+                "stop_loss": { "id": "s", "api_rx": {}, "time": 1000, "price": 9.0, "contracts": 1.0 },
+                "take_profit": { "id": "t", "api_rx": {}, "time": 1000, "price": 12.0, "contracts": 1.0 }
+            },
+            "metadata": { "id": id, "time_created": 1000, "is_dry_run": True, "tags": [] },
+            "merchant_params": { "high_interval": "60", "low_interval": "5", "stoploss_percent": 1.0, "takeprofit_percent": 2.0, "notes": "", "version": 1, "strategy": "BRACKET" },
+            "projections": { "profit_without_fees": 1.0, "loss_without_fees": -1.0 },
+            "results": { "transaction": None, "complete": False, "additional_data": {} }
+        }
+
+    def _merchant(merchant_id:str = "m1") -> Merchant:
+        merchant = Merchant(table_service=unittest.mock.Mock(), broker=unittest.mock.Mock())
+        merchant._id = merchant_id
+        return merchant
+
+    class Test(unittest.TestCase):
+        def test_read_state_point_read(self):
+            table_client = unittest.mock.Mock()
+            table_client.get_entity.return_value = { keys.PARTITIONKEY(): "m1", keys.ROWKEY(): consts.STATE_ROW_KEY() }
+            row = _merchant()._read_state(table_client=table_client)
+            self.assertEqual(row.get(keys.ROWKEY()), consts.STATE_ROW_KEY())
+            table_client.query_entities.assert_not_called()
+            table_client.submit_transaction.assert_not_called()
+
+        def test_read_state_migrates_legacy_row(self):
+            legacy_row = { keys.PARTITIONKEY(): "m1", keys.ROWKEY(): "BTCUSDT-signal" }
+            migrated_row = { keys.PARTITIONKEY(): "m1", keys.ROWKEY(): consts.STATE_ROW_KEY() }
+            table_client = unittest.mock.Mock()
+            table_client.get_entity.side_effect = [ ResourceNotFoundError("no state row"), migrated_row ]
+            table_client.query_entities.return_value = [ legacy_row ]
+            row = _merchant()._read_state(table_client=table_client)
+            self.assertEqual(row, migrated_row)
+            operations = table_client.submit_transaction.call_args.args[0]
+            self.assertEqual([ (op[0], op[1].get(keys.ROWKEY())) for op in operations ], [
+                (TransactionOperation.CREATE, consts.STATE_ROW_KEY()),
+                (TransactionOperation.DELETE, "BTCUSDT-signal")
+            ])
+            self.assertEqual(operations[1][2], { "match_condition": MatchConditions.IfNotModified })
+
+        def test_read_state_failed_migration_reads_new_row(self):
+            ### a concurrent signal migrated the row first - the transaction fails, its row is used
+            legacy_row = { keys.PARTITIONKEY(): "m1", keys.ROWKEY(): "BTCUSDT-signal" }
+            migrated_row = { keys.PARTITIONKEY(): "m1", keys.ROWKEY(): consts.STATE_ROW_KEY() }
+            table_client = unittest.mock.Mock()
+            table_client.get_entity.side_effect = [ ResourceNotFoundError("no state row"), migrated_row ]
+            table_client.query_entities.return_value = [ legacy_row ]
+            table_client.submit_transaction.side_effect = ResourceExistsError("already migrated")
+            self.assertEqual(_merchant()._read_state(table_client=table_client), migrated_row)
+
+        def test_read_state_failed_migration_without_new_row(self):
+            legacy_row = { keys.PARTITIONKEY(): "m1", keys.ROWKEY(): "BTCUSDT-signal" }
+            table_client = unittest.mock.Mock()
+            table_client.get_entity.side_effect = ResourceNotFoundError("no state row")
+            table_client.query_entities.return_value = [ legacy_row ]
+            table_client.submit_transaction.side_effect = ResourceModifiedError("legacy row changed")
+            with self.assertRaises(ResourceNotFoundError):
+                _merchant()._read_state(table_client=table_client)
+
+        def test_migrate_state_row_keys_counts_committed(self):
+            table_service = unittest.mock.Mock()
+            table_client = table_service.get_table_client.return_value
+            table_client.query_entities.return_value = [
+                { keys.PARTITIONKEY(): "m1", keys.ROWKEY(): "BTCUSDT-signal" },
+                ### a second legacy row of a partition already migrated
+                { keys.PARTITIONKEY(): "m2", keys.ROWKEY(): "ETHUSDT-signal" }
+            ]
+            table_client.submit_transaction.side_effect = [ [], ResourceExistsError("already exists") ]
+            self.assertEqual(Merchant.migrate_state_row_keys(table_service=table_service), 1)
+            table_client.get_entity.assert_not_called()
+
+        def test_sell_order_of_legacy_keyed_merchant(self):
+            ### orders moved out of broker_data by a check cycle, the state row still has its ticker-signal row key
+            merchant = _merchant(merchant_id=None)
+            order_entity = OrderRepository.to_entity(merchant_id="m1", order_dict=_order_dict(id="o1"))
+            merchant.order_repository = unittest.mock.Mock()
+            merchant.order_repository.find_by_digest.return_value = order_entity
+            legacy_row = { keys.PARTITIONKEY(): "m1", keys.ROWKEY(): "BTCUSDT-signal", keys.BROKER_DATA(): "[]" }
+            migrated_row = dict(legacy_row, **{ keys.ROWKEY(): consts.STATE_ROW_KEY() })
+            table_client = merchant.table_service.get_table_client.return_value
+            table_client.get_entity.side_effect = [ ResourceNotFoundError("no state row"), migrated_row ]
+            table_client.query_entities.return_value = [ legacy_row ]
+            merchant._query_legacy_positions = unittest.mock.Mock()
+            order, position = merchant.find_order_by_identifier(identifier=order_entity.get(okeys.DIGEST()))
+            self.assertEqual(order.metadata.id, "o1")
+            self.assertEqual(position, migrated_row)
+            merchant._query_legacy_positions.assert_not_called()
+            merchant._sell_order = unittest.mock.Mock()
+            merchant.sell(order=order, position=position)
+            merchant.order_repository.remove.assert_called_once_with(merchant_id="m1", order_id="o1", digest=order_entity.get(okeys.DIGEST()))
+
+        def test_remove_order_stored_twice(self):
+            ### the check cycle wrote the order entity, then failed to clear broker_data
+            merchant = _merchant()
+            merchant.order_repository = unittest.mock.Mock()
+            merchant._sync_with_storage = unittest.mock.Mock()
+            order = Order.from_dict(_order_dict(id="o1"))
+            position = { keys.PARTITIONKEY(): "m1", keys.BROKER_DATA(): json.dumps([ _order_dict(id="o1"), _order_dict(id="o2") ]) }
+            merchant._remove_order_from_storage(position=position, removal_order=order)
+            merchant.order_repository.remove.assert_called_once_with(merchant_id="m1", order_id="o1", digest=order_digest(order))
+            self.assertEqual([ order_key(order_dict) for order_dict in json.loads(position.get(keys.BROKER_DATA())) ], [ "o2" ])
+            merchant._sync_with_storage.assert_called_once()
+
+        def test_migrated_orders_are_indexed(self):
+            merchant = _merchant()
+            merchant._order_batch = unittest.mock.Mock()
+            merchant._digest_batch = unittest.mock.Mock()
+            merchant._sync_with_storage = unittest.mock.Mock()
+            legacy_order, stored_order = _order_dict(id="o1"), _order_dict(id="o2")
+            position = { keys.PARTITIONKEY(): "m1", keys.BROKER_DATA(): json.dumps([ legacy_order ]) }
+            changed = merchant._store_checked_orders(
+                position=position,
+                order_list=[ legacy_order, stored_order ],
+                new_order_list=[ legacy_order, stored_order ],
+                stored_order_ids=set([ "o2" ])
+            )
+            self.assertTrue(changed)
+            ### only the order moving out of broker_data - the stored one is already indexed
+            index_entity = merchant._digest_batch.upsert.call_args.kwargs.get("entity")
+            self.assertEqual(merchant._digest_batch.upsert.call_count, 1)
+            self.assertEqual((index_entity.get(keys.ROWKEY()), index_entity.get("merchant_id")), ("o1", "m1"))
+            self.assertEqual(merchant._order_batch.upsert.call_args.kwargs.get("entity").get(okeys.DIGEST()), index_entity.get(keys.PARTITIONKEY()))
+            self.assertEqual(position.get(keys.BROKER_DATA()), "[]")
+
+        def test_read_state_missing(self):
+            table_client = unittest.mock.Mock()
+            table_client.get_entity.side_effect = ResourceNotFoundError("no state row")
+            table_client.query_entities.return_value = []
+            self.assertIsNone(_merchant()._read_state(table_client=table_client))
+
+    unittest.main()
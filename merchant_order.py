@@ -60,13 +60,14 @@ class SubOrders(dict):
         return equals
 
 class Metadata(dict):
-    def __init__(self, id:str, time_created:int, is_dry_run:bool, security_type:SecurityTypes, tags:list[str] = []):
+    def __init__(self, id:str, time_created:int, is_dry_run:bool, security_type:SecurityTypes, tags:list[str] = [], digest:str = None):
         super().__init__(
             id=id, 
             time_created=time_created, 
             is_dry_run=is_dry_run,
             security_type=security_type,
-            tags=tags
+            tags=tags,
+            digest=digest
         )
         if null_or_empty(id):
             raise ValueError(f"Metadata id is empty")
@@ -88,6 +89,12 @@ class Metadata(dict):
         self.is_dry_run = is_dry_run
         self.security_type = security_type
         self.tags = tags
+        ### the sell identifier, see security.order_digest - None for orders created before it was kept
+        self.digest = digest
+
+    def set_digest(self, digest:str) -> None:
+        self.digest = digest
+        self["digest"] = digest
 
     def __eq__(self, value) -> bool:
         if not isinstance(value, Metadata):
@@ -298,7 +305,8 @@ class Order(dict):
             time_created=order_dict["metadata"]["time_created"],
             is_dry_run=order_dict["metadata"]["is_dry_run"],
             security_type="crypto" if "security_type" not in order_dict["metadata"] else order_dict["metadata"]["security_type"],
-            tags=[] if "tags" not in order_dict["metadata"] else order_dict["metadata"]["tags"]
+            tags=[] if "tags" not in order_dict["metadata"] else order_dict["metadata"]["tags"],
+            digest=order_dict["metadata"].get("digest")
         )
         merchant_params = MerchantParams(
             high_interval=order_dict["merchant_params"]["high_interval"],
@@ -1,5 +1,7 @@
 from ledger import Ledger, Entry
 from ledger_analytics import Analytics
+from ledger_rollups import LedgerRollups, cfg as rollup_cfg
+from ledger_sampling import is_price_tick, snapshot_key
 from merchant_order import Order
 
 import logging
@@ -17,13 +19,20 @@ class LedgerOrdersResult:
             "assets": {}
         }
 
-    def add_ledger_entry(self, entry:Entry) -> None:
+    def add_ledger_entry(self, entry:Entry, snapshot:Entry = None) -> None:
+        """ snapshot is the order snapshot a price tick refers to (see ledger_sampling) """
         ticker = entry.name
+        order_data = entry.data
+        if is_price_tick(data=entry.data):
+            if snapshot is None:
+                logging.warning(f"Order snapshot {snapshot_key(entry=entry)} not found, skipping its price tick")
+                return
+            order_data = snapshot.data
         if ticker not in self.data["assets"]:
             self.data["assets"].update({ticker: {"closed": {}, "open": {}}})
         
         asset_dict:dict = self.data["assets"].get(ticker)
-        entry_order:Order = Order.from_dict(entry.data)
+        entry_order:Order = Order.from_dict(order_data)
         asset_closed_orders:dict = asset_dict.get("closed")
         asset_open_orders:dict = asset_dict.get("open")
         
@@ -90,7 +99,11 @@ class LedgerOrdersResult:
 
 class MerchantPerformance:
     
-    def for_ledger_transactions(self, ledger:Ledger, from_timestamp:int, to_timestamp:int, filters:dict = {}) -> LedgerTransactionsResult:
+    def for_ledger_transactions(self, ledger:Ledger, from_timestamp:int, to_timestamp:int, filters:dict = {}, rollups:LedgerRollups = None) -> LedgerTransactionsResult:
+        if rollups is not None and rollup_cfg.QUERIES_ENABLED() and self._unfiltered(filters=filters):
+            ### rollups are by whole hours and cannot be filtered
+            metrics:dict = rollups.performance_metrics(from_timestamp=from_timestamp, to_timestamp=to_timestamp)
+            return LedgerTransactionsResult(metrics=metrics)
         entries:list[Entry] = self._fetch_entries(ledger=ledger, from_timestamp=from_timestamp, to_timestamp=to_timestamp, filters=filters)
         metrics:dict = Analytics.all_performance_metrics(ledger_entries=entries)
         return LedgerTransactionsResult(metrics=metrics)
@@ -98,11 +111,36 @@ class MerchantPerformance:
     def for_ledger_orders(self, ledger:Ledger, from_timestamp:int, to_timestamp:int, filters:dict = {}) -> LedgerOrdersResult:
         entries = self._fetch_entries(ledger=ledger, from_timestamp=from_timestamp, to_timestamp=to_timestamp, filters=filters)
         result = LedgerOrdersResult()
+        snapshots:dict[tuple, Entry] = {}
         for entry in entries:
-            result.add_ledger_entry(entry=entry)
+            key = snapshot_key(entry=entry)
+            if not is_price_tick(data=entry.data):
+                snapshots[key] = entry
+            elif key not in snapshots:
+                ### the snapshot was logged before the window
+                snapshots[key] = self._fetch_snapshot(ledger=ledger, price_tick=entry)
+            result.add_ledger_entry(entry=entry, snapshot=snapshots.get(key))
         result.convert_orders_to_lists()
         return result
+
+    def _fetch_snapshot(self, ledger:Ledger, price_tick:Entry) -> Entry:
+        order_id, snapshot_timestamp = snapshot_key(entry=price_tick)
+        for entry in ledger.get_entries(name=price_tick.name, from_timestamp=snapshot_timestamp, to_timestamp=snapshot_timestamp):
+            if not is_price_tick(data=entry.data) and snapshot_key(entry=entry) == (order_id, snapshot_timestamp):
+                return entry
+        return None
     
+    def _unfiltered(self, filters:dict) -> bool:
+        if filters is None:
+            return True
+        for filter_value in filters.values():
+            if isinstance(filter_value, dict):
+                if not self._unfiltered(filters=filter_value):
+                    return False
+            elif filter_value is not None:
+                return False
+        return True
+
     def _fetch_entries(self, ledger:Ledger, from_timestamp:int, to_timestamp:int, filters:dict = {}) -> list[Entry]:
         if ledger is None:
             raise ValueError("ledger is None")
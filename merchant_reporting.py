@@ -1,10 +1,13 @@
 from discord import DiscordClient, WebhookMessage, Thumbnail, Author, Footer, Field, Embed, colors
-from ledger import Ledger, Entry, Signer
+from ledger import Ledger, Entry, Signer, LedgerConflictError
 from ledger_analytics import Analytics
+from ledger_rollups import LedgerRollups, cfg as rollup_cfg, consts as rollup_consts, dimensions as rollup_dimensions
+from ledger_sampling import PriceSampler, Sample, price_tick_data
 from merchant_keys import keys as mkeys
 from merchant_order import Order
 from merchant_signal import MerchantSignal
 from merchant import PositionsCheckResult
+from open_book import OpenBook
 from personas import database, main_author, next_laggard_persona, next_leader_persona, next_loser_persona, next_winner_persona
 from security import order_digest
 from transactions import multiply, calculate_percent_diff, calculate_pnl
@@ -66,6 +69,12 @@ class cfg:
                 raise ValueError(f"Invalid timeframe: {timeframe}, must be one of {['Hours', 'Days']}")
         return results
 
+    def LEDGER_APPEND_ATTEMPTS() -> int:
+        attempts = os.environ.get("MERCHANT_REPORTING_LEDGER_APPEND_ATTEMPTS", "3")
+        if not attempts.isnumeric() or int(attempts) < 1:
+            raise ValueError(f"MERCHANT_REPORTING_LEDGER_APPEND_ATTEMPTS must be a positive integer, got {attempts}")
+        return int(attempts)
+
 class MerchantReporting:
 
     def report_problem(self, msg:str, exc:Exception = None) -> None:
@@ -316,7 +325,7 @@ class MerchantReporting:
             self.title = title
             self.seconds_in_past = seconds_in_past
 
-    def report_ledger_performance(self, ledger:Ledger, signer:Signer) -> None:
+    def report_ledger_performance(self, ledger:Ledger, signer:Signer, rollups:LedgerRollups = None) -> None:
         if not cfg.REPORTING_LEDGER_PERFORMANCE():
             logging.warning("reporting ledger performance is disabled")
             return
@@ -341,6 +350,13 @@ class MerchantReporting:
             
         now_timestamp = unix_timestamp_secs()
         for report_timeframe in report_timeframes:
+            if rollups is not None and rollup_cfg.QUERIES_ENABLED():
+                tag_analytics = rollups.analytics(
+                    from_timestamp=now_timestamp - report_timeframe.seconds_in_past, 
+                    to_timestamp=now_timestamp
+                )
+                self.report_performance_for_analytics(title=report_timeframe.title, tag_analytics=tag_analytics)
+                continue
             ledger_entries:list[Entry] = ledger.get_entries(
                                             name=None, 
                                             from_timestamp=now_timestamp - report_timeframe.seconds_in_past,
@@ -359,7 +375,17 @@ class MerchantReporting:
                                 title=f"{title} - {tag}"
                             )
             embeds.append(embed)
+        self._send_performance_report(embeds=embeds)
 
+    def report_performance_for_analytics(self, tag_analytics:dict, title:str) -> None:
+        """ same report as report_performance_for_entries, from LedgerRollups.analytics """
+        embeds:list[Embed] = [ self._embed_from_analytics(title=f"{title} - {rollup_consts.ALL_TAG()}", analytics=tag_analytics.get(rollup_consts.ALL_TAG())) ]
+        for tag, analytics in tag_analytics.items():
+            if tag != rollup_consts.ALL_TAG():
+                embeds.append(self._embed_from_analytics(title=f"{title} - {tag}", analytics=analytics))
+        self._send_performance_report(embeds=embeds)
+
+    def _send_performance_report(self, embeds:list[Embed]) -> None:
         embed_limit = 10
         if len(embeds) > embed_limit:
             logging.warning(f"reached discord embed limit of {embed_limit} - truncating report...")
@@ -391,9 +417,31 @@ class MerchantReporting:
         return results
 
     def _embed_from_ledger_entries(self, entries:list[Entry], title:str) -> Embed:
+        if len(entries) == 0:
+            return self._embed_from_analytics(title=title, analytics=None)
+        interval_analytics = Analytics.Intervals()
+        spread_analytics = Analytics.Spreads()
+        ticker_analytics = Analytics.Tickers()
+        overall = Analytics.Overall()
+
+        for ledger_entry in entries:
+            interval_analytics.add(ledger_entry=ledger_entry)
+            spread_analytics.add(ledger_entry=ledger_entry)
+            ticker_analytics.add(ledger_entry=ledger_entry)
+            overall.add(ledger_entry=ledger_entry)
+
+        return self._embed_from_analytics(title=title, analytics={
+            rollup_dimensions.OVERALL(): overall,
+            rollup_dimensions.INTERVAL(): interval_analytics,
+            rollup_dimensions.SPREAD(): spread_analytics,
+            rollup_dimensions.TICKER(): ticker_analytics
+        })
+
+    def _embed_from_analytics(self, title:str, analytics:dict) -> Embed:
+        """ analytics is keyed by the ledger_rollups dimensions, None when there were no entries """
         author = main_author(db=database())
 
-        if len(entries) == 0:
+        if analytics is None:
             logging.info(f"No entries found in ledger - will skip analytics and performance reporting")
             return Embed(
                 author=Author(
@@ -418,16 +466,10 @@ class MerchantReporting:
 
             fields = []
 
-            interval_analytics = Analytics.Intervals()
-            spread_analytics = Analytics.Spreads()
-            ticker_analytics = Analytics.Tickers()
-            overall = Analytics.Overall()
-
-            for ledger_entry in entries:
-                interval_analytics.add(ledger_entry=ledger_entry)
-                spread_analytics.add(ledger_entry=ledger_entry)
-                ticker_analytics.add(ledger_entry=ledger_entry)
-                overall.add(ledger_entry=ledger_entry)
+            interval_analytics = analytics.get(rollup_dimensions.INTERVAL())
+            spread_analytics = analytics.get(rollup_dimensions.SPREAD())
+            ticker_analytics = analytics.get(rollup_dimensions.TICKER())
+            overall = analytics.get(rollup_dimensions.OVERALL())
             
             overall_results = overall.results()
             overall_results = [_overall for _overall in overall_results if _overall.total_trades >= min_trades]
@@ -513,15 +555,23 @@ class MerchantReporting:
                     )
         return self._embed_from_ledger_entries(entries=entries, title=title)
 
-    def report_to_ledger(self, positions:list[dict], ledger:Ledger, signer:Signer, current_prices:dict = {}) -> None:
+    def report_to_ledger(self, positions:list[dict], ledger:Ledger, signer:Signer, current_prices:dict = {}, sampler:PriceSampler = None) -> None:
+        """ without a sampler every position is logged as a whole order, with one only the sampled ones are (see ledger_sampling) """
         if ledger is None:
             raise ValueError("ledger is None")
         if signer is None:
             raise ValueError("signer is None")
         if positions is None:
             raise ValueError("positions is None")
-        for position in positions:
-            order = Order.from_dict(position)
+        now = unix_timestamp_secs()
+        orders = [ Order.from_dict(position) for position in positions ]
+        if sampler is None:
+            samples = [ Sample(order=order, snapshot=True, snapshot_timestamp=now) for order in orders ]
+        else:
+            samples = sampler.select(orders=orders, current_prices=current_prices, now=now)
+        new_entries:list[Entry] = []
+        for sample in samples:
+            order = sample.order
 
             ###
             # TODO: there is a difference in meaning for "amount" if the order is finalized
@@ -540,24 +590,37 @@ class MerchantReporting:
                     profit_price=0.0
                 )
                 amount = pnl_dict.get("current_without_fees")
-                timestamp = unix_timestamp_secs()
+                timestamp = now
             else:
                 if order.ticker not in current_prices:
                     raise ValueError(f"Current price not found for {order.ticker}")
                 amount = current_prices.get(order.ticker)
-                timestamp = unix_timestamp_secs()
+                timestamp = now
 
-            last_entry = ledger.get_latest_entry()
-            new_entry = Entry(
+            new_entries.append(Entry(
                 name=order.ticker,
                 amount=amount,
                 hash=None,
                 test=order.metadata.is_dry_run,
                 timestamp=timestamp,
-                data=order.__dict__
-            )
-            new_entry.hash = signer.sign(new_entry=new_entry, prev_entry=last_entry)
-            ledger.log(entry=new_entry)
+                data=order.__dict__ if sample.snapshot else price_tick_data(order=order, snapshot_timestamp=sample.snapshot_timestamp)
+            ))
+        self._append_to_ledger(entries=new_entries, ledger=ledger, signer=signer)
+        if sampler is not None:
+            sampler.record(samples=samples, orders=orders, current_prices=current_prices, now=now)
+
+    def _append_to_ledger(self, entries:list[Entry], ledger:Ledger, signer:Signer) -> None:
+        if len(entries) == 0:
+            return
+        attempts = cfg.LEDGER_APPEND_ATTEMPTS()
+        for attempt in range(1, attempts + 1):
+            try:
+                ledger.log_many(entries=entries, signer=signer)
+                return
+            except LedgerConflictError as e:
+                if attempt == attempts:
+                    raise
+                logging.warning(f"ledger append conflict for {len(entries)} entries (attempt {attempt} of {attempts}) - signing again: {e}")
 
     def _embed(self, author:str, author_icon:str, title:str, desc:str, color:int, footer:str, footer_icon:str, thumbnail:str, positions:list, prices:dict) -> Embed:
         icon_current_price = "\U000027A1"
@@ -572,12 +635,10 @@ class MerchantReporting:
             main_price = order.sub_orders.main_order.price
             main_contracts = order.sub_orders.main_order.contracts
             return (current_price - main_price) * main_contracts
-        
-        def _sort_current_profit(order_dict:dict, prices:dict) -> float:
-            order = Order.from_dict(order_dict)
-            return _current_profit(order, prices.get(order.ticker))
-        
-        positions.sort(key=lambda x: _sort_current_profit(order_dict=x, prices=prices), reverse=True)
+
+        ### highest current profit first, computed for all positions at once
+        sorted_rows = OpenBook(orders=positions).evaluate(prices=prices).order_by_pnl(descending=True)
+        positions[:] = [ positions[row] for row in sorted_rows ]
 
         fields = []
         discord_max_fields = 5
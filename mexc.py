@@ -4,13 +4,16 @@ import hashlib
 import json     
 import logging
 import os
-import requests
 
 from urllib.parse import urlencode
 
 from broker_exceptions import ApiError, OrderAlreadyFilledError, OversoldError, InvalidQuantityScale
-from live_capable import LiveCapable, AssetInfoResult, BalancesResult, AssetBalance
+from broker_transport import BrokerTransport, shared_transport, timeouts
+from exchange_info import ExchangeInfoCache, store_for
+from fill_resolution import Fill, FillResolver, fill_from_trades, sources
+from live_capable import LiveCapable, AssetInfoResult, BalancesResult, AssetBalance, SymbolInfo
 from order_capable import Broker, MarketOrderable, LimitOrderable, OrderCancelable, DryRunnable
+from price_cache import PriceSnapshotCache
 from utils import unix_timestamp_ms, unix_timestamp_secs, null_or_empty
 
 ### NOTES
@@ -40,6 +43,15 @@ class ApiErrorResponse:
 
 class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCapable, DryRunnable):
 
+    def __init__(self, transport:BrokerTransport = None):
+        ### instances share one keep-alive connection pool unless given their own
+        self.transport = shared_transport(broker_name="MEXC") if transport is None else transport
+        self.fill_resolver = FillResolver(
+            order_fill_fn=self._order_fill,
+            trade_fill_fn=self._trade_fill,
+            snapshot_price_fn=lambda ticker: self.get_current_prices(symbols=[ticker]).get(ticker)
+        )
+
     def get_name(self) -> str:
         return "MEXC"
 
@@ -50,7 +62,9 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
         )
     
     def get_balances(self) -> BalancesResult:
-        acct_info = self._api_get_account_info()
+        return self._balances_from(acct_info=self._api_get_account_info())
+
+    def _balances_from(self, acct_info: dict) -> BalancesResult:
         if "balances" not in acct_info:
             raise ValueError(f"expected key balances to be in {acct_info}")
         balances = acct_info.get("balances")
@@ -79,8 +93,16 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
         )
     
     def standardize_market_order(self, market_order_result: dict) -> dict:
-        override_with_cur_price:bool = True
+        contracts = float(self._check_market_order(market_order_result=market_order_result).get("origQty"))
+        price = market_order_result.get("price")
+        if self._needs_fill(market_order_result=market_order_result):
+            ticker = market_order_result.get("__ticker")
+            fill = self.fill_resolver.resolve(ticker=ticker, broker_order_id=market_order_result.get("orderId"), ordered_contracts=contracts)
+            logging.info(f"{ticker} market order {market_order_result.get('orderId')} filled {fill.contracts} at {fill.price()} (from {fill.source}), MEXC reported {price}")
+            contracts, price = fill.contracts, fill.price()
+        return self._standardized_market_order(market_order_result=market_order_result, contracts=contracts, price=price)
 
+    def _check_market_order(self, market_order_result: dict) -> dict:
         if "clientOrderId" not in market_order_result:
             raise ValueError(f"expected key clientOrderId to be in {market_order_result}")
         if "orderId" not in market_order_result:
@@ -91,27 +113,45 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
             raise ValueError(f"expected key origQty to be in {market_order_result}")
         if "price" not in market_order_result:
             raise ValueError(f"expected key price to be in {market_order_result}")
-        if override_with_cur_price:
-            ### TODO
-            ### ### There is a bug in the MEXC API where the market order price is not correct
-            ### This is true for BOTH SELLs and BUYs
-            ### https://github.com/mexcdevelop/mexc-api-sdk/issues/77
-            ### temporarily use current price instead, this will incur a cost to our API usage
-            if "__ticker" not in market_order_result:
-                raise ValueError(f"expected key __ticker to be in {market_order_result}")
-            original_price = market_order_result.get("price")
-            ticker = market_order_result.get("__ticker")
-            symbols = [ ticker ]
-            prices = self.get_current_prices(symbols=symbols)
-            market_order_result["price"] = prices.get(ticker)
-            logging.warning(f"Due to MEXC bug - https://github.com/mexcdevelop/mexc-api-sdk/issues/77 - overriding the ORDER price from {original_price} to {prices.get(ticker)} for {ticker}. In dry run mode, these values will be equal.")
+        return market_order_result
+
+    def _needs_fill(self, market_order_result: dict) -> bool:
+        ### There is a bug in the MEXC API where the market order price is not correct
+        ### This is true for BOTH SELLs and BUYs
+        ### https://github.com/mexcdevelop/mexc-api-sdk/issues/77
+        ### the price is what the order was actually filled at instead - dry runs are priced when placed
+        if str(market_order_result.get("orderId")).endswith("_DRYRUN"):
+            return False
+        if "__ticker" not in market_order_result:
+            raise ValueError(f"expected key __ticker to be in {market_order_result}")
+        return True
+
+    def _standardized_market_order(self, market_order_result: dict, contracts: float, price: float) -> dict:
         return {
             "id": market_order_result.get("clientOrderId"),
             "broker_order_id": market_order_result.get("orderId"),
             "timestamp": market_order_result.get("transactTime"),
-            "contracts": float(market_order_result.get("origQty")),
-            "price": float(market_order_result.get("price"))
+            "contracts": float(contracts),
+            "price": float(price)
         }
+
+    def _order_fill(self, ticker: str, broker_order_id: str) -> Fill:
+        return self._fill_from_order(order=self._api_get_order(symbol=ticker, broker_order_id=broker_order_id))
+
+    def _fill_from_order(self, order: dict) -> Fill:
+        if order.get("status") not in [ "FILLED", "PARTIALLY_CANCELED", "CANCELED" ]:
+            return None
+        executed = float(order.get("executedQty", 0.0))
+        quote_amount = float(order.get("cummulativeQuoteQty", 0.0))
+        if executed <= 0.0 or quote_amount <= 0.0:
+            return None
+        return Fill(contracts=executed, quote_amount=quote_amount, source=sources.ORDER())
+
+    def _trade_fill(self, ticker: str, broker_order_id: str) -> Fill:
+        return self._fill_from_trades(trades=self._api_get_my_trades(symbol=ticker, broker_order_id=broker_order_id))
+
+    def _fill_from_trades(self, trades: list[dict]) -> Fill:
+        return fill_from_trades(trades=[ (float(trade.get("qty")), float(trade.get("quoteQty"))) for trade in trades ])
     
     def place_limit_order(self, ticker: str, action: str, contracts: float, limit: float, broker_params: dict = {}) -> dict:
         return self._place_limit_order(
@@ -195,7 +235,9 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
     
     def get_order(self, ticker: str, order_id: str) -> dict:
         logging.debug("get_order")
-        order = self._api_get_order(ticker, order_id)
+        return self._order_from(order=self._api_get_order(ticker, order_id), order_id=order_id)
+
+    def _order_from(self, order: dict, order_id: str) -> dict:
         if "status" not in order:
             raise ValueError(f"expected key status to be in {order}")
         if "executedQty" not in order:
@@ -215,49 +257,58 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
         }
     
     def get_current_prices(self, symbols: list[str]) -> dict:
+        ### the ticker endpoint always returns every symbol, so one download is shared
+        ### by all lookups (and all MEXC_API instances) until the snapshot expires
+        return _shared_price_cache.get_prices(symbols=symbols, fetch_fn=self._fetch_all_prices)
+    
+    def price_cache_stats(self) -> dict:
+        return _shared_price_cache.stats()
+    
+    def _fetch_all_prices(self, symbols: list[str]) -> dict:
         prices = self._api_get_current_prices()
         logging.debug(f"Received response for get prices: {prices}")
-        result = { }
-        for price in prices:
-            ticker = price["symbol"]
-            if ticker in symbols:
-                result[ticker] = float(price["price"])
-        result.update({ "_timechecked": unix_timestamp_ms() })
-        return result
+        return { price["symbol"]: float(price["price"]) for price in prices }
     
     def get_asset_info(self, symbols:list[str]) -> AssetInfoResult:
-        if len(symbols) != 1:
-            raise ValueError(f"MEXC currently supports 1 symbol, got {len(symbols)}")
+        ### answered from the exchange info of every symbol, downloaded once and shared by all MEXC_API instances
+        if symbols is None or len(symbols) == 0:
+            raise ValueError("at least 1 symbol is required")
+        infos = _shared_exchange_info.get(symbols=symbols)
+        return AssetInfoResult(base_scale=infos[symbols[0]].base_scale, symbols=infos)
+
+    def _fetch_exchange_info(self) -> dict[str, SymbolInfo]:
         base_url = self._cfg_api_endpoint()
         endpoint = "/api/v3/exchangeInfo"
         remote_server_time = self._timestamp()
         params = {
-            "symbols": ",".join(symbols),
             "timestamp": remote_server_time,
             "recvWindow": self._cfg_recv_window_ms()
         }
         params["signature"] = self._sign(params)
         headers = self._request_headers()
-        response = requests.get(f"{base_url}{endpoint}", headers=headers, params=params)
-        logging.info(f"MEXC API asset info response: {response.status_code} - {response.text}")
+        response = self.transport.get(f"{base_url}{endpoint}", headers=headers, params=params, timeout=timeouts.MARKET_DATA())
+        logging.info(f"MEXC API exchange info response: {response.status_code}")
         
         if response.status_code != 200:
-            msg = f"Failed to get asset info: {response.status_code} - {response.text}"
+            msg = f"Failed to get exchange info: {response.status_code} - {response.text}"
             logging.error(msg)
             raise ApiError(msg)
         
         api_rx = response.json()
         if not isinstance(api_rx, dict):
             raise TypeError(f"Expected dict, got {type(api_rx)}")
-        symbols = api_rx.get("symbols")
-
-        ### TODO - this can easily support multiple symbols (securities / tickers, whatever you want to call it) but 
-        ### keeping it simple for now, feel free to remove this restriction
-        if len(symbols) != 1:
-            raise ValueError(f"Expected 1 symbol, got {len(symbols)}")
-        if "baseSizePrecision" not in symbols[0]:
-            raise KeyError(f"Expected key 'baseSizePrecision' not found in {api_rx}")
-        return AssetInfoResult(base_scale=float(symbols[0].get("baseSizePrecision")))
+        infos = {}
+        for symbol in api_rx.get("symbols", []):
+            if "baseSizePrecision" not in symbol:
+                raise KeyError(f"Expected key 'baseSizePrecision' not found in {symbol}")
+            infos[symbol.get("symbol")] = SymbolInfo(
+                symbol=symbol.get("symbol"),
+                base_asset=symbol.get("baseAsset"),
+                quote_asset=symbol.get("quoteAsset"),
+                base_scale=float(symbol.get("baseSizePrecision")),
+                filters=symbol.get("filters", [])
+            )
+        return infos
             
     def place_market_order_test(self, ticker: str, action: str, contracts: float, broker_params: dict = {}, tracking_id:str=None) -> dict:
         result = self._place_market_order(
@@ -268,8 +319,10 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
             dry_run=True
         )
         logging.info(f"place_market_order_test result: {result}")
+        return self._dry_run_market_order(ticker=ticker, contracts=contracts, tracking_id=tracking_id, current_prices=self.get_current_prices(symbols=[ticker]))
+
+    def _dry_run_market_order(self, ticker: str, contracts: float, tracking_id: str, current_prices: dict) -> dict:
         """ NOTE - Although not very authentic, this is as close to a fill-price for a market order as we can get. """
-        current_prices = self.get_current_prices(symbols=[ticker])
         if ticker not in current_prices:
             raise ValueError(f"expected key {ticker} to be in {current_prices}")
         tracking_id = f"{ticker}-{unix_timestamp_ms()}" if tracking_id is None else tracking_id
@@ -291,7 +344,9 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
             limit=limit, 
             dry_run=True
         )
-        current_prices = self.get_current_prices(symbols=[ticker])
+        return self._dry_run_limit_order(ticker=ticker, contracts=contracts, limit=limit, tracking_id=tracking_id, current_prices=self.get_current_prices(symbols=[ticker]))
+
+    def _dry_run_limit_order(self, ticker: str, contracts: float, limit: float, tracking_id: str, current_prices: dict) -> dict:
         if ticker not in current_prices:
             raise ValueError(f"expected key {ticker} to be in {current_prices}")
         tracking_id = f"{ticker}-{unix_timestamp_ms()}" if tracking_id is None else tracking_id
@@ -310,6 +365,11 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
     ## PRIVATE METHODS
     
     def _place_market_order(self, ticker:str, action:str, contracts:float, tracking_id = None, dry_run:bool = False) -> dict:
+        results = self._api_place_order(params=self._market_order_params(ticker=ticker, action=action, contracts=contracts, tracking_id=tracking_id), dry_run=dry_run)
+        results.update({"__ticker": ticker})
+        return results
+
+    def _market_order_params(self, ticker:str, action:str, contracts:float, tracking_id = None) -> dict:
         # if not self._api_ping():
         #     msg = "MEXC API is not available"
         #     logging.error(msg)
@@ -333,11 +393,15 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
             contracts=contracts, 
             tracking_id=market_order_id
         )
-        results = self._api_place_order(params=market_order_params,dry_run=dry_run)
-        results.update({"__ticker": ticker})
-        return results
+        return market_order_params
     
     def _place_limit_order(self, ticker: str, action: str, contracts: float, limit: float, broker_params: dict = {}, dry_run:bool = False) -> dict:
+        return self._api_place_order(
+            params=self._limit_order_params(ticker=ticker, action=action, contracts=contracts, limit=limit), 
+            dry_run=dry_run
+        )
+
+    def _limit_order_params(self, ticker: str, action: str, contracts: float, limit: float) -> dict:
         # if not self._api_ping():
         #     msg = "MEXC API is not available"
         #     logging.error(msg)
@@ -370,10 +434,7 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
             tracking_id=limit_order_id,
             target_price=limit
         )
-        return self._api_place_order(
-            params=limit_order_params, 
-            dry_run=dry_run
-        )
+        return limit_order_params
 
     def _cfg_api_key(self) -> str:
         api_key = os.environ[MEXC_ENV_API_KEY()]
@@ -409,7 +470,7 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
 
     def _api_ping(self) -> bool:
         url = f"{self._cfg_api_endpoint()}/api/v3/ping"
-        response = requests.get(url)
+        response = self.transport.get(url, timeout=timeouts.MARKET_DATA())
         return response.status_code == 200
     
     def _api_get_current_prices(self, ticker: str = None) -> dict:
@@ -419,14 +480,14 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
                 "symbol": ticker,
             }
             headers = self._request_headers()
-            response = requests.get(f"{url}", headers=headers, params=params)
+            response = self.transport.get(f"{url}", headers=headers, params=params, timeout=timeouts.MARKET_DATA())
         else:
-            response = requests.get(url)
+            response = self.transport.get(url, timeout=timeouts.MARKET_DATA())
         return response.json()
 
     def _api_get_server_time(self) -> str:
         url = f"{self._cfg_api_endpoint()}/api/v3/time"
-        response = requests.get(url)
+        response = self.transport.get(url, timeout=timeouts.MARKET_DATA())
         if response.status_code != 200:
             logging.error(f"Failed to get server time: {response.status_code} - {response.text}")
             raise ValueError(f"Failed to get server time: {response.status_code} - {response.text}")
@@ -455,7 +516,7 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
         }
         params["signature"] = self._sign(params)
         headers = self._request_headers()
-        response = requests.get(f"{base_url}{endpoint}", headers=headers, params=params)
+        response = self.transport.get(f"{base_url}{endpoint}", headers=headers, params=params, timeout=timeouts.ACCOUNT())
         logging.info(f"MEXC API account info response: {response.status_code} - {response.text}")
         
         if response.status_code != 200:
@@ -465,19 +526,25 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
         
         return response.json()
     
-    def _api_get_order(self, symbol: str, order_id: str) -> dict:
+    def _api_get_order(self, symbol: str, order_id: str = None, broker_order_id: str = None) -> dict:
+        ### by our tracking id, or by the id MEXC gave the order
+        if order_id is None and broker_order_id is None:
+            raise ValueError("order_id or broker_order_id is required")
         base_url = self._cfg_api_endpoint()
         endpoint = "/api/v3/order"
         remote_server_time = self._timestamp()
         params = {
             "symbol": symbol,
-            "origClientOrderId": order_id,
             "timestamp": remote_server_time,
             "recvWindow": self._cfg_recv_window_ms()
         }
+        if order_id is not None:
+            params["origClientOrderId"] = order_id
+        else:
+            params["orderId"] = broker_order_id
         params["signature"] = self._sign(params)
         headers = self._request_headers()
-        response = requests.get(f"{base_url}{endpoint}", headers=headers, params=params)
+        response = self.transport.get(f"{base_url}{endpoint}", headers=headers, params=params, timeout=timeouts.ACCOUNT())
         logging.info(f"MEXC API get order status response: {response.status_code} - {response.text}")
         
         if response.status_code != 200:
@@ -500,7 +567,7 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
         }
         params["signature"] = self._sign(params)
         headers = self._request_headers()
-        response = requests.get(f"{base_url}{endpoint}", headers=headers, params=params)
+        response = self.transport.get(f"{base_url}{endpoint}", headers=headers, params=params, timeout=timeouts.ACCOUNT())
         logging.info(f"MEXC API get open orders response: {response.status_code} - {response.text}")
         if response.status_code != 200:
             msg = f"Failed to get open orders: {response.status_code} - {response.text}"
@@ -508,6 +575,31 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
             raise ValueError(msg)
         return response.json()
 
+    def _api_get_my_trades(self, symbol: str, broker_order_id: str) -> list[dict]:
+        if null_or_empty(symbol):
+            raise ValueError("symbol parameter is required")
+        base_url = self._cfg_api_endpoint()
+        endpoint = "/api/v3/myTrades"
+        remote_server_time = self._timestamp()
+        params = {
+            "symbol": symbol,
+            "orderId": broker_order_id,
+            "timestamp": remote_server_time,
+            "recvWindow": self._cfg_recv_window_ms()
+        }
+        params["signature"] = self._sign(params)
+        headers = self._request_headers()
+        response = self.transport.get(f"{base_url}{endpoint}", headers=headers, params=params, timeout=timeouts.ACCOUNT())
+        
+        logging.info(f"MEXC API get trades response: {response.status_code} - {response.text}")
+        
+        if response.status_code != 200:
+            msg = f"Failed to get trades: {response.status_code} - {response.text}"
+            logging.error(msg)
+            raise ValueError(msg)
+        
+        return response.json()
+
     def _api_get_orders(self, symbol: str) -> dict:
         if null_or_empty(symbol):
             raise ValueError("symbol parameter is required")
@@ -521,7 +613,7 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
         }
         params["signature"] = self._sign(params)
         headers = self._request_headers()
-        response = requests.get(f"{base_url}{endpoint}", headers=headers, params=params)
+        response = self.transport.get(f"{base_url}{endpoint}", headers=headers, params=params, timeout=timeouts.ACCOUNT())
         
         logging.info(f"MEXC API  get order response: {response.status_code} - {response.text}")
         
@@ -558,25 +650,27 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
 
         headers = self._request_headers()
 
-        response = requests.delete(f"{base_url}{endpoint}", headers=headers, params=params)
+        response = self.transport.delete(f"{base_url}{endpoint}", headers=headers, params=params, timeout=timeouts.ORDER())
         logging.info(f"MEXC API cancel order for {ticker} response: {response.status_code} - {response.text}")
         
         if response.status_code == 404:
             logging.warning(f"Orders were not found for {ticker} : {response.text}")
         
         if response.status_code != 200:
-            msg = f"MEXC API error in cancelling orders for {ticker}: {response.status_code} - {response.text}"
-            logging.error(msg)
-            rx_dict = json.loads(response.text)
-            mexc_api_err = ApiErrorResponse(rx_dict)
-            if mexc_api_err.code == ApiErrors.ORDER_ALREADY_FILLED.value:
-                logging.error(f"Order {order_id} for {ticker} was already filled")
-                raise OrderAlreadyFilledError(f"Order {order_id} for {ticker} was already filled")
-            else:
-                raise ApiError(msg)
+            raise self._cancel_order_error(status_code=response.status_code, response_text=response.text, ticker=ticker, order_id=order_id)
         
         return response.json()
 
+    def _cancel_order_error(self, status_code: int, response_text: str, ticker: str, order_id: str) -> Exception:
+        msg = f"MEXC API error in cancelling orders for {ticker}: {status_code} - {response_text}"
+        logging.error(msg)
+        rx_dict = json.loads(response_text)
+        mexc_api_err = ApiErrorResponse(rx_dict)
+        if mexc_api_err.code == ApiErrors.ORDER_ALREADY_FILLED.value:
+            logging.error(f"Order {order_id} for {ticker} was already filled")
+            return OrderAlreadyFilledError(f"Order {order_id} for {ticker} was already filled")
+        return ApiError(msg)
+
     
     def _api_cancel_all_orders(self, ticker: str) -> dict:
         base_url = self._cfg_api_endpoint()
@@ -592,7 +686,7 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
 
         headers = self._request_headers()
 
-        response = requests.delete(f"{base_url}{endpoint}", headers=headers, params=params)
+        response = self.transport.delete(f"{base_url}{endpoint}", headers=headers, params=params, timeout=timeouts.ORDER())
         logging.info(f"MEXC API cancel order for {ticker} response: {response.status_code} - {response.text}")
         
         if response.status_code == 404:
@@ -667,31 +761,32 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
 
         logging.info(f"MEXC API - {target} - placing {order_type} order for {ticker} with {quantity}. Parameters are: {params}")
 
-        response = requests.post(url=target, headers=headers, params=params)
+        response = self.transport.post(target, headers=headers, params=params, timeout=timeouts.ORDER())
 
         if response.status_code != 200:
-            msg = f"error in placing order {order_type} for {ticker}. API response: {response.text}"
-            logging.error(msg)
-            rx_dict = json.loads(response.text)
-            mexc_api_err = ApiErrorResponse(rx_dict)
-            if mexc_api_err.code == ApiErrors.OVERSOLD.value:
-                msg = f"{ticker} - is oversold for quantity {quantity}. All parameters: {params}"
-                logging.error(msg)
-                raise OversoldError(msg)
-            elif mexc_api_err.code == ApiErrors.INVALID_QUANTITY_SCALE.value:
-                msg = f"{ticker} - invalid quantity scale {quantity}. Please consider selling manually."
-                logging.error(msg)
-                raise InvalidQuantityScale(msg)
-            else:
-                raise ApiError(msg)
+            raise self._place_order_error(response_text=response.text, params=params)
         
         logging.info(f"MEXC API response: {response.status_code} - {response.text}")
 
-        if response.status_code != 200:
-            msg = f"Error placing MEXC API {order_type} order: {response.status_code} - {response.text}"
-            raise ValueError(msg)
-
         return response.json()
+
+    def _place_order_error(self, response_text: str, params: dict) -> Exception:
+        ticker = params["symbol"]
+        quantity = params["quantity"]
+        order_type = params["type"]
+        msg = f"error in placing order {order_type} for {ticker}. API response: {response_text}"
+        logging.error(msg)
+        rx_dict = json.loads(response_text)
+        mexc_api_err = ApiErrorResponse(rx_dict)
+        if mexc_api_err.code == ApiErrors.OVERSOLD.value:
+            msg = f"{ticker} - is oversold for quantity {quantity}. All parameters: {params}"
+            logging.error(msg)
+            return OversoldError(msg)
+        elif mexc_api_err.code == ApiErrors.INVALID_QUANTITY_SCALE.value:
+            msg = f"{ticker} - invalid quantity scale {quantity}. Please consider selling manually."
+            logging.error(msg)
+            return InvalidQuantityScale(msg)
+        return ApiError(msg)
     
     ## TEST
 
@@ -704,11 +799,15 @@ class MEXC_API(Broker, MarketOrderable, LimitOrderable, OrderCancelable, LiveCap
             ]
         }
         headers = self._request_headers()
-        response = requests.get(f"{url}", headers=headers, params=params)
+        response = self.transport.get(f"{url}", headers=headers, params=params, timeout=timeouts.MARKET_DATA())
         return response.json()
 
+_shared_price_cache = PriceSnapshotCache(fetch_fn=lambda symbols: MEXC_API()._fetch_all_prices(symbols=symbols))
+_shared_exchange_info = ExchangeInfoCache(fetch_fn=lambda: MEXC_API()._fetch_exchange_info(), store=store_for(broker_name="MEXC"))
+
 if __name__ == "__main__":
     import unittest
+    import unittest.mock
 
     class Test(unittest.TestCase):
         def test_e2e(self):
@@ -720,5 +819,32 @@ if __name__ == "__main__":
             path_params = "?" + path_params
             print(path_params)
 
+        def test_exchange_info_covers_every_symbol(self):
+            transport = unittest.mock.Mock()
+            transport.get.return_value.status_code = 200
+            transport.get.return_value.json.return_value = { "symbols": [
+                { "symbol": "ETHUSDT", "baseAsset": "ETH", "quoteAsset": "USDT", "baseSizePrecision": "0.0001", "filters": [] },
+                { "symbol": "ETHFIUSDT", "baseAsset": "ETHFI", "quoteAsset": "USDT", "baseSizePrecision": "0.01", "filters": [] }
+            ] }
+            api = MEXC_API(transport=transport)
+            with unittest.mock.patch.object(MEXC_API, "_cfg_api_key", return_value="key"), unittest.mock.patch.object(MEXC_API, "_cfg_api_secret", return_value="secret"):
+                infos = api._fetch_exchange_info()
+            self.assertNotIn("symbols", transport.get.call_args.kwargs.get("params"))
+            self.assertEqual(infos["ETHFIUSDT"].base_asset, "ETHFI")
+            self.assertEqual(infos["ETHUSDT"].base_scale, 0.0001)
+
+        def test_market_order_priced_at_fill(self):
+            transport = unittest.mock.Mock()
+            transport.get.return_value.status_code = 200
+            transport.get.return_value.json.return_value = { "status": "FILLED", "executedQty": "2", "cummulativeQuoteQty": "21" }
+            api = MEXC_API(transport=transport)
+            api.get_current_prices = unittest.mock.Mock()
+            result = { "clientOrderId": "FM1", "orderId": "C02", "transactTime": 1, "origQty": "2", "price": "0", "__ticker": "BTCUSDT" }
+            with unittest.mock.patch.object(MEXC_API, "_cfg_api_key", return_value="key"), unittest.mock.patch.object(MEXC_API, "_cfg_api_secret", return_value="secret"):
+                order = api.standardize_market_order(market_order_result=result)
+            self.assertEqual(order.get("price"), 10.5)
+            self.assertEqual(transport.get.call_args.kwargs.get("params").get("orderId"), "C02")
+            api.get_current_prices.assert_not_called()
+
     unittest.main()
 
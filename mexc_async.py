@@ -0,0 +1,220 @@
+from async_capable import AsyncMarketOrderable, AsyncLimitOrderable, AsyncOrderCancelable, AsyncLiveCapable, AsyncDryRunnable
+from broker_transport import AsyncBrokerTransport, AsyncResponse, timeouts
+from fill_resolution import AsyncFillResolver, Fill
+from live_capable import AssetInfoResult, BalancesResult
+from mexc import MEXC_API, _shared_price_cache
+from order_capable import Broker
+from utils import null_or_empty
+
+import asyncio
+import logging
+
+class AsyncMEXC_API(Broker, AsyncMarketOrderable, AsyncLimitOrderable, AsyncOrderCancelable, AsyncLiveCapable, AsyncDryRunnable):
+    """ MEXC on asyncio - the requests are made on one aiohttp connection pool, everything else (signing, order
+    parameters, reading responses, errors) is MEXC_API's. Use it through async_capable.SyncBrokerAdapter from sync code. """
+
+    def __init__(self, transport:AsyncBrokerTransport = None):
+        ### instances share one connection pool unless given their own
+        self.transport = _shared_transport if transport is None else transport
+        self.api = MEXC_API()
+        self.fill_resolver = AsyncFillResolver(
+            order_fill_fn=self._order_fill,
+            trade_fill_fn=self._trade_fill,
+            snapshot_price_fn=self._snapshot_price
+        )
+
+    def get_name(self) -> str:
+        return self.api.get_name()
+
+    async def place_market_order(self, ticker:str, action:str, contracts:float, tracking_id = None) -> dict:
+        params = self.api._market_order_params(ticker=ticker, action=action, contracts=contracts, tracking_id=tracking_id)
+        results = await self._api_place_order(params=params, dry_run=False)
+        results.update({"__ticker": ticker})
+        return results
+
+    async def standardize_market_order(self, market_order_result: dict) -> dict:
+        contracts = float(self.api._check_market_order(market_order_result=market_order_result).get("origQty"))
+        price = market_order_result.get("price")
+        if self.api._needs_fill(market_order_result=market_order_result):
+            ticker = market_order_result.get("__ticker")
+            fill = await self.fill_resolver.resolve_async(ticker=ticker, broker_order_id=market_order_result.get("orderId"), ordered_contracts=contracts)
+            logging.info(f"{ticker} market order {market_order_result.get('orderId')} filled {fill.contracts} at {fill.price()} (from {fill.source}), MEXC reported {price}")
+            contracts, price = fill.contracts, fill.price()
+        return self.api._standardized_market_order(market_order_result=market_order_result, contracts=contracts, price=price)
+
+    async def place_limit_order(self, ticker:str, action:str, contracts:float, limit:float, broker_params: dict={}) -> dict:
+        params = self.api._limit_order_params(ticker=ticker, action=action, contracts=contracts, limit=limit)
+        return await self._api_place_order(params=params, dry_run=False)
+
+    def standardize_limit_order(self, limit_order_result: dict) -> dict:
+        return self.api.standardize_limit_order(limit_order_result=limit_order_result)
+
+    async def cancel_order(self, ticker: str, order_id: str) -> dict:
+        if null_or_empty(ticker):
+            raise ValueError("ticker is required")
+        if null_or_empty(order_id):
+            raise ValueError("order_id is required")
+        response = await self._signed("DELETE", "/api/v3/order", params={ "symbol": ticker, "origClientOrderId": order_id }, timeout=timeouts.ORDER())
+        logging.info(f"MEXC API cancel order for {ticker} response: {response.status_code} - {response.text}")
+        if response.status_code == 404:
+            logging.warning(f"Orders were not found for {ticker} : {response.text}")
+        if response.status_code != 200:
+            raise self.api._cancel_order_error(status_code=response.status_code, response_text=response.text, ticker=ticker, order_id=order_id)
+        return response.json()
+
+    async def place_market_order_test(self, ticker:str, action:str, contracts:float, broker_params:dict = {}, tracking_id = None) -> dict:
+        params = self.api._market_order_params(ticker=ticker, action=action, contracts=contracts, tracking_id=tracking_id)
+        result = await self._api_place_order(params=params, dry_run=True)
+        logging.info(f"place_market_order_test result: {result}")
+        current_prices = await self.get_current_prices(symbols=[ticker])
+        return self.api._dry_run_market_order(ticker=ticker, contracts=contracts, tracking_id=tracking_id, current_prices=current_prices)
+
+    async def place_limit_order_test(self, ticker:str, action:str, contracts:float, limit:float, broker_params: dict={}, tracking_id:str = None) -> dict:
+        params = self.api._limit_order_params(ticker=ticker, action=action, contracts=contracts, limit=limit)
+        await self._api_place_order(params=params, dry_run=True)
+        current_prices = await self.get_current_prices(symbols=[ticker])
+        return self.api._dry_run_limit_order(ticker=ticker, contracts=contracts, limit=limit, tracking_id=tracking_id, current_prices=current_prices)
+
+    async def cancel_order_test(self, ticker: str, order_id: str) -> dict:
+        ### nothing is sent in a dry run
+        return self.api._api_cancel_order(ticker=ticker, order_id=order_id, dry_run=True)
+
+    async def get_current_prices(self, symbols: list[str]) -> dict:
+        ### the price snapshot is shared with MEXC_API - one download answers sync and async lookups alike
+        return await _shared_price_cache.get_prices_async(symbols=symbols, fetch_fn=self._fetch_all_prices)
+
+    def price_cache_stats(self) -> dict:
+        return _shared_price_cache.stats()
+
+    async def get_order(self, ticker: str, order_id: str) -> dict:
+        order = await self._api_get_order(params={ "symbol": ticker, "origClientOrderId": order_id })
+        return self.api._order_from(order=order, order_id=order_id)
+
+    async def get_asset_info(self, symbols:list[str]) -> AssetInfoResult:
+        ### the exchange info cache is shared with MEXC_API and almost always answers from memory -
+        ### its download, once per BROKER_EXCHANGE_INFO_TTL_SECS, runs off the loop
+        return await asyncio.to_thread(self.api.get_asset_info, symbols)
+
+    async def get_balances(self) -> BalancesResult:
+        response = await self._signed("GET", "/api/v3/account", params={}, timeout=timeouts.ACCOUNT())
+        logging.info(f"MEXC API account info response: {response.status_code} - {response.text}")
+        if response.status_code != 200:
+            msg = f"Failed to get account info: {response.status_code} - {response.text}"
+            logging.error(msg)
+            raise ValueError(msg)
+        return self.api._balances_from(acct_info=response.json())
+
+    async def close(self) -> None:
+        await self.transport.close()
+
+    ## PRIVATE METHODS
+
+    async def _signed(self, method:str, endpoint:str, params:dict, timeout:tuple[float, float]) -> AsyncResponse:
+        params = dict(params)
+        params["timestamp"] = self.api._timestamp()
+        params["recvWindow"] = self.api._cfg_recv_window_ms()
+        params["signature"] = self.api._sign(params)
+        url = f"{self.api._cfg_api_endpoint()}{endpoint}"
+        return await self.transport.request(method, url, timeout=timeout, headers=self.api._request_headers(), params=params)
+
+    async def _api_place_order(self, params: dict, dry_run: bool = False) -> dict:
+        ### params are signed by _create_order_params
+        target = f"{self.api._cfg_api_endpoint()}{'/api/v3/order/test' if dry_run else '/api/v3/order'}"
+        logging.info(f"MEXC API - {target} - placing {params['type']} order for {params['symbol']} with {params['quantity']}. Parameters are: {params}")
+        response = await self.transport.post(target, headers=self.api._request_headers(), params=params, timeout=timeouts.ORDER())
+        if response.status_code != 200:
+            raise self.api._place_order_error(response_text=response.text, params=params)
+        logging.info(f"MEXC API response: {response.status_code} - {response.text}")
+        return response.json()
+
+    async def _api_get_order(self, params:dict) -> dict:
+        response = await self._signed("GET", "/api/v3/order", params=params, timeout=timeouts.ACCOUNT())
+        logging.info(f"MEXC API get order status response: {response.status_code} - {response.text}")
+        if response.status_code != 200:
+            msg = f"Failed to get order status: {response.status_code} - {response.text}"
+            logging.error(msg)
+            raise ValueError(msg)
+        return response.json()
+
+    async def _order_fill(self, ticker: str, broker_order_id: str) -> Fill:
+        return self.api._fill_from_order(order=await self._api_get_order(params={ "symbol": ticker, "orderId": broker_order_id }))
+
+    async def _trade_fill(self, ticker: str, broker_order_id: str) -> Fill:
+        response = await self._signed("GET", "/api/v3/myTrades", params={ "symbol": ticker, "orderId": broker_order_id }, timeout=timeouts.ACCOUNT())
+        if response.status_code != 200:
+            raise ValueError(f"Failed to get trades: {response.status_code} - {response.text}")
+        return self.api._fill_from_trades(trades=response.json())
+
+    async def _snapshot_price(self, ticker: str) -> float:
+        return (await self.get_current_prices(symbols=[ticker])).get(ticker)
+
+    async def _fetch_all_prices(self, symbols: list[str]) -> dict:
+        response = await self.transport.get(f"{self.api._cfg_api_endpoint()}/api/v3/ticker/price", timeout=timeouts.MARKET_DATA())
+        if response.status_code != 200:
+            raise ValueError(f"Failed to get prices: {response.status_code} - {response.text}")
+        return { price["symbol"]: float(price["price"]) for price in response.json() }
+
+_shared_transport = AsyncBrokerTransport()
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    def _response(status_code:int, json_text:str) -> AsyncResponse:
+        return AsyncResponse(status_code=status_code, text=json_text)
+
+    class Test(unittest.TestCase):
+        def setUp(self):
+            patches = [
+                unittest.mock.patch.object(MEXC_API, "_cfg_api_key", return_value="key"),
+                unittest.mock.patch.object(MEXC_API, "_cfg_api_secret", return_value="secret")
+            ]
+            for patch in patches:
+                patch.start()
+                self.addCleanup(patch.stop)
+
+        def test_market_order_priced_at_fill(self):
+            transport = unittest.mock.Mock()
+            transport.post = unittest.mock.AsyncMock(return_value=_response(200, '{"clientOrderId": "FM1", "orderId": "C02", "transactTime": 1, "origQty": "2", "price": "0"}'))
+            transport.request = unittest.mock.AsyncMock(return_value=_response(200, '{"status": "FILLED", "executedQty": "2", "cummulativeQuoteQty": "21"}'))
+            api = AsyncMEXC_API(transport=transport)
+            async def buy() -> dict:
+                return await api.standardize_market_order(await api.place_market_order(ticker="BTCUSDT", action="BUY", contracts=2.0))
+            order = asyncio.run(buy())
+            self.assertEqual(order.get("price"), 10.5)
+            self.assertEqual(transport.request.call_args.kwargs.get("params").get("orderId"), "C02")
+
+        def test_cancels_fan_out(self):
+            transport = unittest.mock.Mock()
+            in_flight = []
+            async def request(method, url, timeout, headers=None, params=None):
+                in_flight.append(params.get("origClientOrderId"))
+                await asyncio.sleep(0.01)
+                if params.get("origClientOrderId") == "filled":
+                    return _response(400, '{"code": -2011, "msg": "filled"}')
+                return _response(200, "{}")
+            transport.request = request
+            api = AsyncMEXC_API(transport=transport)
+            async def cancel_all() -> list:
+                return await asyncio.gather(*[ api.cancel_order(ticker="BTCUSDT", order_id=id) for id in [ "1", "filled", "3" ] ], return_exceptions=True)
+            results = asyncio.run(cancel_all())
+            self.assertEqual(len(in_flight), 3)
+            self.assertEqual(type(results[1]).__name__, "OrderAlreadyFilledError")
+            self.assertEqual(results[2], {})
+
+        def test_prices_share_one_download(self):
+            _shared_price_cache.invalidate()
+            transport = unittest.mock.Mock()
+            transport.get = unittest.mock.AsyncMock(return_value=_response(200, '[{"symbol": "BTCUSDT", "price": "10.5"}, {"symbol": "ETHUSDT", "price": "2"}]'))
+            api = AsyncMEXC_API(transport=transport)
+            async def look_up() -> list:
+                return await asyncio.gather(api.get_current_prices(symbols=[ "BTCUSDT" ]), api.get_current_prices(symbols=[ "ETHUSDT" ]))
+            btc, eth = asyncio.run(look_up())
+            self.assertEqual((btc.get("BTCUSDT"), eth.get("ETHUSDT")), (10.5, 2.0))
+            self.assertEqual(transport.get.call_count, 1)
+            ### a symbol MEXC does not list is downloaded for once
+            self.assertNotIn("NOPE", asyncio.run(api.get_current_prices(symbols=[ "NOPE" ])))
+            asyncio.run(api.get_current_prices(symbols=[ "NOPE", "BTCUSDT" ]))
+            self.assertEqual(transport.get.call_count, 2)
+
+    unittest.main()
@@ -0,0 +1,61 @@
+""" One-off storage migrations, run by hand against a storage account:
+
+    storageAccountConnectionString="..." python migrations.py <migration name>
+
+Every migration is safe to run more than once. """
+from azure.data.tables import TableServiceClient
+
+from ledger_rollups import LedgerRollups
+from merchant import Merchant
+from order_repository import OrderRepository
+from table_ledger import TableLedger
+
+import logging
+import os
+import sys
+
+def merchant_state_row_keys(table_service:TableServiceClient) -> int:
+    return Merchant.migrate_state_row_keys(table_service=table_service)
+
+def merchant_orders(table_service:TableServiceClient) -> int:
+    return Merchant.migrate_orders_to_entities(table_service=table_service)
+
+def order_digest_index(table_service:TableServiceClient) -> int:
+    return OrderRepository(table_service=table_service).index_digests()
+
+def ledger_filter_properties(table_service:TableServiceClient) -> int:
+    updated = 0
+    for table_name in [ "fmorderledger", "fmperformanceledger" ]:
+        ledger = TableLedger(table_client=table_service.get_table_client(table_name=table_name), table_service=table_service)
+        updated += ledger.backfill_filter_properties()
+    return updated
+
+def ledger_rollups(table_service:TableServiceClient) -> int:
+    table_name = "fmorderledger"
+    ledger = TableLedger(
+        table_client=table_service.get_table_client(table_name=table_name), 
+        table_service=table_service, 
+        rollups=LedgerRollups(table_service=table_service, ledger_table_name=table_name)
+    )
+    return ledger.rebuild_rollups()
+
+MIGRATIONS = {
+    "merchant-state-row-keys": merchant_state_row_keys,
+    "merchant-orders": merchant_orders,
+    "order-digest-index": order_digest_index,
+    "ledger-filter-properties": ledger_filter_properties,
+    "ledger-rollups": ledger_rollups
+}
+
+def run(name:str) -> int:
+    if name not in MIGRATIONS:
+        raise ValueError(f"unknown migration {name}, expected one of {list(MIGRATIONS.keys())}")
+    with TableServiceClient.from_connection_string(os.environ["storageAccountConnectionString"]) as table_service:
+        return MIGRATIONS.get(name)(table_service=table_service)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2:
+        print(f"usage: python migrations.py <{'|'.join(MIGRATIONS.keys())}>")
+        sys.exit(1)
+    print(f"{sys.argv[1]}: {run(name=sys.argv[1])}")
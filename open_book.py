@@ -0,0 +1,182 @@
+import numpy as np
+
+class categories:
+    @staticmethod
+    def STOP_LOSS() -> str:
+        return "stop_loss"
+
+    @staticmethod
+    def TAKE_PROFIT() -> str:
+        return "take_profit"
+
+    @staticmethod
+    def LEADER() -> str:
+        return "leader"
+
+    @staticmethod
+    def LAGGARD() -> str:
+        return "laggard"
+
+    @staticmethod
+    def UNPRICED() -> str:
+        return "unpriced"
+
+### index into _CATEGORY_NAMES is the category code held in BookEvaluation.category_codes
+_CATEGORY_NAMES = [
+    categories.UNPRICED(),
+    categories.STOP_LOSS(),
+    categories.TAKE_PROFIT(),
+    categories.LEADER(),
+    categories.LAGGARD()
+]
+
+class BookEvaluation:
+    """ result of evaluating an OpenBook against a set of prices, one array element per order """
+    def __init__(self, book:"OpenBook", current_prices:np.ndarray, stop_loss_hit:np.ndarray, take_profit_hit:np.ndarray, pnl:np.ndarray, percent_to_stop:np.ndarray, percent_to_target:np.ndarray, category_codes:np.ndarray):
+        self.book = book
+        self.current_prices = current_prices
+        self.stop_loss_hit = stop_loss_hit
+        self.take_profit_hit = take_profit_hit
+        self.pnl = pnl
+        self.percent_to_stop = percent_to_stop
+        self.percent_to_target = percent_to_target
+        self.category_codes = category_codes
+
+    def category(self, order_id:str) -> str:
+        """ None if the order is not in the book """
+        row = self.book.row_of(order_id=order_id)
+        if row is None:
+            return None
+        return _CATEGORY_NAMES[self.category_codes[row]]
+
+    def count(self, category:str) -> int:
+        return int(np.count_nonzero(self.category_codes == _CATEGORY_NAMES.index(category)))
+
+    def total_pnl(self) -> float:
+        ### unpriced orders do not contribute
+        return float(np.nansum(self.pnl))
+
+    def order_by_pnl(self, descending:bool = True) -> list[int]:
+        """ row numbers sorted by current pnl, unpriced orders last, ties keep book order """
+        keys = -self.pnl if descending else self.pnl
+        return np.argsort(keys, kind="stable").tolist()
+
+class OpenBook:
+    """ Columnar view of open orders: one NumPy array per field, so stop loss / take profit triggers,
+    pnl and leader / laggard classification are evaluated for every order in one pass.
+    Built from the stored order dicts (or Order instances) without building Order objects. """
+
+    def __init__(self, orders:list[dict]):
+        if orders is None:
+            raise ValueError("orders is required")
+        self.orders = orders
+        size = len(orders)
+        self.tickers:list[str] = []
+        self.ticker_index = np.empty(size, dtype=np.int64)
+        self.entry_price = np.empty(size, dtype=np.float64)
+        self.contracts = np.empty(size, dtype=np.float64)
+        self.stop_loss = np.empty(size, dtype=np.float64)
+        self.take_profit = np.empty(size, dtype=np.float64)
+        self._rows:dict[str, int] = {}
+
+        ticker_numbers:dict[str, int] = {}
+        for row, order in enumerate(orders):
+            ticker = order.get("ticker")
+            if ticker not in ticker_numbers:
+                ticker_numbers[ticker] = len(self.tickers)
+                self.tickers.append(ticker)
+            sub_orders = order.get("sub_orders")
+            main_order = sub_orders.get("main_order")
+            self.ticker_index[row] = ticker_numbers.get(ticker)
+            self.entry_price[row] = main_order.get("price")
+            self.contracts[row] = main_order.get("contracts")
+            self.stop_loss[row] = sub_orders.get("stop_loss").get("price")
+            self.take_profit[row] = sub_orders.get("take_profit").get("price")
+            self._rows[order.get("metadata").get("id")] = row
+
+    @staticmethod
+    def from_order_lists(order_lists:list[list[dict]]) -> "OpenBook":
+        return OpenBook(orders=[ order for order_list in order_lists for order in order_list ])
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def row_of(self, order_id:str) -> int:
+        return self._rows.get(order_id)
+
+    def evaluate(self, prices:dict) -> BookEvaluation:
+        """ prices is LiveCapable.get_current_prices shaped - tickers without a price are 'unpriced' """
+        ticker_prices = np.array([ prices.get(ticker, np.nan) for ticker in self.tickers ], dtype=np.float64)
+        current_prices = ticker_prices[self.ticker_index] if len(self.tickers) != 0 else np.empty(0, dtype=np.float64)
+        priced = ~np.isnan(current_prices)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ### same precedence as the merchant: the stop loss wins over the take profit
+            stop_loss_hit = priced & (current_prices <= self.stop_loss)
+            take_profit_hit = priced & ~stop_loss_hit & (current_prices >= self.take_profit)
+            untriggered = priced & ~stop_loss_hit & ~take_profit_hit
+            leader = untriggered & (current_prices > self.entry_price)
+            laggard = untriggered & ~leader
+
+            pnl = (current_prices - self.entry_price) * self.contracts
+            percent_to_stop = (current_prices - self.stop_loss) / current_prices * 100.0
+            percent_to_target = (self.take_profit - current_prices) / current_prices * 100.0
+
+        category_codes = np.zeros(len(self.orders), dtype=np.int8)
+        category_codes[stop_loss_hit] = _CATEGORY_NAMES.index(categories.STOP_LOSS())
+        category_codes[take_profit_hit] = _CATEGORY_NAMES.index(categories.TAKE_PROFIT())
+        category_codes[leader] = _CATEGORY_NAMES.index(categories.LEADER())
+        category_codes[laggard] = _CATEGORY_NAMES.index(categories.LAGGARD())
+
+        return BookEvaluation(
+            book=self,
+            current_prices=current_prices,
+            stop_loss_hit=stop_loss_hit,
+            take_profit_hit=take_profit_hit,
+            pnl=pnl,
+            percent_to_stop=percent_to_stop,
+            percent_to_target=percent_to_target,
+            category_codes=category_codes
+        )
+
+if __name__ == "__main__":
+    import unittest
+
+    def _order(id:str, ticker:str, entry:float, contracts:float, stop_loss:float, take_profit:float) -> dict:
+        return {
+            "ticker": ticker,
+            "metadata": { "id": id },
+            "sub_orders": {
+                "main_order": { "price": entry, "contracts": contracts },
+                "stop_loss": { "price": stop_loss },
+                "take_profit": { "price": take_profit }
+            }
+        }
+
+    class Test(unittest.TestCase):
+        def test_evaluate(self):
+            book = OpenBook(orders=[
+                _order("a", "BTCUSDT", 10.0, 2.0, 9.0, 12.0),
+                _order("b", "BTCUSDT", 10.0, 1.0, 8.0, 11.0),
+                _order("c", "ETHUSDT", 5.0, 1.0, 4.0, 6.0),
+                _order("d", "ETHUSDT", 5.0, 1.0, 4.5, 7.0),
+                _order("e", "XRPUSDT", 1.0, 1.0, 0.5, 2.0)
+            ])
+            evaluation = book.evaluate(prices={ "BTCUSDT": 11.0, "ETHUSDT": 4.5 })
+            self.assertEqual(evaluation.category("a"), categories.LEADER())
+            self.assertEqual(evaluation.category("b"), categories.TAKE_PROFIT())
+            self.assertEqual(evaluation.category("c"), categories.LAGGARD())
+            self.assertEqual(evaluation.category("d"), categories.STOP_LOSS())
+            self.assertEqual(evaluation.category("e"), categories.UNPRICED())
+            self.assertIsNone(evaluation.category("nope"))
+            self.assertEqual(evaluation.pnl.tolist()[:4], [2.0, 1.0, -0.5, -0.5])
+            self.assertAlmostEqual(evaluation.total_pnl(), 2.0)
+            self.assertEqual(evaluation.order_by_pnl(), [0, 1, 2, 3, 4])
+            self.assertEqual(evaluation.count(categories.STOP_LOSS()), 1)
+
+        def test_empty(self):
+            evaluation = OpenBook(orders=[]).evaluate(prices={ "BTCUSDT": 1.0 })
+            self.assertEqual(evaluation.total_pnl(), 0.0)
+            self.assertEqual(evaluation.order_by_pnl(), [])
+
+    unittest.main()
@@ -0,0 +1,227 @@
+from azure.core.exceptions import ResourceNotFoundError
+from azure.data.tables import TableServiceClient, UpdateMode
+
+from merchant_keys import keys
+from merchant_order import Order
+from security import order_digest
+from table_batch import TableWriteBatch
+
+import json
+import logging
+
+class cfg:
+    @staticmethod
+    def TABLE_NAME() -> str:
+        return "flowmerchantorders"
+
+    @staticmethod
+    def DIGEST_TABLE_NAME() -> str:
+        return "flowmerchantorderdigests"
+
+class okeys:
+    """ properties of an order entity, PartitionKey is the merchant id and RowKey the order id """
+    @staticmethod
+    def ORDER_DATA() -> str:
+        return "order_data"
+
+    @staticmethod
+    def TICKER() -> str:
+        return "ticker"
+
+    @staticmethod
+    def DIGEST() -> str:
+        return "digest"
+
+    @staticmethod
+    def TIME_CREATED() -> str:
+        return "time_created"
+
+class dkeys:
+    """ properties of a digest index entity, PartitionKey is the order digest and RowKey the order id """
+    @staticmethod
+    def MERCHANT_ID() -> str:
+        return "merchant_id"
+
+def _order_id(order_dict:dict) -> str:
+    return order_dict.get("metadata").get("id")
+
+class OrderRepository:
+    """ Stores each open Order as its own entity under its merchant's partition, so orders are read
+    and written one at a time instead of rewriting the whole broker_data list of the merchant.
+    Merchants written before this still carry their orders in broker_data - readers should merge
+    both (see orders_of) until they are migrated. 
+    Every order stored is also indexed by its digest in its own table, so find_by_digest is a single partition
+    read followed by a point read - orders stored before the index existed need the order-digest-index migration.
+    Index entities of orders removed without their digest are dropped when looked up. """
+
+    def __init__(self, table_service:TableServiceClient):
+        if table_service is None:
+            raise ValueError("table_service is required")
+        self.table_client = table_service.create_table_if_not_exists(table_name=cfg.TABLE_NAME())
+        self.digest_table_client = table_service.create_table_if_not_exists(table_name=cfg.DIGEST_TABLE_NAME())
+
+    @staticmethod
+    def to_entity(merchant_id:str, order_dict:dict) -> dict:
+        if isinstance(order_dict, Order):
+            order = order_dict
+        else:
+            order = Order.from_dict(order_dict)
+        return {
+            keys.PARTITIONKEY(): merchant_id,
+            keys.ROWKEY(): order.metadata.id,
+            okeys.TICKER(): order.ticker,
+            okeys.DIGEST(): order_digest(order),
+            okeys.TIME_CREATED(): order.metadata.time_created,
+            okeys.ORDER_DATA(): Order.to_json(order)
+        }
+
+    @staticmethod
+    def from_entity(entity:dict) -> dict:
+        return json.loads(entity.get(okeys.ORDER_DATA()))
+
+    @staticmethod
+    def orders_of(position:dict, order_entities:list[dict]) -> list[dict]:
+        """ every open order of a merchant - legacy broker_data orders first, then the order entities by creation time.
+        An order found in both (a migration interrupted half way) is taken from its entity, which is written first. """
+        stored_ids = set([ entity.get(keys.ROWKEY()) for entity in order_entities ])
+        orders = [ order_dict for order_dict in json.loads(position.get(keys.BROKER_DATA(), "[]")) if _order_id(order_dict) not in stored_ids ]
+        for entity in sorted(order_entities, key=lambda entity: entity.get(okeys.TIME_CREATED(), 0)):
+            orders.append(OrderRepository.from_entity(entity))
+        return orders
+
+    def list_by_merchant(self) -> dict[str, list[dict]]:
+        """ every order entity, grouped by merchant id """
+        merchants = { }
+        for entity in self.table_client.list_entities():
+            merchant_id = entity.get(keys.PARTITIONKEY())
+            if merchant_id not in merchants:
+                merchants[merchant_id] = []
+            merchants[merchant_id].append(entity)
+        return merchants
+
+    def list_for_merchant(self, merchant_id:str) -> list[dict]:
+        return list(self.table_client.query_entities(
+            f"{keys.PARTITIONKEY()} eq @merchant_id",
+            parameters={ "merchant_id": merchant_id }
+        ))
+
+    def has_orders(self, merchant_id:str) -> bool:
+        entities = self.table_client.query_entities(
+            f"{keys.PARTITIONKEY()} eq @merchant_id",
+            parameters={ "merchant_id": merchant_id },
+            select=[ keys.ROWKEY() ],
+            results_per_page=1
+        )
+        for _ in entities:
+            return True
+        return False
+
+    def merchants_with_orders(self) -> set[str]:
+        return set([ entity.get(keys.PARTITIONKEY()) for entity in self.table_client.list_entities(select=[ keys.PARTITIONKEY() ]) ])
+
+    @staticmethod
+    def to_digest_entity(order_entity:dict) -> dict:
+        return {
+            keys.PARTITIONKEY(): order_entity.get(okeys.DIGEST()),
+            keys.ROWKEY(): order_entity.get(keys.ROWKEY()),
+            dkeys.MERCHANT_ID(): order_entity.get(keys.PARTITIONKEY())
+        }
+
+    def find_by_digest(self, digest:str) -> dict:
+        """ the order entity whose order_digest is digest, None if there is none """
+        index_entities = list(self.digest_table_client.query_entities(
+            f"{keys.PARTITIONKEY()} eq @digest",
+            parameters={ "digest": digest }
+        ))
+        if len(index_entities) > 1:
+            logging.warning(f"{len(index_entities)} orders share the digest {digest} - using the first open one")
+        for index_entity in index_entities:
+            try:
+                return self.table_client.get_entity(partition_key=index_entity.get(dkeys.MERCHANT_ID()), row_key=index_entity.get(keys.ROWKEY()))
+            except ResourceNotFoundError:
+                logging.info(f"dropping the digest index entity of the removed order {index_entity.get(keys.ROWKEY())}")
+                self._remove_digest(digest=digest, order_id=index_entity.get(keys.ROWKEY()))
+        return None
+
+    def index_digests(self) -> int:
+        """ indexes the digest of every order entity added before the index existed, returns how many were indexed """
+        batch = TableWriteBatch(table_client=self.digest_table_client)
+        indexed = 0
+        for order_entity in self.table_client.list_entities(select=[ keys.PARTITIONKEY(), keys.ROWKEY(), okeys.DIGEST() ]):
+            batch.upsert(entity=OrderRepository.to_digest_entity(order_entity=order_entity))
+            indexed += 1
+        batch.flush()
+        return indexed
+
+    def add(self, merchant_id:str, order:dict) -> None:
+        order_entity = OrderRepository.to_entity(merchant_id=merchant_id, order_dict=order)
+        ### indexed first - an index entity without its order is dropped when looked up, an order without one is never found
+        self.digest_table_client.upsert_entity(entity=OrderRepository.to_digest_entity(order_entity=order_entity))
+        self.table_client.create_entity(entity=order_entity)
+
+    def save(self, merchant_id:str, order:dict) -> None:
+        order_entity = OrderRepository.to_entity(merchant_id=merchant_id, order_dict=order)
+        self.digest_table_client.upsert_entity(entity=OrderRepository.to_digest_entity(order_entity=order_entity))
+        self.table_client.upsert_entity(entity=order_entity, mode=UpdateMode.REPLACE)
+
+    def remove(self, merchant_id:str, order_id:str, digest:str = None) -> None:
+        try:
+            self.table_client.delete_entity(partition_key=merchant_id, row_key=order_id)
+        except ResourceNotFoundError:
+            logging.warning(f"order {merchant_id}/{order_id} was already removed")
+        if digest is not None:
+            self._remove_digest(digest=digest, order_id=order_id)
+
+    def _remove_digest(self, digest:str, order_id:str) -> None:
+        try:
+            self.digest_table_client.delete_entity(partition_key=digest, row_key=order_id)
+        except ResourceNotFoundError:
+            pass
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    class Test(unittest.TestCase):
+        def test_orders_of_merges_legacy_first(self):
+            position = { keys.BROKER_DATA(): json.dumps([ { "metadata": { "id": "a" } }, { "metadata": { "id": "z" } } ]) }
+            entities = [
+                { keys.ROWKEY(): "c", okeys.TIME_CREATED(): 3, okeys.ORDER_DATA(): json.dumps({ "metadata": { "id": "c" } }) },
+                { keys.ROWKEY(): "b", okeys.TIME_CREATED(): 2, okeys.ORDER_DATA(): json.dumps({ "metadata": { "id": "b" } }) },
+                { keys.ROWKEY(): "a", okeys.TIME_CREATED(): 1, okeys.ORDER_DATA(): json.dumps({ "metadata": { "id": "a" } }) }
+            ]
+            orders = OrderRepository.orders_of(position=position, order_entities=entities)
+            self.assertEqual([ _order_id(order) for order in orders ], [ "z", "a", "b", "c" ])
+
+        def test_find_by_digest(self):
+            table_service = unittest.mock.Mock()
+            repository = OrderRepository(table_service=table_service)
+            repository.table_client = unittest.mock.Mock()
+            repository.digest_table_client = unittest.mock.Mock()
+            repository.digest_table_client.query_entities.return_value = [
+                { keys.PARTITIONKEY(): "d", keys.ROWKEY(): "closed", dkeys.MERCHANT_ID(): "m" },
+                { keys.PARTITIONKEY(): "d", keys.ROWKEY(): "open", dkeys.MERCHANT_ID(): "m" }
+            ]
+            def get_entity(partition_key, row_key):
+                if row_key == "closed":
+                    raise ResourceNotFoundError("removed")
+                return { keys.PARTITIONKEY(): partition_key, keys.ROWKEY(): row_key }
+            repository.table_client.get_entity.side_effect = get_entity
+            self.assertEqual(repository.find_by_digest(digest="d").get(keys.ROWKEY()), "open")
+            repository.digest_table_client.delete_entity.assert_called_once_with(partition_key="d", row_key="closed")
+            repository.table_client.query_entities.assert_not_called()
+
+        def test_find_by_digest_miss_does_not_scan(self):
+            repository = OrderRepository(table_service=unittest.mock.Mock())
+            repository.table_client = unittest.mock.Mock()
+            repository.digest_table_client = unittest.mock.Mock()
+            repository.digest_table_client.query_entities.return_value = []
+            self.assertIsNone(repository.find_by_digest(digest="d"))
+            repository.table_client.query_entities.assert_not_called()
+            repository.table_client.list_entities.assert_not_called()
+
+        def test_orders_of_without_legacy(self):
+            position = { keys.BROKER_DATA(): "[]" }
+            self.assertEqual(OrderRepository.orders_of(position=position, order_entities=[]), [])
+
+    unittest.main()
@@ -35,5 +35,10 @@ class OrderStrategy(ABC):
     def handle_price_change(self, broker:Broker, order:Order, merchant_params:dict = {}) -> HandleResult:
         pass
 
+    def handles_price_change(self) -> bool:
+        ### strategies that do nothing until a stop loss or take profit is crossed should return False,
+        ### which lets the merchant skip them entirely on ordinary price ticks
+        return True
+
     def name(self) -> str:
         return type(self).__name__
\ No newline at end of file
@@ -0,0 +1,251 @@
+from live_capable import LiveCapable
+from utils import unix_timestamp_ms
+
+import asyncio
+import logging
+import os
+import threading
+import typing
+
+class cfg:
+    @staticmethod
+    def MAX_AGE_MS() -> int:
+        ### 0 disables caching - every lookup goes to the broker
+        max_age:str = os.environ.get("BROKER_PRICE_CACHE_MAX_AGE_MS", "5000")
+        if not max_age.isnumeric():
+            raise ValueError(f"BROKER_PRICE_CACHE_MAX_AGE_MS must be an integer, got {max_age}")
+        return int(max_age)
+
+class PriceCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.shared_refreshes = 0
+
+class PriceSnapshotCache:
+    """ Caches the last known price of each symbol for a short period of time.
+    Concurrent lookups that miss share a single in-flight refresh instead of each downloading prices. """
+
+    def __init__(self, fetch_fn:typing.Callable[[list[str]], dict], max_age_ms:int = None):
+        if fetch_fn is None:
+            raise ValueError("fetch_fn is required")
+        if max_age_ms is not None and max_age_ms < 0:
+            raise ValueError(f"max_age_ms must be >= 0, got {max_age_ms}")
+        self._fetch_fn = fetch_fn
+        self._max_age_ms = max_age_ms
+        self._prices:dict[str, tuple[float, int]] = {}
+        self._unknown:dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._refresh_done:threading.Event = None
+        self._stats = PriceCacheStats()
+
+    @staticmethod
+    def for_live_capable(broker:LiveCapable, max_age_ms:int = None) -> "PriceSnapshotCache":
+        if not isinstance(broker, LiveCapable):
+            raise TypeError(f"broker must be LiveCapable, got {type(broker)}")
+        return PriceSnapshotCache(fetch_fn=broker.get_current_prices, max_age_ms=max_age_ms)
+
+    def max_age_ms(self) -> int:
+        return cfg.MAX_AGE_MS() if self._max_age_ms is None else self._max_age_ms
+
+    def get_prices(self, symbols:list[str], fetch_fn:typing.Callable[[list[str]], dict] = None) -> dict:
+        """ same shape as LiveCapable.get_current_prices, _timechecked is the time of the oldest price returned """
+        if symbols is None:
+            raise ValueError("symbols is required")
+        if fetch_fn is None:
+            fetch_fn = self._fetch_fn
+        counted_miss = False
+        while True:
+            snapshot, refresh_done, is_refresher = self._look_up(symbols=symbols, counted_miss=counted_miss)
+            if snapshot is not None:
+                return snapshot
+            counted_miss = True
+            if not is_refresher:
+                ### another thread is already downloading - wait for it, then look again
+                refresh_done.wait()
+                continue
+            try:
+                snapshot = self._store(symbols=symbols, prices=fetch_fn(symbols))
+                if snapshot is not None:
+                    return snapshot
+            finally:
+                self._end_refresh(refresh_done=refresh_done)
+
+    async def get_prices_async(self, symbols:list[str], fetch_fn:typing.Callable[[list[str]], typing.Awaitable[dict]]) -> dict:
+        """ get_prices for async brokers - fetch_fn is a coroutine function. Waiting for a download that is
+        already in flight, from a thread or another coroutine, does not block the event loop. """
+        if symbols is None:
+            raise ValueError("symbols is required")
+        if fetch_fn is None:
+            raise ValueError("fetch_fn is required")
+        counted_miss = False
+        while True:
+            snapshot, refresh_done, is_refresher = self._look_up(symbols=symbols, counted_miss=counted_miss)
+            if snapshot is not None:
+                return snapshot
+            counted_miss = True
+            if not is_refresher:
+                await asyncio.to_thread(refresh_done.wait)
+                continue
+            try:
+                snapshot = self._store(symbols=symbols, prices=await fetch_fn(symbols))
+                if snapshot is not None:
+                    return snapshot
+            finally:
+                self._end_refresh(refresh_done=refresh_done)
+
+    def _look_up(self, symbols:list[str], counted_miss:bool) -> tuple[dict, threading.Event, bool]:
+        """ (the prices, None, False) when cached, otherwise (None, the refresh to wait for, whether the caller downloads) """
+        with self._lock:
+            now_ms = unix_timestamp_ms()
+            if self._covers(symbols=symbols, now_ms=now_ms):
+                if not counted_miss:
+                    self._stats.hits += 1
+                return self._snapshot_for(symbols=symbols), None, False
+            if not counted_miss:
+                self._stats.misses += 1
+            if self._refresh_done is not None:
+                self._stats.shared_refreshes += 1
+                return None, self._refresh_done, False
+            self._refresh_done = threading.Event()
+            return None, self._refresh_done, True
+
+    def _store(self, symbols:list[str], prices:dict) -> dict:
+        """ keeps a download - returns the prices only when nothing is cached """
+        fetched_at_ms = unix_timestamp_ms()
+        with self._lock:
+            self._stats.refreshes += 1
+            for symbol, price in prices.items():
+                if not symbol.startswith("_"):
+                    self._prices[symbol] = (price, fetched_at_ms)
+                    self._unknown.pop(symbol, None)
+            ### the broker may simply not know some symbols, remember that so we do not keep refreshing for them
+            for symbol in symbols:
+                if symbol not in prices:
+                    self._unknown[symbol] = fetched_at_ms
+            if self.max_age_ms() == 0:
+                return self._snapshot_for(symbols=symbols, fetched_at_ms=fetched_at_ms)
+        return None
+
+    def _end_refresh(self, refresh_done:threading.Event) -> None:
+        with self._lock:
+            self._refresh_done = None
+        refresh_done.set()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._prices = {}
+            self._unknown = {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            now_ms = unix_timestamp_ms()
+            oldest_ms = min([ fetched_at for _, fetched_at in self._prices.values() ], default=None)
+            return {
+                "hits": self._stats.hits,
+                "misses": self._stats.misses,
+                "refreshes": self._stats.refreshes,
+                "shared_refreshes": self._stats.shared_refreshes,
+                "symbols": len(self._prices),
+                "age_ms": None if oldest_ms is None else now_ms - oldest_ms
+            }
+
+    def _covers(self, symbols:list[str], now_ms:int) -> bool:
+        max_age_ms = self.max_age_ms()
+        if max_age_ms == 0:
+            return False
+        for symbol in symbols:
+            if symbol in self._prices:
+                _, fetched_at_ms = self._prices.get(symbol)
+            elif symbol in self._unknown:
+                fetched_at_ms = self._unknown.get(symbol)
+            else:
+                return False
+            if now_ms - fetched_at_ms > max_age_ms:
+                return False
+        return True
+
+    def _snapshot_for(self, symbols:list[str], fetched_at_ms:int = None) -> dict:
+        result = { }
+        oldest_ms = fetched_at_ms
+        for symbol in symbols:
+            if symbol in self._prices:
+                price, symbol_fetched_at_ms = self._prices.get(symbol)
+                result[symbol] = price
+                if oldest_ms is None or symbol_fetched_at_ms < oldest_ms:
+                    oldest_ms = symbol_fetched_at_ms
+        result.update({ "_timechecked": unix_timestamp_ms() if oldest_ms is None else oldest_ms })
+        return result
+
+if __name__ == "__main__":
+    import time
+    import unittest
+
+    class Test(unittest.TestCase):
+        def test_hit_after_refresh(self):
+            calls = []
+            def fetch(symbols):
+                calls.append(symbols)
+                return { "BTCUSDT": 1.0, "ETHUSDT": 2.0 }
+            cache = PriceSnapshotCache(fetch_fn=fetch, max_age_ms=60000)
+            self.assertEqual(cache.get_prices(["BTCUSDT"]).get("BTCUSDT"), 1.0)
+            self.assertEqual(cache.get_prices(["ETHUSDT", "BTCUSDT"]).get("ETHUSDT"), 2.0)
+            self.assertEqual(len(calls), 1)
+            stats = cache.stats()
+            self.assertEqual(stats.get("hits"), 1)
+            self.assertEqual(stats.get("misses"), 1)
+
+        def test_unknown_symbol_not_returned(self):
+            calls = []
+            def fetch(symbols):
+                calls.append(symbols)
+                return { "BTCUSDT": 1.0 }
+            cache = PriceSnapshotCache(fetch_fn=fetch, max_age_ms=60000)
+            result = cache.get_prices(["NOPE", "BTCUSDT"])
+            self.assertNotIn("NOPE", result)
+            self.assertIn("_timechecked", result)
+            cache.get_prices(["NOPE"])
+            self.assertEqual(len(calls), 1)
+
+        def test_disabled(self):
+            calls = []
+            def fetch(symbols):
+                calls.append(symbols)
+                return { "BTCUSDT": 1.0 }
+            cache = PriceSnapshotCache(fetch_fn=fetch, max_age_ms=0)
+            cache.get_prices(["BTCUSDT"])
+            cache.get_prices(["BTCUSDT"])
+            self.assertEqual(len(calls), 2)
+
+        def test_single_flight(self):
+            calls = []
+            def fetch(symbols):
+                calls.append(symbols)
+                time.sleep(0.2)
+                return { "BTCUSDT": 1.0 }
+            cache = PriceSnapshotCache(fetch_fn=fetch, max_age_ms=60000)
+            threads = [ threading.Thread(target=cache.get_prices, args=(["BTCUSDT"],)) for _ in range(8) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(calls), 1)
+
+        def test_async_single_flight(self):
+            calls = []
+            async def fetch(symbols):
+                calls.append(symbols)
+                await asyncio.sleep(0.1)
+                return { "BTCUSDT": 1.0 }
+            cache = PriceSnapshotCache(fetch_fn=lambda symbols: {}, max_age_ms=60000)
+            async def look_up_all() -> list:
+                return await asyncio.gather(*[ cache.get_prices_async(symbols=["BTCUSDT"], fetch_fn=fetch) for _ in range(4) ])
+            self.assertEqual([ prices.get("BTCUSDT") for prices in asyncio.run(look_up_all()) ], [ 1.0 ] * 4)
+            ### nothing is bound to the first event loop
+            cache.invalidate()
+            asyncio.run(look_up_all())
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(cache.stats().get("hits"), 0)
+
+    unittest.main()
@@ -1,4 +1,5 @@
 from merchant_order import Order
+from utils import null_or_empty
 
 import hashlib
 import os
@@ -18,6 +19,9 @@ def hash(target: str, count: int = cfg.DEFAULT_HASH_COUNT()) -> str:
     return target
 
 def order_digest(order:Order) -> str:
+    """ the sell identifier of order - kept in its metadata when the order is created, computed for older orders """
+    if not null_or_empty(order.metadata.digest):
+        return order.metadata.digest
     hash_count = 5 ## Keep it nice and quick
     metadata_chunk = f"{order.metadata.time_created}-{order.metadata.id}-{order.metadata.is_dry_run}"
     sub_orders_chunk = f"{order.sub_orders.main_order.id}-{order.sub_orders.stop_loss.id}-{order.sub_orders.take_profit.id}"
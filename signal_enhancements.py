@@ -111,8 +111,7 @@ class CurrencyToContracts(SignalEnhancement):
         return broker.get_current_prices(symbols=[symbol]).get(symbol)
 
     def fetch_base_scale(self, symbol:str, broker:LiveCapable) -> float:
-        ### TODO - improvement would be to store these in a cache as they change
-        ### infrequently. The beneift being we are not taxed on API calls to the broker
+        ### brokers cache this, see exchange_info
         result = broker.get_asset_info(symbols=[symbol])
         return result.base_scale
     
@@ -0,0 +1,422 @@
+from ledger import Ledger, Entry, Signer, LedgerError
+from ledger_codec import dumps as dump_payload, loads as load_payload, decode as decode_payload
+from ledger_verification import verify_chain
+from table_ledger import TableLedger, apply_filters, filter_conditions, fkeys, cfg as table_ledger_cfg
+from utils import unix_timestamp_secs, unix_timestamp_secs_dec, null_or_empty, consts as util_consts
+
+import logging
+import sqlite3
+import threading
+import uuid
+
+class consts:
+    @staticmethod
+    def MIN_LOG_TIMESTAMP_STEP() -> float:
+        return 0.001
+
+    @staticmethod
+    def VERIFIED_META_KEY() -> str:
+        return "verified_log_timestamp"
+
+    @staticmethod
+    def SYNCED_META_KEY() -> str:
+        return "synced_log_timestamp"
+
+    @staticmethod
+    def RECOMPUTED_META_KEY() -> str:
+        return "recomputed_at"
+
+_FILTER_COLUMNS = [
+    fkeys.TICKER(),
+    fkeys.HIGH_INTERVAL(),
+    fkeys.LOW_INTERVAL(),
+    fkeys.STOPLOSS_PERCENT(),
+    fkeys.TAKEPROFIT_PERCENT(),
+    fkeys.STRATEGY(),
+    fkeys.TAGS(),
+    fkeys.DRY_RUN()
+]
+
+_COLUMNS = [ "row_key", "partition_key", "name", "amount", "timestamp", "log_timestamp", "hash", "test", "data" ] + _FILTER_COLUMNS
+
+_SCHEMA = [
+    f"""CREATE TABLE IF NOT EXISTS entries (
+        row_key TEXT PRIMARY KEY,
+        partition_key TEXT,
+        name TEXT NOT NULL,
+        amount REAL NOT NULL,
+        timestamp INTEGER NOT NULL,
+        log_timestamp REAL NOT NULL,
+        hash TEXT,
+        test INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        {fkeys.TICKER()} TEXT,
+        {fkeys.HIGH_INTERVAL()} TEXT,
+        {fkeys.LOW_INTERVAL()} TEXT,
+        {fkeys.STOPLOSS_PERCENT()} REAL,
+        {fkeys.TAKEPROFIT_PERCENT()} REAL,
+        {fkeys.STRATEGY()} TEXT,
+        {fkeys.TAGS()} TEXT,
+        {fkeys.DRY_RUN()} INTEGER
+    )""",
+    "CREATE INDEX IF NOT EXISTS entries_timestamp ON entries (timestamp)",
+    "CREATE INDEX IF NOT EXISTS entries_log_timestamp ON entries (log_timestamp)",
+    "CREATE INDEX IF NOT EXISTS entries_name ON entries (name, timestamp)",
+    f"CREATE INDEX IF NOT EXISTS entries_interval ON entries ({fkeys.HIGH_INTERVAL()}, timestamp)",
+    f"CREATE INDEX IF NOT EXISTS entries_spread ON entries ({fkeys.STOPLOSS_PERCENT()}, {fkeys.TAKEPROFIT_PERCENT()}, timestamp)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)"
+]
+
+class SqliteLedger(Ledger):
+    """ A Ledger in a local SQLite file (WAL mode), indexed by timestamp, log_timestamp, name and the promoted
+    filter properties of TableLedger. Runs as a backend of its own, or as a read replica of a TableLedger
+    kept up to date with sync_from. Safe to share between threads. """
+
+    def __init__(self, path:str):
+        if null_or_empty(path):
+            raise ValueError("path is required")
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock:
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                self._connection.execute(statement)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _read_meta(self, key:str) -> float:
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row["value"]
+
+    def _write_meta(self, key:str, value:float) -> None:
+        self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def _row_from_entity(entity:dict) -> tuple:
+        """ an entity is TableLedger shaped - PartitionKey, RowKey and an encoded payload. Payloads are kept COMPACT, 
+        whatever codec wrote the entity. The filter columns are promoted from the payload, entities logged before 
+        TableLedger promoted them do not carry them. """
+        data = decode_payload(properties=entity)
+        filter_properties = TableLedger.filter_properties(data=data)
+        return (
+            entity.get("RowKey"),
+            entity.get("PartitionKey"),
+            entity.get("name"),
+            entity.get("amount"),
+            entity.get("timestamp"),
+            entity.get("log_timestamp"),
+            entity.get("hash"),
+            1 if entity.get("test") else 0,
+            dump_payload(data=data),
+        ) + tuple([ filter_properties.get(column) for column in _FILTER_COLUMNS ])
+
+    @staticmethod
+    def _entry_from_row(row:sqlite3.Row) -> Entry:
+        return Entry(
+            name=row["name"],
+            amount=row["amount"],
+            hash=row["hash"],
+            timestamp=row["timestamp"],
+            test=row["test"] == 1,
+            data=load_payload(payload=row["data"])
+        )
+
+    def _insert(self, entities:list[dict]) -> None:
+        placeholders = ", ".join([ "?" ] * len(_COLUMNS))
+        self._connection.executemany(
+            f"INSERT OR REPLACE INTO entries ({', '.join(_COLUMNS)}) VALUES ({placeholders})",
+            [ SqliteLedger._row_from_entity(entity=entity) for entity in entities ]
+        )
+
+    def _entity_from_entry(self, entry:Entry, log_timestamp:float) -> dict:
+        return {
+            **TableLedger.filter_properties(data=entry.data),
+            "PartitionKey": None,
+            "RowKey": str(uuid.uuid4()),
+            "name": entry.name,
+            "amount": entry.amount,
+            "timestamp": entry.timestamp,
+            "log_timestamp": log_timestamp,
+            "hash": entry.hash,
+            "test": entry.test,
+            "data": dump_payload(data=entry.data)
+        }
+
+    def _next_log_timestamp(self) -> float:
+        row = self._connection.execute("SELECT MAX(log_timestamp) AS latest FROM entries").fetchone()
+        log_timestamp = unix_timestamp_secs_dec()
+        if row["latest"] is not None:
+            log_timestamp = max(log_timestamp, round(row["latest"] + consts.MIN_LOG_TIMESTAMP_STEP(), 3))
+        return log_timestamp
+
+    def _validate_entry(self, entry:Entry) -> None:
+        if entry is None:
+            raise ValueError("entry is required")
+        if null_or_empty(entry.name):
+            raise ValueError("entry.name is required")
+        if entry.amount is None:
+            raise ValueError("entry.amount is required")
+        if entry.timestamp is None:
+            raise ValueError("entry.timestamp is required")
+        if entry.data is None:
+            raise ValueError("entry.data is required")
+
+    def log(self, entry:Entry) -> None:
+        self._validate_entry(entry=entry)
+        if null_or_empty(entry.hash):
+            raise ValueError("entry.hash is required")
+        with self._lock:
+            self._insert(entities=[ self._entity_from_entry(entry=entry, log_timestamp=self._next_log_timestamp()) ])
+
+    def log_many(self, entries:list[Entry], signer:Signer) -> None:
+        """ signs the entries as one chain onto the latest entry and inserts them in one transaction """
+        if entries is None:
+            raise ValueError("entries is required")
+        if signer is None:
+            raise ValueError("signer is required")
+        for entry in entries:
+            self._validate_entry(entry=entry)
+        if len(entries) == 0:
+            return
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                prev_entry = self._latest_entry()
+                log_timestamp = self._next_log_timestamp()
+                entities = []
+                for entry in entries:
+                    entry.hash = signer.sign(new_entry=entry, prev_entry=prev_entry)
+                    entities.append(self._entity_from_entry(entry=entry, log_timestamp=log_timestamp))
+                    prev_entry = entry
+                    log_timestamp = round(log_timestamp + consts.MIN_LOG_TIMESTAMP_STEP(), 3)
+                self._insert(entities=entities)
+                self._connection.execute("COMMIT")
+            except Exception as e:
+                self._connection.execute("ROLLBACK")
+                raise LedgerError(f"failed to write {len(entries)} ledger entries - {e}") from e
+
+    def _latest_entry(self) -> Entry:
+        row = self._connection.execute("SELECT * FROM entries ORDER BY log_timestamp DESC LIMIT 1").fetchone()
+        return None if row is None else SqliteLedger._entry_from_row(row=row)
+
+    def get_latest_entry(self) -> Entry:
+        with self._lock:
+            return self._latest_entry()
+
+    def verify_integrity(self, signer:Signer) -> list[Entry]:
+        """ verifies the entries logged since the last verification - without one, the first entry cannot be """
+        with self._lock:
+            verified_ts = self._read_meta(key=consts.VERIFIED_META_KEY())
+            prev_entry = None
+            if verified_ts is not None:
+                row = self._connection.execute("SELECT * FROM entries WHERE log_timestamp = ?", (verified_ts,)).fetchone()
+                prev_entry = None if row is None else SqliteLedger._entry_from_row(row=row)
+            rows = self._connection.execute(
+                "SELECT * FROM entries WHERE log_timestamp > ? ORDER BY log_timestamp",
+                (-1.0 if verified_ts is None else verified_ts,)
+            ).fetchall()
+        if len(rows) == 0:
+            return []
+        entries = [ SqliteLedger._entry_from_row(row=row) for row in rows ]
+        first = 0
+        if prev_entry is None:
+            prev_entry = entries[0]
+            first = 1
+        problem_entries = [ entries[first + i] for i in verify_chain(entries=entries[first:], signer=signer, prev_entry=prev_entry) ]
+        for problem_entry in problem_entries:
+            logging.warning(f"entry hash mismatch for {problem_entry.name} - expected {problem_entry.hash}")
+        with self._lock:
+            self._write_meta(key=consts.VERIFIED_META_KEY(), value=rows[-1]["log_timestamp"])
+        logging.info(f"ledger integrity checks found {len(problem_entries)} problem entries out of {len(rows)}")
+        return problem_entries
+
+    def purge_old_logs(self) -> list[Entry]:
+        age = unix_timestamp_secs() - util_consts.ONE_DAY_IN_SECS(days=table_ledger_cfg.ENTRY_RETENTION_DAYS())
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._connection.execute("SELECT * FROM entries WHERE log_timestamp < ?", (age,)).fetchall()
+                self._connection.execute("DELETE FROM entries WHERE log_timestamp < ?", (age,))
+                self._connection.execute("COMMIT")
+            except Exception as e:
+                self._connection.execute("ROLLBACK")
+                raise LedgerError(f"failed to purge ledger entries older than {age} - {e}") from e
+        return [ SqliteLedger._entry_from_row(row=row) for row in rows ]
+
+    def get_entries(self, name:str, from_timestamp:int, to_timestamp:int = None, include_tests:bool = True, filters:dict = {}) -> list[Entry]:
+        if from_timestamp is None:
+            raise ValueError("from_timestamp is required")
+        to_timestamp = unix_timestamp_secs() if to_timestamp is None else to_timestamp
+        from_timestamp = abs(from_timestamp)
+        to_timestamp = abs(to_timestamp)
+        if from_timestamp > to_timestamp:
+            raise ValueError("from_timestamp must be less than to_timestamp")
+        filters = {} if filters is None else filters
+        clauses = [ "timestamp >= ?", "timestamp <= ?" ]
+        parameters = [ from_timestamp, to_timestamp ]
+        if include_tests is False:
+            clauses.append("test = 0")
+        if not null_or_empty(name):
+            clauses.append("name = ?")
+            parameters.append(name)
+        for column, value in filter_conditions(filters=filters):
+            clauses.append(f"{column} = ?")
+            parameters.append(int(value) if isinstance(value, bool) else value)
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT name, amount, hash, timestamp, test, data FROM entries WHERE {' AND '.join(clauses)} ORDER BY timestamp",
+                parameters
+            ).fetchall()
+        return apply_filters(entries=[ SqliteLedger._entry_from_row(row=row) for row in rows ], filters=filters)
+
+    def sync_from(self, table_ledger:TableLedger) -> int:
+        """ copies the entries logged to table_ledger since the last sync. Entries within TABLE_LEDGER_VERIFY_SETTLE_SECS 
+        are copied again by every sync until they settled, their hash may still be repaired - and once table_ledger was 
+        recomputed every retained entry is copied again. Returns how many were copied. """
+        now = unix_timestamp_secs_dec()
+        recomputed_ts = table_ledger.recomputed_at()
+        with self._lock:
+            synced_ts = self._read_meta(key=consts.SYNCED_META_KEY())
+            if recomputed_ts != self._read_meta(key=consts.RECOMPUTED_META_KEY()):
+                logging.info(f"the ledger was recomputed at {recomputed_ts} - copying every retained entry to the replica again")
+                synced_ts = None
+        retention_start = now - util_consts.ONE_DAY_IN_SECS(days=table_ledger_cfg.ENTRY_RETENTION_DAYS())
+        from_ts = retention_start if synced_ts is None else max(synced_ts, retention_start)
+        entities = table_ledger.entities_between(from_log_timestamp=from_ts, to_log_timestamp=now)
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert(entities=entities)
+                self._write_meta(key=consts.SYNCED_META_KEY(), value=max(from_ts, now - table_ledger_cfg.VERIFY_SETTLE_SECS()))
+                if recomputed_ts is not None:
+                    self._write_meta(key=consts.RECOMPUTED_META_KEY(), value=recomputed_ts)
+                self._connection.execute("COMMIT")
+            except Exception as e:
+                self._connection.execute("ROLLBACK")
+                raise LedgerError(f"failed to sync {len(entities)} ledger entries - {e}") from e
+        return len(entities)
+
+class ReplicatedLedger(Ledger):
+    """ Writes to a TableLedger and reads entries from a local SqliteLedger replica of it, synced before every read -
+    entries logged a moment ago are read too, see SqliteLedger.sync_from """
+
+    def __init__(self, table_ledger:TableLedger, replica:SqliteLedger):
+        if table_ledger is None:
+            raise ValueError("table_ledger is required")
+        if replica is None:
+            raise ValueError("replica is required")
+        self.table_ledger = table_ledger
+        self.replica = replica
+
+    def log(self, entry:Entry) -> None:
+        self.table_ledger.log(entry=entry)
+
+    def log_many(self, entries:list[Entry], signer:Signer) -> None:
+        self.table_ledger.log_many(entries=entries, signer=signer)
+
+    def verify_integrity(self, signer:Signer) -> list[Entry]:
+        return self.table_ledger.verify_integrity(signer=signer)
+
+    def anchor(self) -> int:
+        return self.table_ledger.anchor()
+
+    def purge_old_logs(self) -> list[Entry]:
+        self.replica.purge_old_logs()
+        return self.table_ledger.purge_old_logs()
+
+    def get_latest_entry(self) -> Entry:
+        return self.table_ledger.get_latest_entry()
+
+    def get_entries(self, name:str, from_timestamp:int, to_timestamp:int = None, include_tests:bool = True, filters:dict = {}) -> list[Entry]:
+        synced = self.replica.sync_from(table_ledger=self.table_ledger)
+        logging.info(f"synced {synced} ledger entries to the replica {self.replica.path}")
+        return self.replica.get_entries(name=name, from_timestamp=from_timestamp, to_timestamp=to_timestamp, include_tests=include_tests, filters=filters)
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+    from table_ledger import HashSigner
+
+    def _entry(name:str, amount:float, timestamp:int, high_interval:str) -> Entry:
+        return Entry(name=name, amount=amount, hash=None, timestamp=timestamp, test=False, data={
+            "ticker": name,
+            "merchant_params": { "high_interval": high_interval, "low_interval": "5", "version": 1 }
+        })
+
+    def _entity(row_key:str, amount:float, log_timestamp:float) -> dict:
+        return {
+            "PartitionKey": "flowmerchant-60-5-1", "RowKey": row_key, "name": "BTCUSDT", "amount": amount, "timestamp": int(log_timestamp),
+            "log_timestamp": float(log_timestamp), "hash": "h", "test": False, "data": "{}"
+        }
+
+    def _table_ledger(entities:list[dict]) -> unittest.mock.Mock:
+        table_ledger = unittest.mock.Mock()
+        table_ledger.recomputed_at.return_value = None
+        table_ledger.entities_between.side_effect = lambda from_log_timestamp, to_log_timestamp: [
+            dict(entity) for entity in entities if from_log_timestamp < entity.get("log_timestamp") <= to_log_timestamp
+        ]
+        return table_ledger
+
+    class Test(unittest.TestCase):
+        def test_log_query_verify(self):
+            ledger = SqliteLedger(path=":memory:")
+            signer = HashSigner()
+            now = unix_timestamp_secs()
+            entries = [ _entry("BTCUSDT", 1.0, now, "60"), _entry("ETHUSDT", 2.0, now + 1, "240"), _entry("BTCUSDT", 3.0, now + 2, "240") ]
+            ledger.log_many(entries=entries[:2], signer=signer)
+            entries[2].hash = signer.sign(new_entry=entries[2], prev_entry=ledger.get_latest_entry())
+            ledger.log(entry=entries[2])
+            self.assertEqual(ledger.get_latest_entry().amount, 3.0)
+            results = ledger.get_entries(name=None, from_timestamp=now, to_timestamp=now + 10, filters={ "merchant_params": { "high_interval": "240" } })
+            self.assertEqual([ entry.amount for entry in results ], [ 2.0, 3.0 ])
+            self.assertEqual(len(ledger.get_entries(name="BTCUSDT", from_timestamp=now, to_timestamp=now + 10)), 2)
+            self.assertEqual(ledger.verify_integrity(signer=signer), [])
+            ledger._connection.execute("UPDATE entries SET amount = 5.0 WHERE amount = 3.0")
+            ### everything up to the last entry was verified, the tampered entry is behind the checkpoint now
+            self.assertEqual(ledger.verify_integrity(signer=signer), [])
+
+        def test_replica_reads_unsettled_and_repaired_entries(self):
+            now = unix_timestamp_secs()
+            settled = _entity("a", amount=1.0, log_timestamp=now - table_ledger_cfg.VERIFY_SETTLE_SECS() - 10)
+            just_logged = _entity("b", amount=2.0, log_timestamp=now)
+            table_ledger = _table_ledger(entities=[ settled, just_logged ])
+            ledger = ReplicatedLedger(table_ledger=table_ledger, replica=SqliteLedger(path=":memory:"))
+            entries = ledger.get_entries(name=None, from_timestamp=now - 100, to_timestamp=now + 1)
+            self.assertEqual([ entry.amount for entry in entries ], [ 1.0, 2.0 ])
+            ### repaired by log_many while it was unsettled - copied again
+            just_logged["hash"] = "repaired"
+            entries = ledger.get_entries(name=None, from_timestamp=now - 100, to_timestamp=now + 1)
+            self.assertEqual([ entry.hash for entry in entries ], [ "h", "repaired" ])
+            ### rewritten by a recompute long after it settled
+            settled["hash"] = "recomputed"
+            self.assertEqual(ledger.get_entries(name=None, from_timestamp=now - 100, to_timestamp=now + 1)[0].hash, "h")
+            table_ledger.recomputed_at.return_value = float(now)
+            self.assertEqual(ledger.get_entries(name=None, from_timestamp=now - 100, to_timestamp=now + 1)[0].hash, "recomputed")
+
+        def test_failed_sync_rolls_back(self):
+            now = unix_timestamp_secs()
+            table_ledger = _table_ledger(entities=[ { "RowKey": "bad", "name": None, "log_timestamp": float(now), "data": "{}" } ])
+            replica = SqliteLedger(path=":memory:")
+            with self.assertRaises(LedgerError):
+                replica.sync_from(table_ledger=table_ledger)
+            ### the connection is not left inside the failed transaction
+            self.assertEqual(replica.purge_old_logs(), [])
+            self.assertIsNone(replica._read_meta(key=consts.SYNCED_META_KEY()))
+
+        def test_sync_promotes_filter_columns(self):
+            now = unix_timestamp_secs()
+            ### logged before TableLedger promoted the filter properties
+            entity = _entity("a", amount=1.0, log_timestamp=now)
+            entity["data"] = dump_payload(data=_entry("BTCUSDT", 1.0, now, "240").data)
+            replica = SqliteLedger(path=":memory:")
+            replica.sync_from(table_ledger=_table_ledger(entities=[ entity ]))
+            results = replica.get_entries(name=None, from_timestamp=now - 1, to_timestamp=now + 1, filters={ "merchant_params": { "high_interval": "240" } })
+            self.assertEqual([ entry.amount for entry in results ], [ 1.0 ])
+
+    unittest.main()
@@ -0,0 +1,147 @@
+from azure.core.exceptions import ResourceNotFoundError
+from azure.data.tables import TableClient, TransactionOperation, UpdateMode
+
+import logging
+import threading
+
+class consts:
+    @staticmethod
+    def MAX_TRANSACTION_OPERATIONS() -> int:
+        ### hard limit imposed by Azure Table storage on entity group transactions
+        return 100
+
+class TableWriteBatch:
+    """ Collects entity writes and flushes them as per-partition table transactions.
+    Writes to the same entity are coalesced (last write wins), so each entity is written at most once per flush.
+    Safe to stage from multiple threads. """
+
+    def __init__(self, table_client: TableClient):
+        if table_client is None:
+            raise ValueError("table_client is required")
+        self.table_client = table_client
+        self._operations:dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+
+    def update(self, entity:dict) -> None:
+        self._stage(operation=TransactionOperation.UPDATE, entity=entity)
+
+    def upsert(self, entity:dict) -> None:
+        self._stage(operation=TransactionOperation.UPSERT, entity=entity)
+
+    def delete(self, partition_key:str, row_key:str) -> None:
+        self._stage(
+            operation=TransactionOperation.DELETE,
+            entity={ "PartitionKey": partition_key, "RowKey": row_key }
+        )
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._operations)
+
+    def _stage(self, operation:TransactionOperation, entity:dict) -> None:
+        if entity is None:
+            raise ValueError("entity is required")
+        if "PartitionKey" not in entity or "RowKey" not in entity:
+            raise ValueError(f"entity must contain PartitionKey and RowKey, got {entity}")
+        entity_key = (entity.get("PartitionKey"), entity.get("RowKey"))
+        with self._lock:
+            self._operations[entity_key] = (operation, dict(entity))
+
+    def flush(self) -> int:
+        """ returns the number of storage round trips it took to flush """
+        with self._lock:
+            operations = list(self._operations.values())
+            self._operations = {}
+        if len(operations) == 0:
+            return 0
+
+        partitions:dict[str, list] = {}
+        for operation, entity in operations:
+            partition_key = entity.get("PartitionKey")
+            if partition_key not in partitions:
+                partitions[partition_key] = []
+            partitions[partition_key].append((operation, entity))
+
+        round_trips = 0
+        failures = []
+        max_ops = consts.MAX_TRANSACTION_OPERATIONS()
+        for partition_key, partition_ops in partitions.items():
+            for i in range(0, len(partition_ops), max_ops):
+                chunk = partition_ops[i:i + max_ops]
+                round_trips += 1
+                try:
+                    self.table_client.submit_transaction([ self._transaction_op(op, entity) for op, entity in chunk ])
+                except Exception as e:
+                    logging.warning(f"transaction of {len(chunk)} operations failed for partition {partition_key} - falling back to single writes: {e}")
+                    for operation, entity in chunk:
+                        round_trips += 1
+                        try:
+                            self._single_write(operation=operation, entity=entity)
+                        except Exception as single_e:
+                            logging.error(f"failed to write entity {entity.get('PartitionKey')}/{entity.get('RowKey')} ({operation.value}): {single_e}")
+                            failures.append(single_e)
+
+        logging.info(f"flushed {len(operations)} entity writes over {len(partitions)} partitions in {round_trips} round trips")
+        if len(failures) != 0:
+            raise failures[0]
+        return round_trips
+
+    def _transaction_op(self, operation:TransactionOperation, entity:dict) -> tuple:
+        if operation == TransactionOperation.UPDATE:
+            return (operation, entity, { "mode": UpdateMode.MERGE })
+        return (operation, entity)
+
+    def _single_write(self, operation:TransactionOperation, entity:dict) -> None:
+        if operation == TransactionOperation.UPDATE:
+            self.table_client.update_entity(entity=entity)
+        elif operation == TransactionOperation.UPSERT:
+            self.table_client.upsert_entity(entity=entity)
+        elif operation == TransactionOperation.DELETE:
+            try:
+                self.table_client.delete_entity(
+                    partition_key=entity.get("PartitionKey"),
+                    row_key=entity.get("RowKey")
+                )
+            except ResourceNotFoundError:
+                ### already gone is as good as deleted
+                logging.info(f"entity {entity.get('PartitionKey')}/{entity.get('RowKey')} was already deleted")
+        else:
+            raise ValueError(f"unsupported operation {operation}")
+
+if __name__ == "__main__":
+    import unittest
+    import unittest.mock
+
+    class Test(unittest.TestCase):
+        def test_coalesces_and_groups_by_partition(self):
+            mock_table_client = unittest.mock.Mock()
+            batch = TableWriteBatch(table_client=mock_table_client)
+            batch.update({ "PartitionKey": "a", "RowKey": "1", "v": 1 })
+            batch.update({ "PartitionKey": "a", "RowKey": "1", "v": 2 })
+            batch.update({ "PartitionKey": "a", "RowKey": "2", "v": 1 })
+            batch.delete(partition_key="b", row_key="1")
+            self.assertEqual(batch.pending_count(), 3)
+            self.assertEqual(batch.flush(), 2)
+            self.assertEqual(mock_table_client.submit_transaction.call_count, 2)
+            first_tx = mock_table_client.submit_transaction.call_args_list[0].args[0]
+            self.assertEqual(len(first_tx), 2)
+            self.assertEqual(first_tx[0][1]["v"], 2)
+            self.assertEqual(batch.pending_count(), 0)
+
+        def test_chunks_large_partitions(self):
+            mock_table_client = unittest.mock.Mock()
+            batch = TableWriteBatch(table_client=mock_table_client)
+            for i in range(250):
+                batch.upsert({ "PartitionKey": "a", "RowKey": str(i) })
+            self.assertEqual(batch.flush(), 3)
+
+        def test_falls_back_to_single_writes(self):
+            mock_table_client = unittest.mock.Mock()
+            mock_table_client.submit_transaction.side_effect = ValueError("batch failed")
+            batch = TableWriteBatch(table_client=mock_table_client)
+            batch.update({ "PartitionKey": "a", "RowKey": "1" })
+            batch.update({ "PartitionKey": "a", "RowKey": "2" })
+            self.assertEqual(batch.flush(), 3)
+            self.assertEqual(mock_table_client.update_entity.call_count, 2)
+
+    unittest.main()
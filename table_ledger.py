@@ -1,12 +1,20 @@
 import unittest.mock
-from ledger import Ledger, Entry, Signer
+from ledger import Ledger, Entry, Signer, LedgerError, LedgerConflictError
+from ledger_buckets import LedgerBuckets, buckets_for
+from ledger_codec import encode as encode_payload, decode as decode_payload
+from ledger_merkle import LedgerAnchors
+from ledger_rollups import LedgerRollups
+from ledger_verification import verify_chain
 from merchant_keys import keys as mkeys
 from merchant_order import Order
 from order_strategies import OrderStrategies
 from security import hash
+from table_batch import TableWriteBatch, consts as table_batch_consts
 from utils import unix_timestamp_secs, unix_timestamp_ms, null_or_empty, unix_timestamp_secs_dec, consts as util_consts
 
-from azure.data.tables import TableClient
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import TableClient, TableServiceClient, TransactionOperation, UpdateMode
 
 import json
 import logging
@@ -21,6 +29,196 @@ class consts:
     @staticmethod
     def AMOUNT_TRUNCATION() -> int:
         return 10
+
+    @staticmethod
+    def CHAIN_PARTITION_KEY() -> str:
+        ### bookkeeping entities of the ledger itself, never ledger entries
+        return "__chain__"
+
+    @staticmethod
+    def HEAD_ROW_KEY() -> str:
+        return "head"
+
+    @staticmethod
+    def VERIFIED_ROW_KEY() -> str:
+        return "verified"
+
+    @staticmethod
+    def PURGE_ROW_KEY() -> str:
+        return "purge"
+
+    @staticmethod
+    def RECOMPUTE_ROW_KEY() -> str:
+        return "recompute"
+
+    @staticmethod
+    def RECOMPUTED_ROW_KEY() -> str:
+        return "recomputed"
+
+    @staticmethod
+    def MIN_LOG_TIMESTAMP_STEP() -> float:
+        ### log_timestamp has millisecond resolution, each entry must be strictly after the previous one
+        return 0.001
+
+class hkeys:
+    """ properties of the chain head - prefixed so the ledger's log_timestamp / timestamp / name queries never match it """
+    @staticmethod
+    def PARTITION_KEY() -> str:
+        return "tip_partition_key"
+
+    @staticmethod
+    def ROW_KEY() -> str:
+        return "tip_row_key"
+
+    @staticmethod
+    def LOG_TIMESTAMP() -> str:
+        return "tip_log_timestamp"
+
+    @staticmethod
+    def NAME() -> str:
+        return "tip_name"
+
+    @staticmethod
+    def AMOUNT() -> str:
+        return "tip_amount"
+
+    @staticmethod
+    def TIMESTAMP() -> str:
+        return "tip_timestamp"
+
+    @staticmethod
+    def HASH() -> str:
+        return "tip_hash"
+
+    @staticmethod
+    def TEST() -> str:
+        return "tip_test"
+
+    @staticmethod
+    def DATA() -> str:
+        return "tip_data"
+
+    @staticmethod
+    def DATA_Z() -> str:
+        return "tip_data_z"
+
+    @staticmethod
+    def PROBLEM_COUNT() -> str:
+        ### verification checkpoint only - problems found so far
+        return "tip_problem_count"
+
+    @staticmethod
+    def RECOMPUTE_CURSOR() -> str:
+        ### recompute checkpoint only - entries logged up to here are recomputed
+        return "tip_recompute_cursor"
+
+    @staticmethod
+    def RECOMPUTED_AT() -> str:
+        ### recompute marker only - when the last recompute finished
+        return "tip_recomputed_at"
+
+class pkeys:
+    """ properties of the purge resume point - the continuation of an unfinished purge scan """
+    @staticmethod
+    def TABLE() -> str:
+        return "purge_table"
+
+    @staticmethod
+    def NEXT_PARTITION_KEY() -> str:
+        return "purge_next_partition_key"
+
+    @staticmethod
+    def NEXT_ROW_KEY() -> str:
+        return "purge_next_row_key"
+
+class fkeys:
+    """ entry properties copied out of data when an entry is logged, so get_entries can filter on them server side """
+    @staticmethod
+    def TICKER() -> str:
+        return "ticker"
+
+    @staticmethod
+    def HIGH_INTERVAL() -> str:
+        return "high_interval"
+
+    @staticmethod
+    def LOW_INTERVAL() -> str:
+        return "low_interval"
+
+    @staticmethod
+    def STOPLOSS_PERCENT() -> str:
+        return "stoploss_percent"
+
+    @staticmethod
+    def TAKEPROFIT_PERCENT() -> str:
+        return "takeprofit_percent"
+
+    @staticmethod
+    def STRATEGY() -> str:
+        return "strategy"
+
+    @staticmethod
+    def TAGS() -> str:
+        ### JSON list - stored for reading, tags filters still run on data
+        return "tags"
+
+    @staticmethod
+    def DRY_RUN() -> str:
+        return "dry_run"
+
+_order_keys = mkeys.bkrdata.order
+### path of a filterable field in entry data -> the property it is promoted to
+_FILTER_PROPERTIES = {
+    (_order_keys.TICKER(),): fkeys.TICKER(),
+    (_order_keys.MERCHANT_PARAMETERS(), _order_keys.merchant_params.HIGH_INTERVAL()): fkeys.HIGH_INTERVAL(),
+    (_order_keys.MERCHANT_PARAMETERS(), _order_keys.merchant_params.LOW_INTERVAL()): fkeys.LOW_INTERVAL(),
+    (_order_keys.MERCHANT_PARAMETERS(), _order_keys.merchant_params.STOPLOSS_PERCENT()): fkeys.STOPLOSS_PERCENT(),
+    (_order_keys.MERCHANT_PARAMETERS(), _order_keys.merchant_params.TAKEPROFIT_PERCENT()): fkeys.TAKEPROFIT_PERCENT(),
+    (_order_keys.MERCHANT_PARAMETERS(), "strategy"): fkeys.STRATEGY(),
+    (_order_keys.METADATA(), "tags"): fkeys.TAGS(),
+    (_order_keys.METADATA(), _order_keys.metadata.DRY_RUN()): fkeys.DRY_RUN()
+}
+
+### the columns an Entry is built from
+_ENTRY_COLUMNS = [ "name", "amount", "hash", "timestamp", "test", "data", "data_z" ]
+
+def _odata_literal(value) -> str:
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (int, float)):
+        return repr(value) if isinstance(value, float) else str(value)
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    raise ValueError(f"cannot filter on {type(value)} values")
+
+def filter_conditions(filters:dict, path:tuple = ()) -> list[tuple[str, object]]:
+    """ (promoted property, value) of every get_entries filter that can be evaluated on a promoted property """
+    conditions = []
+    for filter_property, filter_value in filters.items():
+        filter_path = path + (filter_property,)
+        if isinstance(filter_value, dict):
+            conditions.extend(filter_conditions(filters=filter_value, path=filter_path))
+        elif filter_path in _FILTER_PROPERTIES and isinstance(filter_value, (str, int, float, bool)):
+            conditions.append((_FILTER_PROPERTIES.get(filter_path), filter_value))
+    return conditions
+
+def _apply_filter(entry_data:dict, filters:dict) -> bool:
+    for filter_property, filter_value in filters.items():
+        if filter_property in entry_data:
+            if isinstance(filter_value, dict):
+                if not _apply_filter(entry_data=entry_data[filter_property], filters=filter_value):
+                    return False
+            else:
+                if entry_data[filter_property] != filter_value:
+                    return False
+    return True
+
+def apply_filters(entries:list[Entry], filters:dict) -> list[Entry]:
+    """ the entries whose data matches every get_entries filter - a property missing from data matches anything """
+    return [ entry for entry in entries if _apply_filter(entry_data=entry.data, filters=filters) ]
+
+### marks that the head has not been read by this ledger instance yet
+_HEAD_UNREAD = object()
     
 class cfg:
     @staticmethod
@@ -33,6 +231,49 @@ class cfg:
             raise ValueError(f"TABLE_LEDGER_ENTRY_RETENTION_DAYS must be less than 365, got {days_retention}")
         return days_retention
 
+    @staticmethod
+    def VERIFY_SETTLE_SECS() -> int:
+        ### entries younger than this may still be repaired by an in-flight log_many, so they are left for the next verification
+        settle_secs:str = os.environ.get("TABLE_LEDGER_VERIFY_SETTLE_SECS", "60")
+        if not settle_secs.isnumeric():
+            raise ValueError(f"TABLE_LEDGER_VERIFY_SETTLE_SECS must be an integer, got {settle_secs}")
+        return int(settle_secs)
+
+    @staticmethod
+    def PURGE_MAX_ROWS() -> int:
+        max_rows:str = os.environ.get("TABLE_LEDGER_PURGE_MAX_ROWS", "1000")
+        if not max_rows.isnumeric() or int(max_rows) == 0:
+            raise ValueError(f"TABLE_LEDGER_PURGE_MAX_ROWS must be a positive integer, got {max_rows}")
+        return int(max_rows)
+
+    @staticmethod
+    def PURGE_MAX_MS() -> int:
+        max_ms:str = os.environ.get("TABLE_LEDGER_PURGE_MAX_MS", "5000")
+        if not max_ms.isnumeric() or int(max_ms) == 0:
+            raise ValueError(f"TABLE_LEDGER_PURGE_MAX_MS must be a positive integer, got {max_ms}")
+        return int(max_ms)
+
+    @staticmethod
+    def RECOMPUTE_WINDOW_SECS() -> int:
+        ### the span of log_timestamp read at a time - bounds the entries held in memory
+        window_secs:str = os.environ.get("TABLE_LEDGER_RECOMPUTE_WINDOW_SECS", "21600")
+        if not window_secs.isnumeric() or int(window_secs) == 0:
+            raise ValueError(f"TABLE_LEDGER_RECOMPUTE_WINDOW_SECS must be a positive integer, got {window_secs}")
+        return int(window_secs)
+
+    @staticmethod
+    def RECOMPUTE_MAX_MS() -> int:
+        max_ms:str = os.environ.get("TABLE_LEDGER_RECOMPUTE_MAX_MS", "60000")
+        if not max_ms.isnumeric() or int(max_ms) == 0:
+            raise ValueError(f"TABLE_LEDGER_RECOMPUTE_MAX_MS must be a positive integer, got {max_ms}")
+        return int(max_ms)
+
+    @staticmethod
+    def FILTER_PUSHDOWN() -> bool:
+        ### only turn on once the ledger-filter-properties migration ran - until then entries logged before the
+        ### filter properties existed lack them and would be dropped, where apply_filters lets them match
+        return os.environ.get("TABLE_LEDGER_FILTER_PUSHDOWN", "false").lower() == "true"
+
 class HashSigner(Signer):
     def sign(self, new_entry:Entry, prev_entry:Entry) -> str:
         if new_entry is None:
@@ -53,38 +294,97 @@ class HashSigner(Signer):
         return hash(entry_blob, count=consts.HASH_CT())
 
 class TableLedger(Ledger):
-    def __init__(self, table_client: TableClient):
+    """ The newest entry is mirrored in a chain head entity (PartitionKey __chain__, RowKey head) that every log() 
+    moves forward under ETag concurrency, so the latest entry is a single point read. 
+    log() only succeeds if the head is still the one get_latest_entry() returned - otherwise the entry was signed 
+    against a stale previous entry and LedgerConflictError is raised. 
+    Entries are kept in the buckets configured by TABLE_LEDGER_BUCKETS (see ledger_buckets), the bookkeeping
+    entities always stay in table_client. Every entry written is also added to rollups, when given. 
+    Known gap: log() moves the head before it writes the entry, so a process that crashes in between leaves the head
+    on a row that does not exist and the next entry is signed onto it - verify_integrity moves such a head back. """
+
+    def __init__(self, table_client: TableClient, table_service: TableServiceClient = None, rollups: LedgerRollups = None):
         if table_client is None:
             raise ValueError("table_client is required")
         self.table_client = table_client
+        self.buckets:LedgerBuckets = buckets_for(table_client=table_client, table_service=table_service)
+        self.rollups = rollups
+        self._head_etag = _HEAD_UNREAD
 
     def verify_integrity(self, signer:Signer) -> list[Entry]:
+        """ Verifies the entries appended since the last verification, starting from the checkpoint entity 
+        (PartitionKey __chain__, RowKey verified), then moves the checkpoint to the last entry verified.
+        Without a checkpoint the last day is verified, and its first entry cannot be. """
         problem_entries = []
-        now = unix_timestamp_secs()
-        one_day_old_ts = now - util_consts.ONE_DAY_IN_SECS()
-        query_filter = f"log_timestamp gt {one_day_old_ts}"
-        entities = self.table_client.query_entities(query_filter)
-        entities = list(entities)
+        checkpoint = self._read_chain_entity(row_key=consts.VERIFIED_ROW_KEY())
+        settled_ts = unix_timestamp_secs_dec() - cfg.VERIFY_SETTLE_SECS()
+        self._repair_orphaned_head(settled_ts=settled_ts)
+        if checkpoint is None:
+            from_ts = unix_timestamp_secs() - util_consts.ONE_DAY_IN_SECS()
+            prev_entry = None
+        else:
+            from_ts = checkpoint.get(hkeys.LOG_TIMESTAMP())
+            prev_entry = self._entry_from_head(head=checkpoint)
+        query_filter = f"log_timestamp gt {from_ts} and log_timestamp le {settled_ts}"
+        entities = self.buckets.query(query_filter, from_timestamp=from_ts, to_timestamp=settled_ts)
         entity_ct = len(entities)
         if entity_ct == 0:
-            logging.info("No entries found in the ledger - skipping integrity checks")
+            logging.info("No new entries found in the ledger - skipping integrity checks")
             return []
         entities.sort(key=lambda x: x["log_timestamp"], reverse=False)
-        prev_entity = None
-        for entity in entities:
-            ## skip the first entry - we require the previous entry to compute the hash
-            ## but we don't have it for the first entry
-            if entity.get("hash") != entities[0].get("hash"):    
-                current_entry = self._entry_from_entity(raw_entity=entity)
-                previous_entry = self._entry_from_entity(raw_entity=prev_entity)
-                signature = signer.sign(new_entry=current_entry, prev_entry=previous_entry)
-                if signature != current_entry.hash:
-                    logging.warning(f"entry hash mismatch for {current_entry.name} - expected {current_entry.hash} but got {signature}. Previous entry: {previous_entry}")
-                    problem_entries.append(current_entry)
-            prev_entity = entity
-        logging.info(f"ledger integrity checks found {len(problem_entries)} problem entries out of {entity_ct}")
+        entries = [ self._entry_from_entity(raw_entity=entity) for entity in entities ]
+        ## without a checkpoint there is no previous entry for the first entry in the window
+        first = 0
+        if prev_entry is None:
+            prev_entry = entries[0]
+            first = 1
+        for i in verify_chain(entries=entries[first:], signer=signer, prev_entry=prev_entry):
+            current_entry = entries[first + i]
+            logging.warning(f"entry hash mismatch for {current_entry.name} - expected {current_entry.hash}. Previous entry: {entries[first + i - 1] if first + i > 0 else prev_entry}")
+            problem_entries.append(current_entry)
+        problem_count = len(problem_entries) + (0 if checkpoint is None else checkpoint.get(hkeys.PROBLEM_COUNT(), 0))
+        new_checkpoint = self._head_from_entity(entity=entities[-1], row_key=consts.VERIFIED_ROW_KEY())
+        new_checkpoint[hkeys.PROBLEM_COUNT()] = problem_count
+        self.table_client.upsert_entity(entity=new_checkpoint, mode=UpdateMode.REPLACE)
+        logging.info(f"ledger integrity checks found {len(problem_entries)} problem entries out of {entity_ct} ({problem_count} since the first checkpoint)")
         return problem_entries
     
+    def _repair_orphaned_head(self, settled_ts:float) -> None:
+        """ moves a head left on a missing row (see the known gap above) back to the latest entry that exists - 
+        under ETag, so a log() that moved it meanwhile wins """
+        head = self._read_head()
+        if head is None or head.get(hkeys.ROW_KEY()) is None or head.get(hkeys.LOG_TIMESTAMP()) > settled_ts:
+            ### a younger head's entry may still be being written
+            return
+        try:
+            self.buckets.table_for(log_timestamp=head.get(hkeys.LOG_TIMESTAMP())).get_entity(
+                partition_key=head.get(hkeys.PARTITION_KEY()), 
+                row_key=head.get(hkeys.ROW_KEY())
+            )
+            return
+        except ResourceNotFoundError:
+            pass
+        latest_entity = self._scan_latest_entity()
+        logging.error(f"the ledger head points at the missing entry {head.get(hkeys.ROW_KEY())} - moving it back to {None if latest_entity is None else latest_entity.get('RowKey')}")
+        try:
+            if latest_entity is None:
+                self.table_client.delete_entity(
+                    partition_key=consts.CHAIN_PARTITION_KEY(), 
+                    row_key=consts.HEAD_ROW_KEY(), 
+                    etag=head.metadata.get("etag"), 
+                    match_condition=MatchConditions.IfNotModified
+                )
+            else:
+                self.table_client.update_entity(
+                    entity=self._head_from_entity(entity=latest_entity), 
+                    mode=UpdateMode.REPLACE, 
+                    etag=head.metadata.get("etag"), 
+                    match_condition=MatchConditions.IfNotModified
+                )
+        except (ResourceModifiedError, ResourceNotFoundError) as e:
+            logging.warning(f"the ledger head moved while it was repaired - {e}")
+        self._head_etag = _HEAD_UNREAD
+
     def _entry_from_entity(self, raw_entity:dict) -> Entry:
         return Entry(
             name=raw_entity["name"],
@@ -92,15 +392,24 @@ class TableLedger(Ledger):
             hash=raw_entity["hash"],
             timestamp=raw_entity["timestamp"],
             test=raw_entity["test"],
-            data=json.loads(raw_entity["data"])
+            data=decode_payload(properties=raw_entity)
         )
 
     def get_latest_entry(self) -> Entry:
+        head = self._read_head()
+        if head is not None:
+            self._head_etag = head.metadata.get("etag")
+            return self._entry_from_head(head=head)
+        ### no head yet (a ledger written before the head existed) - the first log() creates it
+        self._head_etag = None
+        last_entity = self._scan_latest_entity()
+        return None if last_entity is None else self._entry_from_entity(raw_entity=last_entity)
+
+    def _scan_latest_entity(self) -> dict:
         now = unix_timestamp_secs()
         one_mo_old_ts = now - util_consts.ONE_MONTH_IN_SECS()
         query_filter = f"log_timestamp gt {one_mo_old_ts}"
-        entities = self.table_client.query_entities(query_filter)
-        entities = list(entities)
+        entities = self.buckets.query(query_filter, from_timestamp=one_mo_old_ts, to_timestamp=now)
         entity_ct = len(entities)
         if entity_ct == 0:
             logging.info("No entries found in the ledger - no latest entry exists")
@@ -110,33 +419,264 @@ class TableLedger(Ledger):
         last_entity = entities[0]
         if last_entity.get("log_timestamp") < entities[entity_ct - 1].get("log_timestamp"):
             raise ValueError("entities are not sorted by log_timestamp correctly (descending)")
-        return self._entry_from_entity(raw_entity=last_entity)
+        return last_entity
 
-    def log(self, entry:Entry) -> None:
+    def _read_head(self) -> dict:
+        return self._read_chain_entity(row_key=consts.HEAD_ROW_KEY())
+
+    def _read_chain_entity(self, row_key:str) -> dict:
+        try:
+            return self.table_client.get_entity(partition_key=consts.CHAIN_PARTITION_KEY(), row_key=row_key)
+        except ResourceNotFoundError:
+            return None
+
+    def _entry_from_head(self, head:dict) -> Entry:
+        return self._entry_from_entity(raw_entity={
+            "name": head.get(hkeys.NAME()),
+            "amount": head.get(hkeys.AMOUNT()),
+            "hash": head.get(hkeys.HASH()),
+            "timestamp": head.get(hkeys.TIMESTAMP()),
+            "test": head.get(hkeys.TEST()),
+            "data": head.get(hkeys.DATA()),
+            "data_z": head.get(hkeys.DATA_Z())
+        })
+
+    def _head_from_entity(self, entity:dict, row_key:str = consts.HEAD_ROW_KEY()) -> dict:
+        """ a chain entity pointing at entity - the head, or a checkpoint when row_key is given """
+        return {
+            "PartitionKey": consts.CHAIN_PARTITION_KEY(),
+            "RowKey": row_key,
+            hkeys.PARTITION_KEY(): entity.get("PartitionKey"),
+            hkeys.ROW_KEY(): entity.get("RowKey"),
+            hkeys.LOG_TIMESTAMP(): entity.get("log_timestamp"),
+            hkeys.NAME(): entity.get("name"),
+            hkeys.AMOUNT(): entity.get("amount"),
+            hkeys.TIMESTAMP(): entity.get("timestamp"),
+            hkeys.HASH(): entity.get("hash"),
+            hkeys.TEST(): entity.get("test"),
+            hkeys.DATA(): entity.get("data"),
+            hkeys.DATA_Z(): entity.get("data_z")
+        }
+
+    def _is_chain_entity(self, entity:dict) -> bool:
+        return entity.get("PartitionKey") == consts.CHAIN_PARTITION_KEY() or LedgerAnchors.is_anchor_entity(entity=entity)
+
+    def _claim_head(self, new_head:dict) -> str:
+        """ moves the head to new_head if nobody else moved it since it was read, returns the new etag """
+        try:
+            if self._head_etag is None:
+                result = self.table_client.create_entity(entity=new_head)
+            else:
+                result = self.table_client.update_entity(
+                    entity=new_head, 
+                    mode=UpdateMode.REPLACE, 
+                    etag=self._head_etag, 
+                    match_condition=MatchConditions.IfNotModified
+                )
+        except (ResourceExistsError, ResourceModifiedError) as e:
+            self._head_etag = _HEAD_UNREAD
+            raise LedgerConflictError(f"the ledger was appended to concurrently - re-read the latest entry and sign again") from e
+        return result.get("etag")
+
+    def _next_log_timestamp(self, head:dict) -> float:
+        log_timestamp = unix_timestamp_secs_dec()
+        if head is not None and head.get(hkeys.LOG_TIMESTAMP()) is not None:
+            log_timestamp = max(log_timestamp, round(head.get(hkeys.LOG_TIMESTAMP()) + consts.MIN_LOG_TIMESTAMP_STEP(), 3))
+        return log_timestamp
+
+    def _validate_entry(self, entry:Entry, signed:bool = True) -> None:
         if entry is None:
             raise ValueError("entry is required")
         if null_or_empty(entry.name):
             raise ValueError("entry.name is required")
         if entry.amount is None:
             raise ValueError("entry.amount is required")
-        if null_or_empty(entry.hash):
+        if signed and null_or_empty(entry.hash):
             raise ValueError("entry.hash is required")
         if entry.timestamp is None:
             raise ValueError("entry.timestamp is required")
         if entry.data is None:
             raise ValueError("entry.data is required")
-        entity = {
+
+    @staticmethod
+    def filter_properties(data:dict) -> dict:
+        """ the promoted filter properties of an entry's data """
+        properties = {}
+        for path, property_name in _FILTER_PROPERTIES.items():
+            value = data
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value is None:
+                continue
+            properties[property_name] = json.dumps(value) if isinstance(value, (list, dict)) else value
+        return properties
+
+    def _entity_from_entry(self, entry:Entry, log_timestamp:float) -> dict:
+        return {
+            **TableLedger.filter_properties(data=entry.data),
             "PartitionKey": self._get_partition_key(entry.data),
             "RowKey": str(uuid.uuid4()),
             "name": entry.name,
             "amount": entry.amount,
             "timestamp": entry.timestamp,
-            "log_timestamp": unix_timestamp_secs_dec(),
+            "log_timestamp": log_timestamp,
             "hash": entry.hash,
             "test": entry.test,
-            "data": json.dumps(entry.data)
+            **encode_payload(data=entry.data)
         }
-        self.table_client.create_entity(entity)
+
+    def log(self, entry:Entry) -> None:
+        self._validate_entry(entry=entry)
+        head = self._read_head()
+        if self._head_etag is _HEAD_UNREAD:
+            ### the caller did not read the latest entry through this ledger - chain onto whatever the head is now
+            self._head_etag = None if head is None else head.metadata.get("etag")
+        entity = self._entity_from_entry(entry=entry, log_timestamp=self._next_log_timestamp(head=head))
+        ### the head is claimed first so two writers can never both chain onto the same previous entry
+        previous_head = head
+        self._head_etag = self._claim_head(new_head=self._head_from_entity(entity=entity))
+        try:
+            self.buckets.table_for(log_timestamp=entity.get("log_timestamp")).create_entity(entity)
+        except Exception as e:
+            self._restore_head(previous_head=previous_head)
+            raise LedgerError(f"failed to write ledger entry {entry.name} - {e}") from e
+        self._roll_up(entries=[ entry ])
+
+    def _roll_up(self, entries:list[Entry]) -> None:
+        if self.rollups is None or len(entries) == 0:
+            return
+        try:
+            self.rollups.add(entries=entries)
+        except Exception as e:
+            ### the entries are written - a rollup that missed them is repaired by the ledger-rollups migration
+            logging.error(f"failed to add {len(entries)} ledger entries to the rollups - {e}", exc_info=True)
+
+    def log_many(self, entries:list[Entry], signer:Signer) -> None:
+        """ Signs entries in memory as one chain onto the current head and writes them with per-partition transactions.
+        If some entries cannot be written, the written ones are re-signed around the gaps and the head is moved to the 
+        last written entry, so the chain still verifies - then LedgerError is raised with the entries that are missing. """
+        if entries is None:
+            raise ValueError("entries is required")
+        if signer is None:
+            raise ValueError("signer is required")
+        if len(entries) == 0:
+            return
+        for entry in entries:
+            self._validate_entry(entry=entry, signed=False)
+
+        head = self._read_head()
+        if head is not None:
+            self._head_etag = head.metadata.get("etag")
+            chain_entry = self._entry_from_head(head=head)
+        else:
+            self._head_etag = None
+            last_entity = self._scan_latest_entity()
+            chain_entry = None if last_entity is None else self._entry_from_entity(raw_entity=last_entity)
+
+        first_entry = chain_entry
+        log_timestamp = self._next_log_timestamp(head=head)
+        entities = []
+        for entry in entries:
+            entry.hash = signer.sign(new_entry=entry, prev_entry=chain_entry)
+            entities.append(self._entity_from_entry(entry=entry, log_timestamp=log_timestamp))
+            chain_entry = entry
+            log_timestamp = round(log_timestamp + consts.MIN_LOG_TIMESTAMP_STEP(), 3)
+
+        previous_head = head
+        self._head_etag = self._claim_head(new_head=self._head_from_entity(entity=entities[-1]))
+
+        failed_rows = self._write_entities(entities=entities)
+        self._roll_up(entries=[ entry for entry, entity in zip(entries, entities) if entity.get("RowKey") not in failed_rows ])
+        if len(failed_rows) == 0:
+            return
+        self._repair_chain(
+            entries=entries, 
+            entities=entities, 
+            failed_rows=failed_rows, 
+            prev_entry=first_entry, 
+            previous_head=previous_head, 
+            signer=signer
+        )
+        failed_names = [ entry.name for entry, entity in zip(entries, entities) if entity.get("RowKey") in failed_rows ]
+        raise LedgerError(f"{len(failed_rows)} of {len(entries)} ledger entries could not be written: {failed_names}")
+
+    def _write_entities(self, entities:list[dict]) -> set[str]:
+        """ returns the RowKeys of the entities that could not be written """
+        partitions:dict[tuple, list[dict]] = {}
+        tables:dict[tuple, TableClient] = {}
+        for entity in entities:
+            table = self.buckets.table_for(log_timestamp=entity.get("log_timestamp"))
+            partition = (table.table_name, entity.get("PartitionKey"))
+            if partition not in partitions:
+                partitions[partition] = []
+                tables[partition] = table
+            partitions[partition].append(entity)
+        failed_rows = set()
+        max_ops = table_batch_consts.MAX_TRANSACTION_OPERATIONS()
+        for partition, partition_entities in partitions.items():
+            table = tables[partition]
+            for i in range(0, len(partition_entities), max_ops):
+                chunk = partition_entities[i:i + max_ops]
+                try:
+                    table.submit_transaction([ (TransactionOperation.CREATE, entity) for entity in chunk ])
+                except Exception as e:
+                    logging.warning(f"ledger transaction of {len(chunk)} entries failed for partition {partition[1]} - writing them one by one: {e}")
+                    for entity in chunk:
+                        try:
+                            table.create_entity(entity)
+                        except Exception as single_e:
+                            logging.error(f"failed to write ledger entry {entity.get('name')} - {single_e}")
+                            failed_rows.add(entity.get("RowKey"))
+        return failed_rows
+
+    def _repair_chain(self, entries:list[Entry], entities:list[dict], failed_rows:set[str], prev_entry:Entry, previous_head:dict, signer:Signer) -> None:
+        last_written = None
+        for entry, entity in zip(entries, entities):
+            if entity.get("RowKey") in failed_rows:
+                continue
+            signature = signer.sign(new_entry=entry, prev_entry=prev_entry)
+            if signature != entity.get("hash"):
+                entry.hash = signature
+                entity["hash"] = signature
+                self.buckets.table_for(log_timestamp=entity.get("log_timestamp")).update_entity(entity=entity)
+            prev_entry = entry
+            last_written = entity
+        if last_written is None:
+            self._restore_head(previous_head=previous_head)
+            return
+        try:
+            result = self.table_client.update_entity(
+                entity=self._head_from_entity(entity=last_written), 
+                mode=UpdateMode.REPLACE, 
+                etag=self._head_etag, 
+                match_condition=MatchConditions.IfNotModified
+            )
+            self._head_etag = result.get("etag")
+        except Exception as e:
+            self._head_etag = _HEAD_UNREAD
+            logging.error(f"could not move the ledger head back to the last written entry - the next entry will not verify: {e}")
+
+    def _restore_head(self, previous_head:dict) -> None:
+        try:
+            if previous_head is None:
+                self.table_client.delete_entity(
+                    partition_key=consts.CHAIN_PARTITION_KEY(), 
+                    row_key=consts.HEAD_ROW_KEY(), 
+                    etag=self._head_etag, 
+                    match_condition=MatchConditions.IfNotModified
+                )
+                self._head_etag = None
+            else:
+                result = self.table_client.update_entity(
+                    entity=dict(previous_head), 
+                    mode=UpdateMode.REPLACE, 
+                    etag=self._head_etag, 
+                    match_condition=MatchConditions.IfNotModified
+                )
+                self._head_etag = result.get("etag")
+        except Exception as e:
+            self._head_etag = _HEAD_UNREAD
+            logging.error(f"could not restore the ledger head after a failed append - the next entry will not verify: {e}")
 
     def _get_partition_key(self, data:dict) -> str:
         if mkeys.bkrdata.order.MERCHANT_PARAMETERS() not in data:
@@ -155,20 +695,89 @@ class TableLedger(Ledger):
         return partition_key
 
     def purge_old_logs(self) -> list:
+        """ Drops the buckets that only hold expired entries, then deletes the remaining expired entries a page at 
+        a time through per-partition transactions, stopping once TABLE_LEDGER_PURGE_MAX_ROWS rows are deleted or 
+        TABLE_LEDGER_PURGE_MAX_MS has passed. An unfinished scan leaves its continuation in a resume point 
+        (PartitionKey __chain__, RowKey purge) for the next call. """
+        start_time = unix_timestamp_ms()
+        max_rows = cfg.PURGE_MAX_ROWS()
+        max_ms = cfg.PURGE_MAX_MS()
         now = unix_timestamp_secs()
         retention_period_secs = util_consts.ONE_DAY_IN_SECS(days=cfg.ENTRY_RETENTION_DAYS())
         age = now - retention_period_secs
-        ### TODO - put a limit on the amount returned to prevent long processing
-        ### apply it at the query level
+        dropped_buckets = self.buckets.drop_before(timestamp=age)
+        if dropped_buckets != 0:
+            logging.info(f"dropped {dropped_buckets} expired ledger buckets")
         query_filter = f"log_timestamp lt {age}"
-        deleted_entities = self.table_client.query_entities(query_filter)
-        deleted_entities = list(deleted_entities)
-        for entity in deleted_entities:
-            self.table_client.delete_entity(
-                partition_key=entity.get("PartitionKey"),
-                row_key=entity.get("RowKey")
-            )
+        resume_point = self._read_chain_entity(row_key=consts.PURGE_ROW_KEY())
+        tables = self.buckets.tables_between(from_timestamp=0, to_timestamp=age)
+        if resume_point is not None:
+            ### the tables before the one the last purge stopped in are done
+            table_names = [ table.table_name for table in tables ]
+            if resume_point.get(pkeys.TABLE()) in table_names:
+                tables = tables[table_names.index(resume_point.get(pkeys.TABLE())):]
+        deleted_entities = []
+        continuation_token = None
+        for table in tables:
+            continuation_token = None
+            if resume_point is not None and resume_point.get(pkeys.TABLE()) == table.table_name:
+                continuation_token = { "PartitionKey": resume_point.get(pkeys.NEXT_PARTITION_KEY()), "RowKey": resume_point.get(pkeys.NEXT_ROW_KEY()) }
+            pages = table.query_entities(
+                query_filter,
+                select=[ "PartitionKey", "RowKey", "log_timestamp" ],
+                results_per_page=min(max_rows, table_batch_consts.MAX_TRANSACTION_OPERATIONS())
+            ).by_page(continuation_token=continuation_token)
+            batch = TableWriteBatch(table_client=table)
+            continuation_token = None
+            for page in pages:
+                for entity in page:
+                    batch.delete(partition_key=entity.get("PartitionKey"), row_key=entity.get("RowKey"))
+                    deleted_entities.append(entity)
+                batch.flush()
+                if len(deleted_entities) >= max_rows or unix_timestamp_ms() - start_time >= max_ms:
+                    continuation_token = pages.continuation_token
+                    break
+            if continuation_token is not None:
+                break
+            if len(deleted_entities) >= max_rows or unix_timestamp_ms() - start_time >= max_ms:
+                ### stopped exactly at the end of this table - the next purge starts over, which finds nothing here
+                break
+        if continuation_token is not None or resume_point is not None:
+            self._save_purge_resume_point(table=table, continuation_token=continuation_token)
+        if continuation_token is not None:
+            logging.info(f"purge stopped after {len(deleted_entities)} entries in {unix_timestamp_ms() - start_time}ms, resuming on the next purge")
+        purged_anchors = LedgerAnchors(table_client=self.table_client).purge_old_anchors(before_timestamp=age)
+        logging.info(f"purged {purged_anchors} ledger anchors older than {age}")
         return deleted_entities
+
+    def _save_purge_resume_point(self, table:TableClient, continuation_token:dict) -> None:
+        if continuation_token is None:
+            try:
+                self.table_client.delete_entity(partition_key=consts.CHAIN_PARTITION_KEY(), row_key=consts.PURGE_ROW_KEY())
+            except ResourceNotFoundError:
+                pass
+            return
+        self.table_client.upsert_entity(entity={
+            "PartitionKey": consts.CHAIN_PARTITION_KEY(),
+            "RowKey": consts.PURGE_ROW_KEY(),
+            pkeys.TABLE(): table.table_name,
+            pkeys.NEXT_PARTITION_KEY(): continuation_token.get("PartitionKey"),
+            pkeys.NEXT_ROW_KEY(): continuation_token.get("RowKey")
+        }, mode=UpdateMode.REPLACE)
+
+    def anchor(self) -> int:
+        """ writes the Merkle anchors of every closed interval not anchored yet, see LedgerAnchors """
+        retention_start = unix_timestamp_secs() - util_consts.ONE_DAY_IN_SECS(days=cfg.ENTRY_RETENTION_DAYS())
+        return LedgerAnchors(table_client=self.table_client, buckets=self.buckets).anchor(from_timestamp=retention_start)
+
+    def verify_range(self, from_timestamp:float, to_timestamp:float) -> list[int]:
+        """ checks [from_timestamp, to_timestamp) against its Merkle anchors only, see LedgerAnchors.verify_range """
+        retention_start = unix_timestamp_secs() - util_consts.ONE_DAY_IN_SECS(days=cfg.ENTRY_RETENTION_DAYS())
+        return LedgerAnchors(table_client=self.table_client, buckets=self.buckets).verify_range(
+            from_timestamp=from_timestamp, 
+            to_timestamp=to_timestamp, 
+            retained_from=retention_start
+        )
     
     def get_entries(self, name:str, from_timestamp:int, to_timestamp:int = unix_timestamp_secs(), include_tests:bool=True, filters:dict = {}) -> list[Entry]:
         if from_timestamp is None:
@@ -187,71 +796,228 @@ class TableLedger(Ledger):
             if not name.isalnum():
                 raise ValueError("name must be alphanumeric")
             query_filter = f"{query_filter} and name eq '{name}'"
+        if cfg.FILTER_PUSHDOWN():
+            for predicate in self._filter_predicates(filters=filters):
+                query_filter = f"{query_filter} and {predicate}"
         logging.info(f"ledger query: {query_filter}")
-        entites = self.table_client.query_entities(query_filter)
-        results = [self._entry_from_entity(raw_entity=entity) for entity in list(entites)]
+        ### buckets are by log_timestamp, which trails the entry timestamp by at most the time it took to report it
+        entites = self.buckets.query(
+            query_filter, 
+            from_timestamp=from_timestamp - util_consts.ONE_DAY_IN_SECS(), 
+            to_timestamp=to_timestamp + util_consts.ONE_DAY_IN_SECS(), 
+            sort_key="timestamp",
+            select=_ENTRY_COLUMNS
+        )
+        results = [self._entry_from_entity(raw_entity=entity) for entity in entites]
         results = self._apply_filters(entries=results, filters=filters)
         results.sort(key=lambda x: x.timestamp, reverse=False)
         return results
     
+    def entities_between(self, from_log_timestamp:float, to_log_timestamp:float) -> list[dict]:
+        """ the raw entry entities logged within (from_log_timestamp, to_log_timestamp], by log_timestamp - for replicas """
+        return self.buckets.query(
+            f"log_timestamp gt {from_log_timestamp} and log_timestamp le {to_log_timestamp}", 
+            from_timestamp=from_log_timestamp, 
+            to_timestamp=to_log_timestamp
+        )
+
+    def recomputed_at(self) -> float:
+        """ when recompute_ledger last finished, None if it never did - for replicas """
+        marker = self._read_chain_entity(row_key=consts.RECOMPUTED_ROW_KEY())
+        return None if marker is None else marker.get(hkeys.RECOMPUTED_AT())
+
+    def _filter_predicates(self, filters:dict) -> list[str]:
+        """ OData predicates for the filters on promoted properties - the rest are left to _apply_filters """
+        return [ f"{property_name} eq {_odata_literal(value)}" for property_name, value in filter_conditions(filters=filters) ]
+
+    def rebuild_rollups(self) -> int:
+        """ rebuilds the rollups from every retained entry, returns the rollup rows written """
+        if self.rollups is None:
+            raise ValueError("the ledger has no rollups")
+        now = unix_timestamp_secs()
+        entries = self.get_entries(
+            name=None, 
+            from_timestamp=now - util_consts.ONE_DAY_IN_SECS(days=cfg.ENTRY_RETENTION_DAYS()), 
+            to_timestamp=now
+        )
+        return self.rollups.rebuild(entries=entries)
+
+    def backfill_filter_properties(self) -> int:
+        """ promotes the filter properties of entries logged before they existed, returns how many were updated """
+        updated = 0
+        for table in self.buckets.all_tables():
+            for entity in table.list_entities():
+                if self._is_chain_entity(entity=entity):
+                    continue
+                if any([ property_name in entity for property_name in _FILTER_PROPERTIES.values() ]):
+                    continue
+                properties = TableLedger.filter_properties(data=decode_payload(properties=entity))
+                if len(properties) == 0:
+                    continue
+                table.update_entity(entity={ "PartitionKey": entity.get("PartitionKey"), "RowKey": entity.get("RowKey"), **properties }, mode=UpdateMode.MERGE)
+                updated += 1
+        logging.info(f"promoted the filter properties of {updated} ledger entries")
+        return updated
+
     def _apply_filters(self, entries:list[Entry], filters:dict) -> list[Entry]:
-        new_entries = []
-        for entry in entries:
-            if self._apply_filter(entry_data=entry.data, filters=filters):
-                new_entries.append(entry)
-        return new_entries
-    
-    def _apply_filter(self, entry_data:dict, filters:dict) -> bool:
-        for filter_property, filter_value in filters.items():
-            if filter_property in entry_data:
-                if isinstance(filter_value, dict):
-                    if not self._apply_filter(entry_data=entry_data[filter_property], filters=filter_value):
-                        return False
-                else:
-                    if entry_data[filter_property] != filter_value:
-                        return False
-        return True
+        return apply_filters(entries=entries, filters=filters)
     
     def _patch_missing_strategy(self, entry_data:dict) -> bool:
-        if not isinstance(entry_data["data"], str):
+        if not isinstance(entry_data.get("data"), str):
             logging.error("expected string")
             return False
-        data_dict = json.loads(entry_data["data"])
+        data_dict = decode_payload(properties=entry_data)
         if not isinstance(data_dict, dict):
             logging.error("expected dict")
             return False
         if "strategy" not in data_dict["merchant_params"]:
             logging.warning(f"found missing strategy for entry: {data_dict}")
             data_dict["merchant_params"]["strategy"] = OrderStrategies.TRAILING_STOP.value
-            entry_data["data"] = json.dumps(data_dict)
+            ### entities are merged - a compressed payload left behind would shadow the patched one
+            if entry_data.get("data_z") is not None:
+                entry_data["data_z"] = b""
+            entry_data.update(encode_payload(data=data_dict))
             return True
         return False
     
-    def recompute_ledger(self) -> None:
-        logging.warning("recomputing ledger - all entries will have hash signatures recalculated")
+    def _claim_recomputed_head(self, checkpoint:dict) -> None:
+        """ points the head at the last recomputed entry, LedgerConflictError if it moved since it was last read """
+        if checkpoint.get(hkeys.ROW_KEY()) is None:
+            return
+        head = { key: value for key, value in checkpoint.items() if key != hkeys.RECOMPUTE_CURSOR() }
+        head["RowKey"] = consts.HEAD_ROW_KEY()
+        self._head_etag = self._claim_head(new_head=head)
+
+    def recompute_ledger(self) -> bool:
+        """ Re-signs every retained entry in log_timestamp order, one TABLE_LEDGER_RECOMPUTE_WINDOW_SECS window at a 
+        time - only the previous entry is carried between windows. Changed entries are written back as per-partition 
+        transactions to the table they were read from. Progress is checkpointed (PartitionKey __chain__, RowKey 
+        recompute) after every window and the call returns once TABLE_LEDGER_RECOMPUTE_MAX_MS has passed, so a large 
+        ledger takes several calls. Entries logged before the retention period are left to purge_old_logs. 
+        The head is only moved if no log() moved it since the last window was read - otherwise that window is redone
+        with the entries logged meanwhile. Returns True once the whole ledger is recomputed. """
         start_time = unix_timestamp_ms()
-        entities = self.table_client.list_entities()
-        entities = list(entities)
-        entities.sort(key=lambda x: x.get("log_timestamp"), reverse=False)
+        max_ms = cfg.RECOMPUTE_MAX_MS()
+        window_secs = cfg.RECOMPUTE_WINDOW_SECS()
+        checkpoint = self._read_chain_entity(row_key=consts.RECOMPUTE_ROW_KEY())
+        if checkpoint is None:
+            logging.warning("recomputing ledger - all entries will have hash signatures recalculated")
+            cursor = unix_timestamp_secs() - util_consts.ONE_DAY_IN_SECS(days=cfg.ENTRY_RETENTION_DAYS())
+            prev_entry = None
+        else:
+            cursor = checkpoint.get(hkeys.RECOMPUTE_CURSOR())
+            prev_entry = self._entry_from_head(head=checkpoint) if checkpoint.get(hkeys.ROW_KEY()) is not None else None
+            logging.info(f"resuming the ledger recompute from log_timestamp {cursor}")
         signer = HashSigner()
-        prev_entity = None
-        for entity in entities:
-            entry = self._entry_from_entity(raw_entity=entity)
-            prev_entry = self._entry_from_entity(raw_entity=prev_entity) if prev_entity is not None else None
-            signature = signer.sign(new_entry=entry, prev_entry=prev_entry)
-            if entity.get("hash") != signature or self._patch_missing_strategy(entry_data=entity):
-                logging.warning(f"entry {entry.name} hash mismatch, recomputing...")
-                entity["hash"] = signature
-                self.table_client.update_entity(entity=entity)
-            prev_entity = entity
-        logging.info(f"ledger recomputed in {unix_timestamp_ms() - start_time}ms")
+        recomputed = 0
+        while True:
+            window_start = (cursor, prev_entry, None if checkpoint is None else dict(checkpoint))
+            ### read before the window - a log() that moves the head after this makes the final claim fail
+            head = self._read_head()
+            self._head_etag = None if head is None else head.metadata.get("etag")
+            now = unix_timestamp_secs_dec()
+            window_end = min(cursor + window_secs, now)
+            tagged_entities = [
+                (table, entity) for table, entity in self.buckets.query_by_table(
+                    f"log_timestamp gt {cursor} and log_timestamp le {window_end}",
+                    from_timestamp=cursor,
+                    to_timestamp=window_end
+                ) if not self._is_chain_entity(entity=entity)
+            ]
+            entries = [ self._entry_from_entity(raw_entity=entity) for _, entity in tagged_entities ]
+            ### the chain is intact up to the first mismatch - found in parallel, only the rest is re-signed in order
+            mismatches = verify_chain(entries=entries, signer=signer, prev_entry=prev_entry)
+            first_mismatch = mismatches[0] if len(mismatches) != 0 else len(entries)
+            batches:dict[str, TableWriteBatch] = {}
+            for i, (table, entity) in enumerate(tagged_entities):
+                entry = entries[i]
+                changed = self._patch_missing_strategy(entry_data=entity)
+                if i >= first_mismatch:
+                    signature = signer.sign(new_entry=entry, prev_entry=prev_entry)
+                    if entity.get("hash") != signature:
+                        logging.warning(f"entry {entry.name} hash mismatch, recomputing...")
+                        entity["hash"] = signature
+                        entry.hash = signature
+                        changed = True
+                if changed:
+                    if table.table_name not in batches:
+                        batches[table.table_name] = TableWriteBatch(table_client=table)
+                    batches[table.table_name].update(entity=entity)
+                    recomputed += 1
+                prev_entry = entry
+            for batch in batches.values():
+                batch.flush()
+            if len(tagged_entities) != 0:
+                checkpoint = self._head_from_entity(entity=tagged_entities[-1][1], row_key=consts.RECOMPUTE_ROW_KEY())
+            elif checkpoint is None:
+                checkpoint = { "PartitionKey": consts.CHAIN_PARTITION_KEY(), "RowKey": consts.RECOMPUTE_ROW_KEY() }
+            checkpoint[hkeys.RECOMPUTE_CURSOR()] = window_end
+            cursor = window_end
+            if window_end >= now:
+                try:
+                    self._claim_recomputed_head(checkpoint=checkpoint)
+                    break
+                except LedgerConflictError:
+                    ### entries logged meanwhile were signed onto the old hashes - redo the window to re-sign them too
+                    logging.warning(f"the ledger was appended to during the recompute, redoing the window from log_timestamp {window_start[0]}")
+                    cursor, prev_entry, checkpoint = window_start
+                    if checkpoint is None:
+                        checkpoint = { "PartitionKey": consts.CHAIN_PARTITION_KEY(), "RowKey": consts.RECOMPUTE_ROW_KEY() }
+                    checkpoint[hkeys.RECOMPUTE_CURSOR()] = cursor
+            if unix_timestamp_ms() - start_time >= max_ms:
+                self.table_client.upsert_entity(entity=checkpoint, mode=UpdateMode.REPLACE)
+                logging.info(f"ledger recompute stopped at log_timestamp {cursor} after {recomputed} changed entries in {unix_timestamp_ms() - start_time}ms, resuming on the next call")
+                return False
+        ### every hash may have changed, the next verification starts over
+        for row_key in [ consts.VERIFIED_ROW_KEY(), consts.RECOMPUTE_ROW_KEY() ]:
+            try:
+                self.table_client.delete_entity(partition_key=consts.CHAIN_PARTITION_KEY(), row_key=row_key)
+            except ResourceNotFoundError:
+                pass
+        LedgerAnchors(table_client=self.table_client).reset()
+        ### replicas copy every entry again once they see this moved
+        self.table_client.upsert_entity(entity={
+            "PartitionKey": consts.CHAIN_PARTITION_KEY(),
+            "RowKey": consts.RECOMPUTED_ROW_KEY(),
+            hkeys.RECOMPUTED_AT(): unix_timestamp_secs_dec()
+        }, mode=UpdateMode.REPLACE)
+        logging.info(f"ledger recomputed with {recomputed} changed entries in {unix_timestamp_ms() - start_time}ms")
+        return True
 
 if __name__ == "__main__":
     import unittest
 
+    def _chain_table_client(chain:dict) -> unittest.mock.Mock:
+        """ a table client keeping the chain entities in chain, with etags """
+        from azure.data.tables import TableEntity
+        table_client = unittest.mock.Mock(table_name="ledger")
+        def store(entity, **kwargs):
+            stored = TableEntity(**entity)
+            stored._metadata = { "etag": str(uuid.uuid4()) }
+            chain[entity.get("RowKey")] = stored
+            return { "etag": stored.metadata.get("etag") }
+        def get_entity(partition_key, row_key):
+            if row_key not in chain:
+                raise ResourceNotFoundError("not found")
+            return chain[row_key]
+        def create_entity(entity):
+            if entity.get("RowKey") in chain:
+                raise ResourceExistsError("exists")
+            return store(entity=entity)
+        def update_entity(entity, mode, etag, match_condition):
+            if chain.get(entity.get("RowKey")) is None or chain[entity.get("RowKey")].metadata.get("etag") != etag:
+                raise ResourceModifiedError("modified")
+            return store(entity=entity)
+        table_client.get_entity.side_effect = get_entity
+        table_client.upsert_entity.side_effect = store
+        table_client.create_entity.side_effect = create_entity
+        table_client.update_entity.side_effect = update_entity
+        return table_client
+
     class TestLedger(unittest.TestCase):
         def test_verify_integity_no_enttries(self):
             mock_table_client = unittest.mock.Mock()
+            mock_table_client.get_entity.side_effect = ResourceNotFoundError("no checkpoint")
             mock_table_client.query_entities.return_value = []
             l = TableLedger(table_client=mock_table_client)
             result = l.verify_integrity(signer=HashSigner())
@@ -260,6 +1026,7 @@ if __name__ == "__main__":
         def test_verify_integity_with_entries(self):
             hash_signer = HashSigner()
             mock_table_client = unittest.mock.Mock()
+            mock_table_client.get_entity.side_effect = ResourceNotFoundError("no checkpoint")
             l = TableLedger(table_client=mock_table_client)
             
             result_1 = {
@@ -293,6 +1060,194 @@ if __name__ == "__main__":
             result = l.verify_integrity(signer=hash_signer)
             assert len(result) == 0
 
+        def test_verify_integrity_from_checkpoint(self):
+            hash_signer = HashSigner()
+            checkpoint_entry = Entry(name="test", amount=1.0, hash="checkpoint", timestamp=unix_timestamp_secs(), test=True)
+            checkpoint = {
+                hkeys.LOG_TIMESTAMP(): 1.0,
+                hkeys.NAME(): checkpoint_entry.name,
+                hkeys.AMOUNT(): checkpoint_entry.amount,
+                hkeys.HASH(): checkpoint_entry.hash,
+                hkeys.TIMESTAMP(): checkpoint_entry.timestamp,
+                hkeys.TEST(): True,
+                hkeys.DATA(): "{}",
+                hkeys.PROBLEM_COUNT(): 0
+            }
+            next_entity = {
+                "name": "test2",
+                "amount": 2.0,
+                "timestamp": unix_timestamp_secs(),
+                "log_timestamp": 2.0,
+                "hash": "wrong",
+                "test": True,
+                "data": "{}"
+            }
+            mock_table_client = unittest.mock.Mock()
+            mock_table_client.get_entity.return_value = checkpoint
+            mock_table_client.query_entities.return_value = [ next_entity ]
+            l = TableLedger(table_client=mock_table_client)
+            ### the first entry after the checkpoint is verified too
+            self.assertEqual(len(l.verify_integrity(signer=hash_signer)), 1)
+            next_entity["hash"] = hash_signer.sign(new_entry=l._entry_from_entity(next_entity), prev_entry=checkpoint_entry)
+            self.assertEqual(len(l.verify_integrity(signer=hash_signer)), 0)
+            self.assertIn("log_timestamp gt 1.0", mock_table_client.query_entities.call_args.args[0])
+            saved_checkpoint = mock_table_client.upsert_entity.call_args.kwargs.get("entity")
+            self.assertEqual(saved_checkpoint.get(hkeys.LOG_TIMESTAMP()), 2.0)
+
+        def test_log_conflicts_when_head_moved(self):
+            mock_table_client = unittest.mock.Mock()
+            mock_table_client.get_entity.side_effect = ResourceNotFoundError("no head")
+            mock_table_client.query_entities.return_value = []
+            l = TableLedger(table_client=mock_table_client)
+            self.assertIsNone(l.get_latest_entry())
+            mock_table_client.create_entity.side_effect = ResourceExistsError("head exists")
+            entry = Entry(name="test", amount=1.0, hash="hash", timestamp=unix_timestamp_secs(), data={
+                "merchant_params": { "high_interval": "60", "low_interval": "5", "version": 1 }
+            })
+            with self.assertRaises(LedgerConflictError):
+                l.log(entry=entry)
+            ### only the head was attempted, the entry itself was never written
+            self.assertEqual(mock_table_client.create_entity.call_count, 1)
+
+        def test_verify_integrity_repairs_orphaned_head(self):
+            ### the process crashed after claiming the head for the entry "lost", before writing it
+            now = unix_timestamp_secs()
+            chain = {}
+            table_client = _chain_table_client(chain=chain)
+            latest_entity = { "PartitionKey": "flowmerchant-60-5-1", "RowKey": "written", "name": "test", "amount": 1.0, "timestamp": now - 120, "log_timestamp": now - 120.0, "hash": "h", "test": True, "data": "{}" }
+            l = TableLedger(table_client=table_client)
+            table_client.upsert_entity(entity=l._head_from_entity(entity=dict(latest_entity, RowKey="lost", log_timestamp=now - 100.0)))
+            table_client.query_entities.return_value = [ latest_entity ]
+            l.verify_integrity(signer=HashSigner())
+            self.assertEqual(chain[consts.HEAD_ROW_KEY()].get(hkeys.ROW_KEY()), "written")
+            ### a head still within the settle window is left alone
+            table_client.upsert_entity(entity=l._head_from_entity(entity=dict(latest_entity, RowKey="in-flight", log_timestamp=float(now))))
+            l.verify_integrity(signer=HashSigner())
+            self.assertEqual(chain[consts.HEAD_ROW_KEY()].get(hkeys.ROW_KEY()), "in-flight")
+
+        def test_log_many_chains_in_memory(self):
+            mock_table_client = unittest.mock.Mock()
+            mock_table_client.get_entity.side_effect = ResourceNotFoundError("no head")
+            mock_table_client.query_entities.return_value = []
+            mock_table_client.create_entity.return_value = { "etag": "1" }
+            l = TableLedger(table_client=mock_table_client)
+            signer = HashSigner()
+            entries = [ 
+                Entry(name=f"test{i}", amount=float(i), hash=None, timestamp=unix_timestamp_secs(), data={
+                    "merchant_params": { "high_interval": str(i % 2), "low_interval": "5", "version": 1 }
+                }) for i in range(3) 
+            ]
+            l.log_many(entries=entries, signer=signer)
+            self.assertEqual(mock_table_client.submit_transaction.call_count, 2)
+            self.assertEqual(entries[0].hash, signer.sign(new_entry=entries[0], prev_entry=None))
+            self.assertEqual(entries[2].hash, signer.sign(new_entry=entries[2], prev_entry=entries[1]))
+
+        def test_purge_stops_at_row_budget(self):
+            class Pages(list):
+                continuation_token = None
+            pages = Pages([ [ { "PartitionKey": "p", "RowKey": f"{page}-{row}" } for row in range(2) ] for page in range(3) ])
+            pages.continuation_token = { "PartitionKey": "p", "RowKey": "next" }
+            mock_table_client = unittest.mock.Mock()
+            mock_table_client.get_entity.side_effect = ResourceNotFoundError("no resume point")
+            mock_table_client.query_entities.return_value.by_page.return_value = pages
+            l = TableLedger(table_client=mock_table_client)
+            with unittest.mock.patch.dict(os.environ, { "TABLE_LEDGER_PURGE_MAX_ROWS": "3" }), unittest.mock.patch.object(LedgerAnchors, "purge_old_anchors", return_value=0):
+                purged = l.purge_old_logs()
+            ### whole pages are deleted, the budget is checked between them
+            self.assertEqual(len(purged), 4)
+            self.assertEqual(mock_table_client.submit_transaction.call_count, 2)
+            resume_point = mock_table_client.upsert_entity.call_args_list[0].kwargs.get("entity")
+            self.assertEqual(resume_point.get(pkeys.NEXT_ROW_KEY()), "next")
+
+        def test_recompute_resumes_from_checkpoint(self):
+            signer = HashSigner()
+            _entry = lambda entity: TableLedger(table_client=unittest.mock.Mock())._entry_from_entity(raw_entity=entity)
+            now = unix_timestamp_secs()
+            entities = []
+            prev_entry = None
+            for days_ago in [ 3, 2, 1 ]:
+                entity = {
+                    "PartitionKey": "flowmerchant-60-5-1", "RowKey": f"r{days_ago}", "name": "BTCUSDT", "amount": float(days_ago),
+                    "timestamp": now - days_ago * 86400, "log_timestamp": float(now - days_ago * 86400), "test": True,
+                    "hash": None, "data": json.dumps({ "merchant_params": { "strategy": "BRACKET" } })
+                }
+                entity["hash"] = signer.sign(new_entry=_entry(entity), prev_entry=prev_entry)
+                prev_entry = _entry(entity)
+                entities.append(entity)
+            entities[1]["amount"] = 5.0
+            chain = {}
+            mock_table_client = _chain_table_client(chain=chain)
+            l = TableLedger(table_client=mock_table_client)
+            l.buckets.query_by_table = lambda query_filter, from_timestamp, to_timestamp: [
+                (mock_table_client, dict(entity)) for entity in entities if from_timestamp < entity.get("log_timestamp") <= to_timestamp
+            ]
+            with unittest.mock.patch.dict(os.environ, { "TABLE_LEDGER_RECOMPUTE_WINDOW_SECS": "86400" }), \
+                unittest.mock.patch.object(cfg, "RECOMPUTE_MAX_MS", return_value=0), \
+                unittest.mock.patch.object(LedgerAnchors, "reset"):
+                calls = 1
+                while not l.recompute_ledger():
+                    self.assertIn(consts.RECOMPUTE_ROW_KEY(), chain)
+                    calls += 1
+            self.assertGreater(calls, 2)
+            updated = [ op[1] for call in mock_table_client.submit_transaction.call_args_list for op in call.args[0] ]
+            ### the changed entry and the one signed onto it
+            self.assertEqual([ entity.get("RowKey") for entity in updated ], [ "r2", "r1" ])
+            self.assertEqual(updated[0]["hash"], signer.sign(new_entry=_entry(entities[1]), prev_entry=_entry(entities[0])))
+            self.assertEqual(chain[consts.HEAD_ROW_KEY()][hkeys.ROW_KEY()], "r1")
+            self.assertEqual(chain[consts.HEAD_ROW_KEY()][hkeys.HASH()], updated[1]["hash"])
+            mock_table_client.delete_entity.assert_any_call(partition_key=consts.CHAIN_PARTITION_KEY(), row_key=consts.RECOMPUTE_ROW_KEY())
+
+        def test_recompute_redoes_window_appended_to(self):
+            signer = HashSigner()
+            _entry = lambda entity: TableLedger(table_client=unittest.mock.Mock())._entry_from_entity(raw_entity=entity)
+            _entity = lambda row_key, log_timestamp: {
+                "PartitionKey": "flowmerchant-60-5-1", "RowKey": row_key, "name": "BTCUSDT", "amount": 1.0,
+                "timestamp": int(log_timestamp), "log_timestamp": log_timestamp, "test": True, "hash": "stale",
+                "data": json.dumps({ "merchant_params": { "strategy": "BRACKET" } })
+            }
+            entities = [ _entity("r1", unix_timestamp_secs_dec() - 60) ]
+            chain = {}
+            mock_table_client = _chain_table_client(chain=chain)
+            claim = mock_table_client.create_entity.side_effect
+            def concurrent_log(entity):
+                ### a log() claims the head between the recompute reading the window and claiming it
+                mock_table_client.create_entity.side_effect = claim
+                entities.append(_entity("r2", unix_timestamp_secs_dec()))
+                claim(entity=dict(entities[-1], PartitionKey=consts.CHAIN_PARTITION_KEY(), RowKey=consts.HEAD_ROW_KEY()))
+                raise ResourceExistsError("head claimed")
+            mock_table_client.create_entity.side_effect = concurrent_log
+            l = TableLedger(table_client=mock_table_client)
+            l.buckets.query_by_table = lambda query_filter, from_timestamp, to_timestamp: [
+                (mock_table_client, dict(entity)) for entity in entities if from_timestamp < entity.get("log_timestamp") <= to_timestamp
+            ]
+            with unittest.mock.patch.object(LedgerAnchors, "reset"):
+                self.assertTrue(l.recompute_ledger())
+            self.assertEqual(chain[consts.HEAD_ROW_KEY()][hkeys.ROW_KEY()], "r2")
+            first = signer.sign(new_entry=_entry(dict(entities[0], hash=None)), prev_entry=None)
+            second = signer.sign(new_entry=_entry(entities[1]), prev_entry=_entry(dict(entities[0], hash=first)))
+            self.assertEqual(chain[consts.HEAD_ROW_KEY()][hkeys.HASH()], second)
+
+        def test_filter_pushdown(self):
+            data = {
+                "ticker": "BTCUSDT",
+                "merchant_params": { "high_interval": "60", "stoploss_percent": 1.0 },
+                "metadata": { "is_dry_run": True, "tags": [ "a" ] }
+            }
+            self.assertEqual(TableLedger.filter_properties(data=data), {
+                fkeys.TICKER(): "BTCUSDT",
+                fkeys.HIGH_INTERVAL(): "60",
+                fkeys.STOPLOSS_PERCENT(): 1.0,
+                fkeys.TAGS(): '["a"]',
+                fkeys.DRY_RUN(): True
+            })
+            l = TableLedger(table_client=unittest.mock.Mock())
+            predicates = l._filter_predicates(filters={
+                "name": None,
+                "merchant_params": { "high_interval": "6'0", "stoploss_percent": 1.0, "notes": "x" },
+                "metadata": { "tags": [ "a" ] }
+            })
+            self.assertEqual(predicates, [ "high_interval eq '6''0'", "stoploss_percent eq 1.0" ])
+
         def test_apply_filters(self):
             entries = [
                 Entry(
@@ -0,0 +1,152 @@
+from merchant_keys import keys
+
+import bisect
+import threading
+
+def trigger_levels(order_dict:dict) -> tuple[float, float]:
+    """ reads (stop loss, take profit) straight from a stored order without building an Order """
+    sub_orders = order_dict.get("sub_orders")
+    return (
+        float(sub_orders.get("stop_loss").get("price")),
+        float(sub_orders.get("take_profit").get("price"))
+    )
+
+def order_key(order_dict:dict) -> str:
+    return order_dict.get("metadata").get("id")
+
+class TriggerIndex:
+    """ Stop loss and take profit trigger prices of every open order of one ticker, kept sorted so
+    the orders whose thresholds were crossed by a price are found in O(log n + k).
+    Entries are grouped by position (merchant entity) and each position is re-synced incrementally
+    whenever its stored orders change. """
+
+    def __init__(self):
+        self._stop_losses:list[tuple[float, int]] = []
+        self._take_profits:list[tuple[float, int]] = []
+        self._entries:dict[int, tuple] = {}
+        self._entry_ids:dict[tuple, int] = {}
+        self._positions:dict[tuple, set] = {}
+        self._fingerprints:dict[tuple, int] = {}
+        self._next_entry_id = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def sync_position(self, position_key:tuple, fingerprint:str, order_list:list[dict]) -> None:
+        """ fingerprint identifies the stored version of the position's orders, an unchanged fingerprint skips
+        the sync. None always syncs and never matches later """
+        with self._lock:
+            if fingerprint is not None:
+                fingerprint = hash(fingerprint)
+                if self._fingerprints.get(position_key) == fingerprint:
+                    return
+            stale_keys = set(self._positions.get(position_key, set()))
+            for order_dict in order_list:
+                key = (position_key, order_key(order_dict))
+                stop_loss, take_profit = trigger_levels(order_dict)
+                stale_keys.discard(key)
+                if key in self._entry_ids:
+                    _, current_stop_loss, current_take_profit = self._entries.get(self._entry_ids.get(key))
+                    if current_stop_loss == stop_loss and current_take_profit == take_profit:
+                        continue
+                    self._remove(key=key)
+                self._add(key=key, stop_loss=stop_loss, take_profit=take_profit)
+            for key in stale_keys:
+                self._remove(key=key)
+            self._fingerprints[position_key] = fingerprint
+
+    def retain_positions(self, position_keys:list[tuple]) -> None:
+        with self._lock:
+            retained = set(position_keys)
+            for position_key in list(self._positions.keys()):
+                if position_key not in retained:
+                    for key in list(self._positions.get(position_key)):
+                        self._remove(key=key)
+                    self._positions.pop(position_key, None)
+                    self._fingerprints.pop(position_key, None)
+
+    def crossed(self, current_price:float) -> set[tuple]:
+        """ keys (position key, order id) of orders whose stop loss or take profit was reached """
+        with self._lock:
+            ### stop loss is hit when current_price <= stop loss
+            stop_start = bisect.bisect_left(self._stop_losses, (current_price, -1))
+            ### take profit is hit when current_price >= take profit
+            profit_end = bisect.bisect_right(self._take_profits, (current_price, self._next_entry_id))
+            entry_ids = [ entry_id for _, entry_id in self._stop_losses[stop_start:] ]
+            entry_ids.extend([ entry_id for _, entry_id in self._take_profits[:profit_end] ])
+            return set([ self._entries.get(entry_id)[0] for entry_id in entry_ids ])
+
+    def _add(self, key:tuple, stop_loss:float, take_profit:float) -> None:
+        entry_id = self._next_entry_id
+        self._next_entry_id += 1
+        self._entries[entry_id] = (key, stop_loss, take_profit)
+        self._entry_ids[key] = entry_id
+        position_key, _ = key
+        if position_key not in self._positions:
+            self._positions[position_key] = set()
+        self._positions[position_key].add(key)
+        bisect.insort(self._stop_losses, (stop_loss, entry_id))
+        bisect.insort(self._take_profits, (take_profit, entry_id))
+
+    def _remove(self, key:tuple) -> None:
+        entry_id = self._entry_ids.pop(key, None)
+        if entry_id is None:
+            return
+        _, stop_loss, take_profit = self._entries.pop(entry_id)
+        self._positions.get(key[0]).discard(key)
+        del self._stop_losses[bisect.bisect_left(self._stop_losses, (stop_loss, entry_id))]
+        del self._take_profits[bisect.bisect_left(self._take_profits, (take_profit, entry_id))]
+
+class TriggerIndexes:
+    """ one TriggerIndex per ticker, kept for the lifetime of the process so unchanged positions are not re-read """
+    def __init__(self):
+        self._indexes:dict[str, TriggerIndex] = {}
+        self._lock = threading.Lock()
+
+    def for_ticker(self, ticker:str) -> TriggerIndex:
+        with self._lock:
+            if ticker not in self._indexes:
+                self._indexes[ticker] = TriggerIndex()
+            return self._indexes.get(ticker)
+
+def position_key(position:dict) -> tuple:
+    return (position.get(keys.PARTITIONKEY()), position.get(keys.ROWKEY()))
+
+if __name__ == "__main__":
+    import json
+    import unittest
+
+    def _order(id:str, stop_loss:float, take_profit:float) -> dict:
+        return {
+            "metadata": { "id": id },
+            "sub_orders": {
+                "stop_loss": { "price": stop_loss },
+                "take_profit": { "price": take_profit }
+            }
+        }
+
+    class Test(unittest.TestCase):
+        def test_crossed(self):
+            index = TriggerIndex()
+            orders = [ _order("a", 9.0, 11.0), _order("b", 8.0, 12.0), _order("c", 10.3, 10.5) ]
+            index.sync_position(("p", "r"), json.dumps(orders), orders)
+            self.assertEqual(index.crossed(10.2), set([ (("p", "r"), "c") ]))
+            self.assertEqual(index.crossed(10.4), set())
+            self.assertEqual(index.crossed(11.0), set([ (("p", "r"), "a"), (("p", "r"), "c") ]))
+            self.assertEqual(index.crossed(8.0), set([ (("p", "r"), "a"), (("p", "r"), "b"), (("p", "r"), "c") ]))
+
+        def test_incremental_sync(self):
+            index = TriggerIndex()
+            orders = [ _order("a", 9.0, 11.0), _order("b", 8.0, 12.0) ]
+            index.sync_position(("p", "r"), json.dumps(orders), orders)
+            ### a trailed, b removed, c added
+            orders = [ _order("a", 10.5, 12.5), _order("c", 5.0, 6.0) ]
+            index.sync_position(("p", "r"), json.dumps(orders), orders)
+            self.assertEqual(len(index), 2)
+            self.assertEqual(index.crossed(5.5), set([ (("p", "r"), "a") ]))
+            self.assertEqual(index.crossed(10.0), set([ (("p", "r"), "a"), (("p", "r"), "c") ]))
+            index.retain_positions([])
+            self.assertEqual(len(index), 0)
+
+    unittest.main()